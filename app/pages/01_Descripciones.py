@@ -1,7 +1,6 @@
 import streamlit as st
 from io import BytesIO, StringIO
-from PIL import Image
-from services.llm_gemini import generate_product_description_gemini
+from services.llm_gemini import stream_product_description_gemini, generate_multichannel_descriptions_gemini
 import csv, re
 
 st.title("Generación de descripciones (Gemini)")
@@ -38,11 +37,22 @@ CHANNEL_DESC = {
 }
 st.caption(CHANNEL_DESC[channel])
 
+multi = st.checkbox(
+    "Generar varios canales en una sola llamada",
+    value=False,
+    help="Pide todos los canales elegidos en un único request (el prompt y las imágenes se envían una sola vez)."
+)
+channels_multi = []
+if multi:
+    channels_multi = [CHANNEL_MAP[c] for c in st.multiselect(
+        "Canales a generar", list(CHANNEL_MAP.keys()), default=list(CHANNEL_MAP.keys())
+    )]
+
 images = st.file_uploader(
     "Imágenes del producto (opcional)",
     type=["jpg","jpeg","png"],
     accept_multiple_files=True,
-    help="Adjunta fotos reales del producto para mejorar la precisión (se convierten a JPEG automáticamente)."
+    help="Adjunta fotos reales del producto para mejorar la precisión (se reducen y convierten a JPEG automáticamente; las fotos repetidas se omiten)."
 )
 
 # Controles con ayuda para no expertos
@@ -70,9 +80,15 @@ with col2:
         )
     )
 with col3:
+    manual_tokens = st.checkbox(
+        "Fijar máx. tokens a mano",
+        value=False,
+        help="Por defecto el límite de salida se calcula según los campos y la cantidad de canales."
+    )
     max_tokens = st.slider(
-        "Máx. tokens",
+        "Máx. tokens (por canal)",
         min_value=256, max_value=2048, value=1024, step=64,
+        disabled=not manual_tokens,
         help=(
             "Longitud máxima de la salida (tokens ≈ trozos de palabra).\n"
             "1 token ≈ 3–4 caracteres aprox.\n"
@@ -80,6 +96,12 @@ with col3:
         )
     )
 
+fresh = st.checkbox(
+    "Forzar nueva variación (ignorar caché)",
+    value=False,
+    help="Las combinaciones ya generadas (mismo producto, canal, imágenes y parámetros) se reutilizan desde la caché. Marca esta opción para pedir una redacción nueva."
+)
+
 with st.expander("¿Qué config elijo? (guía rápida y significado)"):
     st.markdown(
         "**¿Qué significa cada parámetro?**\n\n"
@@ -96,19 +118,6 @@ with st.expander("¿Qué config elijo? (guía rápida y significado)"):
         "→ texto ordenado con especificaciones cuando existan."
     )
 
-def _to_jpeg_bytes(file):
-    """Convierte PNG/JPEG a bytes JPEG (en caso suban PNG, asegura compatibilidad)."""
-    data = file.read()
-    try:
-        img = Image.open(BytesIO(data))
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        bio = BytesIO()
-        img.save(bio, format="JPEG", quality=92)
-        return bio.getvalue()
-    except Exception:
-        return data
-
 def _coerce_list(value):
     """Asegura una lista de strings limpia desde list/dict/str."""
     if value is None:
@@ -174,26 +183,16 @@ def _build_docx_bytes(name, channel, short, long, bullets, hashtags):
     bio.seek(0)
     return bio
 
-if st.button("Generar", type="primary"):
-    if not name.strip():
-        st.warning("Ingresa el nombre del producto.")
-        st.stop()
-    if not attrs.strip():
-        st.warning("Agrega al menos algunos atributos.")
-        st.stop()
-
-    img_bytes = [_to_jpeg_bytes(f) for f in (images or [])]
-
-    out = generate_product_description_gemini(
-        name=name,
-        attrs_text=attrs,
-        channel=channel,
-        image_files=img_bytes,
-        temperature=temperature,
-        top_p=top_p,
-        max_tokens=int(max_tokens),
-    )
+# Secciones que se van mostrando durante el streaming (campo JSON → título)
+STREAM_SECTIONS = [
+    ("short", "Descripción corta"),
+    ("long", "Descripción larga (SEO)"),
+    ("bullets", "Bullets"),
+    ("hashtags", "Hashtags"),
+]
 
+def _render_description(out, channel):
+    """Muestra una descripción (corta, larga, bullets, hashtags) y sus descargas."""
     short = out.get("short", "").strip()
     long_ = out.get("long", "").strip()
     bullets = _coerce_list(out.get("bullets", []))
@@ -227,9 +226,10 @@ if st.button("Generar", type="primary"):
     st.download_button(
         "Descargar CSV",
         data=csv_bytes,
-        file_name=f"{slug}.csv",
+        file_name=f"{slug}-{_slugify(channel)}.csv",
         mime="text/csv",
-        use_container_width=True
+        use_container_width=True,
+        key=f"csv-{channel}"
     )
 
     # Word (.docx)
@@ -238,7 +238,71 @@ if st.button("Generar", type="primary"):
         st.download_button(
             "Descargar Word (.docx)",
             data=docx_io,
-            file_name=f"{slug}.docx",
+            file_name=f"{slug}-{_slugify(channel)}.docx",
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            use_container_width=True
+            use_container_width=True,
+            key=f"docx-{channel}"
+        )
+
+if st.button("Generar", type="primary"):
+    if not name.strip():
+        st.warning("Ingresa el nombre del producto.")
+        st.stop()
+    if not attrs.strip():
+        st.warning("Agrega al menos algunos atributos.")
+        st.stop()
+    if multi and not channels_multi:
+        st.warning("Elige al menos un canal.")
+        st.stop()
+
+    # Bytes originales: el servicio reduce, deduplica y re-codifica (services/image_prep.py)
+    img_bytes = [f.getvalue() for f in (images or [])]
+
+    if multi:
+        outs = generate_multichannel_descriptions_gemini(
+            name=name,
+            attrs_text=attrs,
+            channels=channels_multi,
+            image_files=img_bytes,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=int(max_tokens) * len(channels_multi) if manual_tokens else None,
+            use_cache=not fresh,
         )
+        for tab, ch in zip(st.tabs(channels_multi), channels_multi):
+            with tab:
+                _render_description(outs[ch], ch)
+    else:
+        # Streaming: cada sección aparece apenas su campo del JSON se completa
+        live = st.empty()
+        with live.container():
+            placeholders = {}
+            for field, title in STREAM_SECTIONS:
+                st.subheader(title)
+                placeholders[field] = st.empty()
+                placeholders[field].caption("Generando…")
+
+        out = {}
+        for field, value in stream_product_description_gemini(
+            name=name,
+            attrs_text=attrs,
+            channel=channel,
+            image_files=img_bytes,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=int(max_tokens) if manual_tokens else None,
+            use_cache=not fresh,
+        ):
+            if field == "result":
+                out = value
+            elif field in placeholders:
+                items = _coerce_list(value) if field in ("bullets", "hashtags") else None
+                if field == "bullets":
+                    placeholders[field].markdown("\n".join(f"- {b}" for b in items))
+                elif field == "hashtags":
+                    placeholders[field].write(" ".join(items))
+                else:
+                    placeholders[field].write(str(value).strip())
+
+        live.empty()
+        _render_description(out, channel)
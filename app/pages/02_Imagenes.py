@@ -1,7 +1,7 @@
 import streamlit as st
 from io import BytesIO
 from PIL import Image, UnidentifiedImageError
-from services.images_gemini import generate_promos_with_gemini_background
+from services.images_gemini import PromoShortfall, generate_promos_with_gemini_background
 
 st.set_page_config(page_title="Imágenes promocionales", page_icon="🖼️", layout="wide")
 st.title("🖼️ Generador de imágenes promocionales (Vertex AI)")
@@ -64,6 +64,17 @@ def _to_png_bytes(img_arr):
     bio.seek(0)
     return bio
 
+def _show_creatives(imgs):
+    for i, arr in enumerate(imgs, 1):
+        st.image(arr, caption=f"Creatividad {i}", use_container_width=True)
+        st.download_button(
+            label=f"Descargar PNG {i}",
+            data=_to_png_bytes(arr),
+            file_name=f"creatividad_{i}.png",
+            mime="image/png",
+            use_container_width=True
+        )
+
 st.divider()
 generate = st.button("Generar con Vertex AI", type="primary")
 
@@ -115,15 +126,10 @@ if generate:
             )
 
         st.success(f"Listo. Se generaron {len(imgs)} creatividad(es) con Vertex AI.")
-        for i, arr in enumerate(imgs, 1):
-            st.image(arr, caption=f"Creatividad {i}", use_container_width=True)
-            st.download_button(
-                label=f"Descargar PNG {i}",
-                data=_to_png_bytes(arr),
-                file_name=f"creatividad_{i}.png",
-                mime="image/png",
-                use_container_width=True
-            )
+        _show_creatives(imgs)
+    except PromoShortfall as e:
+        st.warning(f"{e}. Prueba a generar de nuevo o ajusta el prompt del fondo.")
+        _show_creatives(e.creatives)
     except Exception as e:
         st.error(f"Ocurrió un error generando con Vertex AI: {e}")
         st.info(
@@ -6,15 +6,29 @@ import json
 import re
 
 # Fallback local simple
-from services.feedback import summarize_reviews as sum_local, score_sentiment as sent_local
+from services.feedback import (
+    summarize_reviews as sum_local,
+    score_sentiment as sent_local,
+    sentiment_distribution,
+)
+from services.review_ingest import (
+    PARQUET_MISSING, detect_format, parquet_available, preview as ingest_preview, read_text_column,
+)
 
 # Gemini (si hay credenciales)
 try:
     from services.feedback_gemini import (
         summarize_reviews_gemini as sum_gem,
         score_sentiment_gemini as sent_gem,
+        estimate_sentiment_calls,
         generate_customer_reply_gemini as reply_gem,
+        extract_themes_gemini as themes_gem,
+        iter_customer_replies_gemini as bulk_replies_gem,
+        write_replies,
     )
+    from services.structured import parse_stats
+    from services.token_budget import usage_stats
+    from services.label_store import label_store
     USE_GEMINI = True
 except Exception:
     USE_GEMINI = False
@@ -22,13 +36,15 @@ except Exception:
 st.title("🗣️ Feedback de clientes (Resumen + Sentimiento + Plan + Respuesta)")
 
 # ------------------ Helpers ------------------
-def _read(file):
-    df = pd.read_csv(file, sep=None, engine="python")
-    # Heurística para CSV con ';'
-    if df.shape[1] == 1 and ";" in df.columns[0]:
-        file.seek(0); df = pd.read_csv(file, sep=";")
-    df.columns = [c.strip().lower() for c in df.columns]
-    return df
+@st.cache_data(show_spinner=False)
+def _load_texts(file_id: str, text_col: str, _file) -> list:
+    """Solo la columna de texto, leída por bloques (cacheada por archivo + columna entre reruns)."""
+    return read_text_column(_file, text_col)
+
+@st.cache_data(show_spinner=False)
+def _sentiment_calls(file_id: str, text_col: str, n: int, _reviews: list) -> dict:
+    """Reviews dudosas (van a Gemini) y llamadas estimadas; cacheado por archivo + columna + n."""
+    return estimate_sentiment_calls(_reviews)
 
 def _slugify(s: str) -> str:
     s = s.strip().lower()
@@ -36,32 +52,12 @@ def _slugify(s: str) -> str:
     s = re.sub(r"-{2,}", "-", s).strip("-")
     return s or "reporte-feedback"
 
-def _normalize_ratio_dict(ratio: dict) -> dict:
-    """Devuelve fracciones que suman ~1.0; acepta 0–100 o 0–1."""
-    vals = {
-        "positivo": float(ratio.get("positivo", 0) or 0),
-        "neutral":  float(ratio.get("neutral",  0) or 0),
-        "negativo": float(ratio.get("negativo", 0) or 0),
-    }
-    s = sum(vals.values())
-    # Si parece porcentaje (p.ej., 100,0,0), conviértelo a fracción
-    if s > 1.5:
-        vals = {k: v / 100.0 for k, v in vals.items()}
-        s = sum(vals.values())
-    # Rebalanceo si no suma 1 o si está todo en cero
-    if s > 0:
-        vals = {k: v / s for k, v in vals.items()}
-    else:
-        vals = {"positivo": 1/3, "neutral": 1/3, "negativo": 1/3}
-    return vals
-
 def _pct(x: float) -> str:
     return f"{x*100:.1f}%"
 
 def _build_summary_csv(summary: dict) -> bytes:
     bullets = summary.get("bullets") or []
-    ratio_raw = summary.get("sentiment_ratio", {})
-    ratio = _normalize_ratio_dict(ratio_raw)
+    ratio = summary.get("sentiment_ratio", {})
     plan  = summary.get("action_plan", [])
     row = {
         **{f"bullet_{i+1}": (bullets[i] if i < len(bullets) else "") for i in range(5)},
@@ -72,6 +68,8 @@ def _build_summary_csv(summary: dict) -> bytes:
         "neutral": ratio.get("neutral", 0.0),
         "negativo": ratio.get("negativo", 0.0),
         "sample_size": summary.get("sample_size", 0),
+        "sentiment_total": summary.get("sentiment_total", 0),
+        "sentiment_unclassified": summary.get("sentiment_unclassified", 0),
     }
     buf = StringIO()
     pd.DataFrame([row]).to_csv(buf, index=False)
@@ -87,7 +85,7 @@ def _build_docx_report(summary: dict, df_sent: pd.DataFrame) -> BytesIO | None:
         return None
 
     bullets = summary.get("bullets") or []
-    ratio = _normalize_ratio_dict(summary.get("sentiment_ratio", {}))
+    ratio = summary.get("sentiment_ratio", {})
     reco  = summary.get("recommendation", "")
     plan  = summary.get("action_plan", [])
     reply = summary.get("customer_reply", "")
@@ -113,7 +111,7 @@ def _build_docx_report(summary: dict, df_sent: pd.DataFrame) -> BytesIO | None:
     doc.add_heading("Respuesta al cliente (plantilla)", level=2)
     doc.add_paragraph(str(reply))
 
-    doc.add_heading("Distribución de sentimiento (aprox.)", level=2)
+    doc.add_heading(f"Distribución de sentimiento ({summary.get('sentiment_total', 0)} reviews clasificadas)", level=2)
     doc.add_paragraph(f"Positivo: {_pct(ratio.get('positivo',0.0))}")
     doc.add_paragraph(f"Neutral:  {_pct(ratio.get('neutral',0.0))}")
     doc.add_paragraph(f"Negativo: {_pct(ratio.get('negativo',0.0))}")
@@ -139,12 +137,20 @@ def _build_docx_report(summary: dict, df_sent: pd.DataFrame) -> BytesIO | None:
 # ---------------------------------------------
 
 # ----------- Carga y selección del CSV -------
-up = st.file_uploader("CSV con columna de texto (review/comentario/...)", type=["csv"])
+up = st.file_uploader("Archivo con columna de texto (review/comentario/...)",
+                      type=["csv", "tsv", "txt", "parquet", "jsonl", "ndjson"],
+                      help="CSV/TSV (separador detectado automáticamente), Parquet o JSONL; se lee por bloques.")
 
 if up:
-    df = _read(up)
-    st.caption(f"📄 {len(df):,} filas cargadas")
-    st.dataframe(df.head(), use_container_width=True)
+    if detect_format(up) == "parquet" and not parquet_available():
+        st.error(f"No se puede leer '{up.name}': {PARQUET_MISSING}")
+        st.stop()
+    try:
+        df = ingest_preview(up)
+    except Exception as e:
+        st.error(f"No se pudo leer el archivo: {e}")
+        st.stop()
+    st.dataframe(df, use_container_width=True)
 
     cols = df.columns.tolist()
     guess = next((c for c in cols if c in ["review","comentario","texto","opinion","comment"]), cols[0])
@@ -160,20 +166,50 @@ if up:
             top_p = st.slider("Top-p", 0.1, 1.0, 0.9, 0.05,
                               help="Probabilidades acumuladas; típicamente 0.9.")
         with c3:
-            max_tokens_sum = st.slider("Máx. tokens (resumen+plan+respuesta)", 512, 2048, 768, 64)
+            manual_sum = st.checkbox("Fijar máx. tokens del resumen", value=False,
+                                     help="Por defecto el límite se calcula según los campos del resumen.")
+            max_tokens_sum = st.slider("Máx. tokens (resumen+plan+respuesta)", 512, 2048, 768, 64,
+                                       disabled=not manual_sum)
         with c4:
-            max_tokens_cls = st.slider("Máx. tokens (sentimiento)", 512, 4096, 2048, 64)
+            max_tokens_cls = st.slider("Máx. tokens por request (sentimiento)", 512, 8192, 8192, 256,
+                                       help="Tope por llamada; si la muestra no entra, se clasifica en varios lotes.")
         c5, c6 = st.columns(2)
         with c5:
+            sum_all = st.checkbox("Resumir todas las reviews", value=True,
+                                  help="Con Gemini, los archivos grandes se resumen por lotes en paralelo y se combinan (map-reduce).")
             sample_size_sum = st.number_input("Muestra para resumen", 50, 2000, 300, step=50,
-                                              help="Máximo de reviews a considerar.")
+                                              help="Máximo de reviews a considerar si no se resumen todas.",
+                                              disabled=sum_all)
         with c6:
+            cls_all = st.checkbox("Clasificar todas las reviews", value=False,
+                                  help="La distribución de sentimiento se cuenta sobre todas las filas; "
+                                       "el léxico local resuelve las claras y solo las dudosas van a Gemini "
+                                       "(en cada análisis).")
             sample_size_cls = st.number_input("Muestra para sentimiento", 50, 2000, 200, step=50,
-                                              help="Máximo de reviews a clasificar.")
-
-    reviews_all = df[text_col].dropna().astype(str).tolist()
-    reviews_sum = reviews_all[: int(sample_size_sum)]
-    reviews_cls = reviews_all[: int(sample_size_cls)]
+                                              help="Máximo de reviews a clasificar si no se clasifican todas.",
+                                              disabled=cls_all)
+        themes_on = st.checkbox("Extraer temas (clustering del corpus)", value=False,
+                                help="Agrupa todas las reviews por similitud (embeddings + k-means); "
+                                     "Gemini solo nombra cada grupo a partir de palabras clave y ejemplos.",
+                                disabled=not USE_GEMINI)
+        c7, c8 = st.columns(2)
+        with c7:
+            replies_on = st.checkbox("Responder todas las reviews negativas (en lote)", value=False,
+                                     help="Agrupa quejas parecidas: una plantilla por grupo + una frase "
+                                          "personalizada por review. Usa las etiquetas de sentimiento.",
+                                     disabled=not USE_GEMINI)
+        with c8:
+            brand_bulk = st.text_input("Marca para las respuestas (opcional)", value="", disabled=not replies_on)
+
+    with st.spinner("Leyendo la columna de texto…"):
+        reviews_all = _load_texts(up.file_id, text_col, up)
+    st.caption(f"📄 {len(reviews_all):,} reviews con texto en '{text_col}'")
+    reviews_sum = reviews_all if (sum_all and USE_GEMINI) else reviews_all[: int(sample_size_sum)]
+    reviews_cls = reviews_all if cls_all else reviews_all[: int(sample_size_cls)]
+    if USE_GEMINI:
+        est_cls = _sentiment_calls(up.file_id, text_col, len(reviews_cls), reviews_cls)
+        st.caption(f"🔎 Sentimiento: hasta {est_cls['to_model']:,} de {est_cls['reviews']:,} reviews irían a Gemini "
+                   f"(≈{est_cls['calls']:,} llamadas; el léxico local resuelve el resto y las ya etiquetadas no se re-envían)")
 
     # ---------- Un solo botón que corre todo ----------
     if st.button("🧾 Analizar (Resumen + Sentimiento + Plan + Respuesta)", type="primary", use_container_width=True):
@@ -184,15 +220,14 @@ if up:
                     reviews_sum,
                     temperature=temperature,
                     top_p=top_p,
-                    max_output_tokens=int(max_tokens_sum),
-                    max_reviews=int(sample_size_sum),
+                    max_output_tokens=int(max_tokens_sum) if manual_sum else None,
+                    max_reviews=None if sum_all else int(sample_size_sum),
                 )
             else:
                 res_txt = sum_local(reviews_sum)
                 summary = {
                     "bullets": [res_txt],
                     "recommendation": "",
-                    "sentiment_ratio": {"positivo": 0.34, "neutral": 0.33, "negativo": 0.33},
                     "action_plan": ["Revisar tickets abiertos; CX; 2 semanas"],
                     "customer_reply": "¡Gracias por tu comentario! Escríbenos por DM con tu número de pedido para ayudarte.",
                     "sample_size": len(reviews_sum),
@@ -203,7 +238,6 @@ if up:
             summary = {
                 "bullets": ["No se pudo generar resumen"],
                 "recommendation": "",
-                "sentiment_ratio": {"positivo": 0.0, "neutral": 1.0, "negativo": 0.0},
                 "action_plan": [],
                 "customer_reply": "",
                 "sample_size": len(reviews_sum),
@@ -217,7 +251,7 @@ if up:
                     temperature=0.2,
                     top_p=top_p,
                     max_output_tokens=int(max_tokens_cls),
-                    max_reviews=int(sample_size_cls),
+                    max_reviews=len(reviews_cls),
                 )
             else:
                 rows = sent_local(reviews_cls)
@@ -225,6 +259,39 @@ if up:
             st.error(f"Error en sentimiento: {e}")
             rows = sent_local(reviews_cls)
 
+        # Distribución exacta sobre las etiquetas por review (no la estima el resumen)
+        dist = sentiment_distribution(rows)
+        summary["sentiment_ratio"] = dist["ratio"]
+        summary["sentiment_counts"] = dist["counts"]
+        summary["sentiment_total"] = dist["total"]
+        summary["sentiment_unclassified"] = dist["unclassified"]
+
+        # Temas del corpus (opcional)
+        themes = None
+        if themes_on and USE_GEMINI:
+            try:
+                with st.spinner("Agrupando reviews por tema…"):
+                    themes = themes_gem(reviews_all, temperature=temperature, top_p=top_p)
+            except Exception as e:
+                st.error(f"Error en temas: {e}")
+
+        # Respuestas en lote a las negativas (opcional; filas por grupo a medida que terminan)
+        replies = []
+        if replies_on and USE_GEMINI:
+            n_neg = dist["counts"]["negativo"]
+            bar = st.progress(0, text=f"Respondiendo {n_neg:,} reviews negativas…")
+            try:
+                for r in bulk_replies_gem(reviews_cls, brand_name=brand_bulk or None,
+                                          labels=rows, temperature=temperature, top_p=top_p):
+                    replies.append(r)
+                    if len(replies) % 50 == 0 or len(replies) == n_neg:
+                        bar.progress(min(1.0, len(replies) / max(1, n_neg)),
+                                     text=f"Respuestas: {len(replies):,}/{n_neg:,}")
+            except Exception as e:
+                st.error(f"Error en respuestas en lote: {e}")
+            bar.empty()
+            replies.sort(key=lambda r: r["index"])
+
         # ---------- Mostrar resultados ----------
         st.subheader("Resumen (3–5 bullets)")
         bullets = summary.get("bullets") or []
@@ -243,25 +310,61 @@ if up:
         st.subheader("Respuesta al cliente (plantilla pública)")
         st.text_area("Copia y personaliza si hace falta:", value=summary.get("customer_reply", ""), height=140)
 
-        st.subheader("Distribución de sentimiento (aprox.)")
-        ratio = _normalize_ratio_dict(summary.get("sentiment_ratio", {}))
+        st.subheader("Distribución de sentimiento")
+        ratio, counts = dist["ratio"], dist["counts"]
         cma, cmb, cmc = st.columns(3)
         with cma:
-            st.metric("Positivo", _pct(ratio["positivo"]))
+            st.metric("Positivo", _pct(ratio["positivo"]), f"{counts['positivo']:,} reviews", delta_color="off")
             st.progress(int(round(ratio["positivo"] * 100)))
         with cmb:
-            st.metric("Neutral", _pct(ratio["neutral"]))
+            st.metric("Neutral", _pct(ratio["neutral"]), f"{counts['neutral']:,} reviews", delta_color="off")
             st.progress(int(round(ratio["neutral"] * 100)))
         with cmc:
-            st.metric("Negativo", _pct(ratio["negativo"]))
+            st.metric("Negativo", _pct(ratio["negativo"]), f"{counts['negativo']:,} reviews", delta_color="off")
             st.progress(int(round(ratio["negativo"] * 100)))
 
-        st.caption(f"Muestra analizada: {summary.get('sample_size', len(reviews_sum)):,} comentario(s)")
+        st.caption(f"Distribución exacta sobre {dist['total']:,} review(s) clasificadas · "
+                   f"Resumen sobre {summary.get('sample_size', len(reviews_sum)):,} comentario(s)")
+        if dist["unclassified"]:
+            st.warning(f"{dist['unclassified']:,} review(s) quedaron sin clasificar (error del modelo) "
+                       "y no cuentan en la distribución.")
 
         st.subheader("Análisis de sentimiento (por review)")
         df_sent = pd.DataFrame(rows)
         st.dataframe(df_sent, use_container_width=True)
 
+        df_themes = None
+        if themes and themes.get("themes"):
+            st.subheader("Temas del corpus")
+            df_themes = pd.DataFrame([{
+                "tema": t["label"],
+                "reviews": t["size"],
+                "proporción": _pct(t["share"]),
+                "sentimiento": t["sentiment"],
+                "palabras clave": ", ".join(t["keywords"]),
+                "resumen": t["summary"],
+                "acción": t["action"],
+            } for t in themes["themes"]])
+            st.dataframe(df_themes, use_container_width=True)
+            st.caption(f"{len(themes['themes'])} temas sobre {themes['n_reviews']:,} reviews (tamaños exactos).")
+
+        if replies:
+            st.subheader("Respuestas a reviews negativas (lote)")
+            df_replies = pd.DataFrame(replies)
+            st.dataframe(df_replies[["review", "keywords", "reply"]], use_container_width=True)
+            st.caption(f"{len(replies):,} respuestas · {df_replies['group'].nunique():,} plantillas (una por grupo de quejas).")
+
+        if USE_GEMINI:
+            with st.expander("Métricas de parseo JSON (sesión)"):
+                st.caption("structured = JSON directo; fallback = rescatado por regex; failed = salida descartada.")
+                st.json(parse_stats())
+            with st.expander("Tokens estimados vs. reales (sesión)"):
+                st.caption("est_input = estimación previa; input/output = usage_metadata; truncated = cortes por MAX_TOKENS.")
+                st.json(usage_stats())
+            with st.expander("Etiquetas reutilizadas (store incremental)"):
+                st.caption("hits = reviews ya etiquetadas en corridas anteriores (no se re-clasifican); misses = nuevas.")
+                st.json(label_store().stats())
+
         # ---------- Descargas ----------
         slug = _slugify(f"feedback-{text_col}")
 
@@ -295,6 +398,31 @@ if up:
             use_container_width=True,
         )
 
+        # Temas CSV
+        if df_themes is not None:
+            csv_buf3 = StringIO()
+            df_themes.to_csv(csv_buf3, index=False)
+            st.download_button(
+                "⬇️ Descargar temas (CSV)",
+                csv_buf3.getvalue().encode("utf-8"),
+                file_name=f"{slug}-temas.csv",
+                mime="text/csv",
+                use_container_width=True,
+            )
+
+        # Respuestas en lote (CSV / JSONL)
+        if replies:
+            for fmt, mime in (("csv", "text/csv"), ("jsonl", "application/x-ndjson")):
+                buf = StringIO()
+                write_replies(replies, buf, fmt)
+                st.download_button(
+                    f"⬇️ Descargar respuestas ({fmt.upper()})",
+                    buf.getvalue().encode("utf-8"),
+                    file_name=f"{slug}-respuestas.{fmt}",
+                    mime=mime,
+                    use_container_width=True,
+                )
+
         # Word (todo)
         docx_io = _build_docx_report(summary, df_sent)
         if docx_io is not None:
@@ -328,7 +456,8 @@ if run_single and manual_txt.strip():
     try:
         if USE_GEMINI:
             from services.feedback_gemini import score_sentiment_gemini as _cls
-            cls = _cls([manual_txt], temperature=0.2, top_p=0.9, max_output_tokens=512, max_reviews=1)
+            cls = _cls([manual_txt], temperature=0.2, top_p=0.9, max_output_tokens=512, max_reviews=1,
+                       local_first=False)
             rep = reply_gem(manual_txt, brand_name=brand or None, temperature=0.4, top_p=0.9, max_output_tokens=512)
         else:
             cls = sent_local([manual_txt])
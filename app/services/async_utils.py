@@ -0,0 +1,58 @@
+# services/async_utils.py
+# -----------------------------------------------------------------------------
+# Utilidades para fan-out asíncrono sobre las versiones *_async de los servicios.
+# - gather_bounded: como asyncio.gather, pero con un semáforo que limita cuántas
+#   corrutinas están en vuelo a la vez (respeta cuotas y evita picos de memoria).
+# - map_bounded: aplica una función async a una lista de items con el mismo límite.
+#
+# Ejemplo:
+#   from services.async_utils import map_bounded
+#   from services.llm_gemini import generate_product_description_gemini_async
+#   outs = asyncio.run(map_bounded(
+#       lambda p: generate_product_description_gemini_async(p["name"], p["attrs"], "Web"),
+#       productos, limit=64))
+# -----------------------------------------------------------------------------
+
+import asyncio
+from typing import Any, Awaitable, Callable, Iterable, List, TypeVar, Union
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+DEFAULT_LIMIT = 32  # requests simultáneos por defecto
+
+
+async def gather_bounded(
+    aws: Iterable[Union[Awaitable[T], Callable[[], Awaitable[T]]]],
+    limit: int = DEFAULT_LIMIT,
+    return_exceptions: bool = False,
+) -> List[Union[T, BaseException]]:
+    """
+    Ejecuta los awaitables con como máximo 'limit' en vuelo y devuelve los
+    resultados en el mismo orden de entrada.
+    - Acepta corrutinas ya creadas o callables sin argumentos que las crean;
+      con callables, la corrutina recién se crea al obtener el semáforo
+      (menos memoria cuando hay miles de items).
+    - return_exceptions=True devuelve la excepción en su posición en vez de abortar.
+    """
+    sem = asyncio.Semaphore(max(1, int(limit)))
+
+    async def _run(a):
+        async with sem:
+            return await (a() if callable(a) else a)
+
+    return await asyncio.gather(*(_run(a) for a in aws), return_exceptions=return_exceptions)
+
+
+async def map_bounded(
+    fn: Callable[[R], Awaitable[T]],
+    items: Iterable[R],
+    limit: int = DEFAULT_LIMIT,
+    return_exceptions: bool = False,
+) -> List[Union[T, BaseException]]:
+    """Aplica fn(item) a cada item con concurrencia acotada; conserva el orden."""
+    return await gather_bounded(
+        ((lambda it=it: fn(it)) for it in items),
+        limit=limit,
+        return_exceptions=return_exceptions,
+    )
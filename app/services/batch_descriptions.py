@@ -0,0 +1,297 @@
+# services/batch_descriptions.py
+# -----------------------------------------------------------------------------
+# Motor de descripciones masivas para catálogos (miles de SKUs × canales).
+# - Lee productos desde CSV o JSONL (columnas: sku, name, attrs[, channel]).
+# - Reparte las llamadas al modelo en un pool acotado de workers (hilos) con
+#   reintentos por item. Con varios canales, por defecto pide todos los canales
+#   de un producto en UNA sola llamada (generate_multichannel_descriptions_gemini).
+# - Escribe cada resultado apenas llega en un JSONL de salida (checkpoint):
+#   si el proceso se cae, al relanzarlo se saltan los (sku, canal) ya exitosos.
+# - Al final reporta throughput (items/s), latencia p50/p95 y fallos.
+#
+# Uso (desde la carpeta app/):
+#   python -m services.batch_descriptions catalogo.csv salida.jsonl \
+#          --channels Web IG Ads Marketplace --workers 8
+# -----------------------------------------------------------------------------
+
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .structured import parse_stats
+from .token_budget import usage_stats
+from .prompt_templates import clear_context_caches
+from .llm_gemini import (
+    CHANNELS,
+    generate_product_description_gemini,
+    generate_multichannel_descriptions_gemini,
+)
+
+_NAME_COLS = ("name", "nombre", "producto", "product")
+_ATTRS_COLS = ("attrs", "attrs_text", "atributos", "attributes")
+_SKU_COLS = ("sku", "id", "codigo", "code")
+
+
+def _pick(row: Dict[str, Any], cols: Tuple[str, ...]) -> str:
+    """Devuelve el primer valor no vacío entre las columnas candidatas (sin distinguir mayúsculas)."""
+    low = {str(k).strip().lower(): v for k, v in row.items()}
+    for c in cols:
+        v = low.get(c)
+        if v is not None and str(v).strip():
+            return str(v).strip()
+    return ""
+
+
+def read_products(path: str) -> Iterator[Dict[str, str]]:
+    """
+    Lee productos en streaming desde .csv o .jsonl.
+    Cada item: {"sku", "name", "attrs", "channel"} (channel puede venir vacío).
+    Si no hay columna sku, se usa el número de fila como identificador.
+    """
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, "r", encoding="utf-8") as f:
+            rows: Iterator[Dict[str, Any]] = (json.loads(ln) for ln in f if ln.strip())
+            yield from _rows_to_products(rows)
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            sample = f.read(64 * 1024)
+            f.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+            except csv.Error:
+                dialect = csv.excel
+            yield from _rows_to_products(csv.DictReader(f, dialect=dialect))
+
+
+def _rows_to_products(rows) -> Iterator[Dict[str, str]]:
+    for i, row in enumerate(rows):
+        name = _pick(row, _NAME_COLS)
+        if not name:
+            continue
+        yield {
+            "sku": _pick(row, _SKU_COLS) or str(i),
+            "name": name,
+            "attrs": _pick(row, _ATTRS_COLS),
+            "channel": _pick(row, ("channel", "canal")),
+        }
+
+
+def load_checkpoint(output_path: str) -> Set[Tuple[str, str]]:
+    """
+    Lee el JSONL de salida (si existe) y devuelve los (sku, canal) ya completados con éxito.
+    Ignora líneas truncadas (p. ej., si el proceso murió a mitad de escritura).
+    """
+    done: Set[Tuple[str, str]] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for ln in f:
+            try:
+                rec = json.loads(ln)
+            except Exception:
+                continue
+            if rec.get("status") == "ok":
+                done.add((str(rec.get("sku")), str(rec.get("channel"))))
+    return done
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Percentil por interpolación lineal (q en 0..100)."""
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = (len(xs) - 1) * q / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def _record(item: Dict[str, str], channel: str, out: Dict[str, Any], latency: float, attempts: int) -> Dict[str, Any]:
+    return {
+        "sku": item["sku"], "name": item["name"], "channel": channel, "status": "ok",
+        "short": out.get("short", ""), "long": out.get("long", ""),
+        "bullets": out.get("bullets", []), "hashtags": out.get("hashtags", []),
+        "latency_s": latency, "attempts": attempts,
+    }
+
+
+def _run_task(fn: Callable[..., Dict], item: Dict[str, str], channels: List[str],
+              gen_kwargs: Dict[str, Any], retries: int, multichannel: bool) -> List[Dict[str, Any]]:
+    """
+    Genera los canales pedidos de un producto con reintentos y backoff exponencial; nunca lanza.
+    - multichannel=False: una llamada por canal (channels tiene un único elemento).
+    - multichannel=True: una sola llamada para todos los canales; en el reintento
+      solo se vuelven a pedir los canales que llegaron vacíos.
+    Devuelve un registro por canal (status "ok" o "error").
+    """
+    t0 = time.perf_counter()
+    pending = list(channels)
+    recs: List[Dict[str, Any]] = []
+    err = ""
+    for attempt in range(retries + 1):
+        try:
+            if multichannel:
+                outs = fn(name=item["name"], attrs_text=item["attrs"], channels=pending, **gen_kwargs)
+            else:
+                outs = {pending[0]: fn(name=item["name"], attrs_text=item["attrs"], channel=pending[0], **gen_kwargs)}
+            latency = round(time.perf_counter() - t0, 3)
+            for ch in list(pending):
+                out = outs.get(ch) or {}
+                if out.get("short") or out.get("long"):
+                    recs.append(_record(item, ch, out, latency, attempt + 1))
+                    pending.remove(ch)
+            if not pending:
+                return recs
+            err = "respuesta sin JSON válido"
+        except Exception as e:
+            err = f"{type(e).__name__}: {e}"
+        if attempt < retries:
+            time.sleep(min(30.0, 2.0 ** attempt))
+    latency = round(time.perf_counter() - t0, 3)
+    return recs + [{
+        "sku": item["sku"], "name": item["name"], "channel": ch, "status": "error",
+        "error": err, "latency_s": latency, "attempts": retries + 1,
+    } for ch in pending]
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    channels: Optional[List[str]] = None,
+    workers: int = 8,
+    retries: int = 2,
+    temperature: float = 0.7,
+    top_p: float = 0.9,
+    max_tokens: Optional[int] = None,
+    use_cache: bool = True,
+    multichannel: bool = True,
+    generate_fn: Optional[Callable[..., Dict]] = None,
+    progress: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Genera descripciones para todo el catálogo y devuelve métricas:
+    {"done", "failed", "skipped", "requests", "elapsed_s", "items_per_s", "p50_s", "p95_s"}.
+    - channels: canales a generar por producto; si es None se usa la columna
+      'channel' de cada fila (o "Web" si viene vacía).
+    - multichannel: con varios canales, los pide todos en una sola llamada por
+      producto (generate_multichannel_descriptions_gemini) en vez de una por canal.
+    - Reanudable: los (sku, canal) con status "ok" en output_path no se repiten.
+    - Como máximo workers*2 tareas en vuelo (memoria acotada con catálogos grandes).
+    - Las latencias p50/p95 son por llamada al modelo.
+    """
+    multi = bool(multichannel and channels and len(channels) > 1)
+    if generate_fn is not None:
+        fn = generate_fn
+    else:
+        fn = generate_multichannel_descriptions_gemini if multi else generate_product_description_gemini
+    gen_kwargs: Dict[str, Any] = {"temperature": temperature, "top_p": top_p}
+    if max_tokens:
+        gen_kwargs["max_tokens"] = int(max_tokens)  # por defecto: token_budget según canales
+    if generate_fn is None:
+        gen_kwargs["use_cache"] = use_cache
+
+    done = load_checkpoint(output_path)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    stats = {"done": 0, "failed": 0, "skipped": 0, "requests": 0}
+
+    def _tasks() -> Iterator[Tuple[Dict[str, str], List[str]]]:
+        for item in read_products(input_path):
+            wanted = channels or [item["channel"] or "Web"]
+            todo = [ch for ch in wanted if (item["sku"], ch) not in done]
+            stats["skipped"] += len(wanted) - len(todo)
+            if multi and todo:
+                yield item, todo
+            else:
+                for ch in todo:
+                    yield item, [ch]
+
+    latencies: List[float] = []
+    write_lock = threading.Lock()
+    max_in_flight = max(1, int(workers)) * 2
+    t0 = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+
+        def _collect(fut) -> None:
+            recs = fut.result()
+            with write_lock:
+                for rec in recs:
+                    out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                out.flush()                                # checkpoint: cada producto queda en disco
+            latencies.append(max(r["latency_s"] for r in recs))
+            stats["requests"] += 1
+            for rec in recs:
+                stats["done" if rec["status"] == "ok" else "failed"] += 1
+                if progress:
+                    progress(stats["done"] + stats["failed"], rec)
+
+        in_flight = set()
+        for item, chs in _tasks():
+            if len(in_flight) >= max_in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    _collect(fut)
+            in_flight.add(pool.submit(_run_task, fn, item, chs, gen_kwargs, retries, multi))
+        for fut in wait(in_flight).done:
+            _collect(fut)
+
+    elapsed = time.perf_counter() - t0
+    processed = stats["done"] + stats["failed"]
+    return {
+        **stats,
+        "elapsed_s": round(elapsed, 3),
+        "items_per_s": round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+        "p50_s": round(_percentile(latencies, 50), 3),
+        "p95_s": round(_percentile(latencies, 95), 3),
+        "parse": parse_stats(),                            # structured / fallback / failed por tipo
+        "tokens": usage_stats(),                           # tokens estimados vs. reales por tipo
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Genera descripciones de producto en lote (CSV/JSONL → JSONL).")
+    ap.add_argument("input", help="CSV o JSONL con columnas sku, name, attrs[, channel]")
+    ap.add_argument("output", help="JSONL de salida (también sirve de checkpoint para reanudar)")
+    ap.add_argument("--channels", nargs="*", choices=CHANNELS, default=None,
+                    help="Canales a generar por producto (por defecto, la columna 'channel' o Web)")
+    ap.add_argument("--workers", type=int, default=8, help="Llamadas concurrentes al modelo")
+    ap.add_argument("--retries", type=int, default=2, help="Reintentos por item ante error")
+    ap.add_argument("--temperature", type=float, default=0.7)
+    ap.add_argument("--top-p", type=float, default=0.9)
+    ap.add_argument("--max-tokens", type=int, default=None,
+                    help="Tokens de salida por llamada (defecto: automático según canales)")
+    ap.add_argument("--per-channel", action="store_true",
+                    help="Una llamada por canal en vez de todos los canales en una sola llamada")
+    ap.add_argument("--no-cache", action="store_true", help="Ignora la caché de descripciones")
+    args = ap.parse_args(argv)
+
+    def _progress(n: int, rec: Dict[str, Any]) -> None:
+        if n % 100 == 0 or rec["status"] != "ok":
+            print(f"[{n}] {rec['sku']} / {rec['channel']}: {rec['status']} {rec.get('error', '')}".rstrip(),
+                  flush=True)
+
+    report = run_batch(
+        args.input, args.output,
+        channels=args.channels or None,
+        workers=args.workers,
+        retries=args.retries,
+        temperature=args.temperature,
+        top_p=args.top_p,
+        max_tokens=args.max_tokens,
+        use_cache=not args.no_cache,
+        multichannel=not args.per_channel,
+        progress=_progress,
+    )
+    report["context_caches_deleted"] = clear_context_caches()   # no pagar almacenamiento hasta el TTL
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+# services/compose_bench.py
+# -----------------------------------------------------------------------------
+# Micro-benchmark del compositor de promos (images_gemini._compose_with_packshot)
+# sin llamar a Vertex: fondo y packshot sintéticos, parámetros por defecto de
+# generate_promos_with_gemini_background.
+# - Tiempo por creatividad: mediana y p95 de --runs composiciones.
+# - Memoria pico: crecimiento del RSS máximo (ru_maxrss) durante la primera
+#   composición, medido en un proceso aparte por tamaño para que un tamaño no
+#   contamine al siguiente (PIL reserva memoria fuera de tracemalloc).
+#
+# Uso (desde la carpeta app/):
+#   python -m services.compose_bench --sizes 1080x1350 1200x628 --runs 20
+# -----------------------------------------------------------------------------
+
+import sys
+import time
+import argparse
+import statistics
+import multiprocessing as mp
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+DEFAULT_SIZES = ("1080x1350", "1200x628")
+
+_STYLE = dict(
+    headline="Oferta de temporada en toda la tienda",
+    subheadline="Envío gratis por compras mayores a S/ 99",
+    cta="Comprar ahora",
+    headline_hex="#141414",
+    subheadline_hex="#3C3C3C",
+    cta_hex="#E30613",
+    quarter_radius_pct=0.55,
+    plate_hex="#FFFFFF",
+    plate_opacity=180,
+    rays_enabled=True,
+    rays_count=12,
+    rays_length_pct=0.6,
+    rays_thickness_px=6,
+    rays_color_hex="#FFD700",
+    rays_opacity=180,
+    rays_spread_deg=80.0,
+    pack_scale_pct=0.9,
+    margin_right_pct=0.06,
+    margin_bottom_pct=0.06,
+    shadow_scale_x=0.9,
+    shadow_scale_y=0.08,
+    shadow_offset_y_px=6,
+    shadow_opacity=160,
+    shadow_blur_px=12,
+)
+
+
+def _parse_size(s: str) -> Tuple[int, int]:
+    w, h = s.lower().split("x")
+    return int(w), int(h)
+
+
+def _inputs(seed: int = 0) -> Tuple[bytes, Image.Image]:
+    """Packshot PNG con transparencia (1200×1500) y fondo 1024×1024 como el que devuelve Imagen."""
+    rng = np.random.default_rng(seed)
+    bg = Image.fromarray(rng.integers(0, 256, (1024, 1024, 3), dtype=np.uint8))
+    prod = Image.new("RGBA", (1200, 1500), (0, 0, 0, 0))
+    ImageDraw.Draw(prod).rounded_rectangle((150, 150, 1050, 1350), radius=90, fill=(200, 30, 30, 255))
+    buf = BytesIO()
+    prod.save(buf, format="PNG")
+    return buf.getvalue(), bg
+
+
+def _max_rss_mb() -> float:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024   # bytes en macOS, KB en Linux
+
+
+def _run_size(size: Tuple[int, int], runs: int) -> Dict[str, Any]:
+    from .images_gemini import PreparedPackshot, _compose_with_packshot
+
+    base_bytes, bg = _inputs()
+    kwargs = dict(_STYLE, packshot=PreparedPackshot(base_bytes), background_img=bg, canvas_size=size)
+
+    rss0 = _max_rss_mb()
+    t0 = time.perf_counter()
+    _compose_with_packshot(**kwargs)
+    first = time.perf_counter() - t0
+    peak = _max_rss_mb() - rss0
+
+    times: List[float] = []
+    for _ in range(max(1, runs)):
+        t0 = time.perf_counter()
+        _compose_with_packshot(**kwargs)
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return {
+        "size": f"{size[0]}x{size[1]}",
+        "first_ms": round(first * 1000, 1),
+        "p50_ms": round(statistics.median(times) * 1000, 1),
+        "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 1),
+        "peak_mb": round(peak, 1),
+    }
+
+
+def bench(sizes=DEFAULT_SIZES, runs: int = 20) -> List[Dict[str, Any]]:
+    """Un proceso nuevo por tamaño (memoria pico aislada)."""
+    ctx = mp.get_context("spawn")
+    out = []
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for s in sizes:
+            out.append(pool.apply(_run_size, (_parse_size(s), runs)))
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Micro-benchmark del compositor de promos (sin Vertex).")
+    ap.add_argument("--sizes", nargs="*", default=list(DEFAULT_SIZES), help="Tamaños WxH (p. ej., 1080x1350)")
+    ap.add_argument("--runs", type=int, default=20, help="Composiciones por tamaño")
+    args = ap.parse_args(argv)
+
+    print(f"{'tamaño':>10} {'1.ª (ms)':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'pico (MB)':>10}")
+    for r in bench(args.sizes, args.runs):
+        print(f"{r['size']:>10} {r['first_ms']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['peak_mb']:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,253 @@
-from typing import List, Dict
+# services/feedback.py
+# -----------------------------------------------------------------------------
+# Análisis local de feedback (sin API):
+# - summarize_reviews: resumen de demo.
+# - score_sentiment: sentimiento por review con un léxico en español (Perú),
+#   vectorizado con pandas/NumPy (sin bucles por fila), apto para millones de filas:
+#     * negación ("no", "nunca", "sin", "ni"...) invierte hasta 3 palabras
+#       siguientes dentro de la misma frase; frases hechas como "sin duda" o
+#       "sin embargo" no niegan;
+#     * intensificadores ("muy", "re", "recontra", "full"...) y atenuadores
+#       ("algo", "medio", "un poco") escalan la palabra siguiente; una palabra
+#       que actúa como intensificador pierde su propia polaridad ("bien malo"
+#       = muy malo, no bueno + malo);
+#     * contraste: lo que va después de "pero"/"sino" pesa más;
+#     * emojis frecuentes suman o restan.
+# - lexicon_sentiment: etiqueta + confianza (0–1) + puntaje por review. Con la
+#   confianza, feedback_gemini resuelve localmente lo claro y solo escala a
+#   Gemini las reviews dudosas (cascada).
+# - sentiment_cues: negadores + palabras con polaridad de un texto (la usa
+#   review_dedup para no fusionar casi duplicados de sentido opuesto).
+# - sentiment_distribution: distribución exacta (conteos y fracciones) en una
+#   sola pasada sobre las etiquetas por review; reemplaza la estimación que
+#   antes devolvía el prompt de resumen. Las filas UNCLASSIFIED (el modelo no
+#   pudo etiquetarlas) se cuentan aparte y no entran en las fracciones.
+# - Config por .env:
+#     * SENTIMENT_LOCAL_CHUNK → reviews procesadas por bloque (defecto 200000)
+# -----------------------------------------------------------------------------
+
+import os
+import re
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+SENTIMENT_LOCAL_CHUNK = int(os.getenv("SENTIMENT_LOCAL_CHUNK", "200000"))
+
+# Polaridad por palabra (texto normalizado: minúsculas, sin tildes, ñ → n)
+_POSITIVE = {
+    1.0: "bueno buena buenos buenas bien rico rica ricos ricas lindo linda lindos lindas bonito bonita "
+         "agradable amable amables rapido rapida rapidos rapidas puntual comodo comoda facil util "
+         "fresco fresca contento contenta satisfecho satisfecha gracias recomendable recomiendo "
+         "recomendado recomendada gusta gustan gusto gustaron encanta encantan cumplieron cumplio "
+         "atento atenta atentos calidad",
+    1.5: "excelente excelentes genial chevere bacan bacano paja buenazo buenaza mejor mejores "
+         "perfecto perfecta perfectos delicioso deliciosa encanto encantado encantada feliz "
+         "maravilloso maravillosa increible espectacular",
+}
+_NEGATIVE = {
+    1.0: "mal malo mala malos malas tarde lento lenta demora demoro demoraron demorado caro cara "
+         "caros caras feo fea problema problemas falla fallo incompleto incompleta equivocado "
+         "equivocada sucio sucia frio fria queja reclamo cancelaron devolucion espera esperando "
+         "regular incomodo incomoda dificil pina",
+    1.5: "pesimo pesima pesimos horrible horribles terrible terribles roto rota rotos rotas danado "
+         "danada defectuoso defectuosa estafa fraude peor peores decepcion decepcionado "
+         "decepcionada decepcionante asco asqueroso grosero grosera maltrato nefasto nefasta "
+         "insatisfecho insatisfecha",
+}
+_NEGATORS = "no nunca jamas ni tampoco sin nada"
+# Negador + palabra que forman una frase hecha sin valor de negación
+_NON_NEGATING = "sin duda, sin dudas, sin embargo, sin falta, no solo, no obstante"
+# Verbos neutros que negados son una queja ("nunca llegó", "no funciona")
+_NEGATED_COMPLAINTS = ("llego llegaron llega funciona funciono sirve sirvio responden respondieron "
+                       "contestan contestaron atienden solucionan soluciono devolvieron")
+_INTENSIFIERS = {
+    1.3: "bien bastante tan realmente",
+    1.4: "re full",
+    1.5: "muy super demasiado totalmente",
+    1.8: "recontra sumamente extremadamente",
+    0.6: "algo medio",
+}
+_CONTRAST = "pero sino"
+_POS_EMOJI = "😀😃😄😁😊🙂😍🥰❤👍👌🙌⭐🔥💯"
+_NEG_EMOJI = "😠😡🤬😞😢😭😤👎💔🤮😒🙄"
+
+_NEGATION_WINDOW = 3        # palabras afectadas tras un negador
+_CONTRAST_AFTER = 1.5       # peso de la cláusula tras "pero"
+_CONTRAST_BEFORE = 0.5      # peso de la cláusula previa
+_EMOJI_WEIGHT = 1.0
+_ALPHA = 2.0                # normalización del puntaje: s / sqrt(s² + α)
+_NO_EVIDENCE = 0.2          # confianza de un "neutral" sin palabras del léxico
+
+
+def _table(groups: Dict[float, str]) -> Dict[str, float]:
+    return {w: v for v, words in groups.items() for w in words.split()}
+
+
+_POLARITY = {**_table(_POSITIVE), **{w: -v for w, v in _table(_NEGATIVE).items()}}
+_MULT = _table(_INTENSIFIERS)
+_NEG_SET = set(_NEGATORS.split())
+_CONTRAST_SET = set(_CONTRAST.split())
+_BOUNDARY = "|"
+_COMPLAINT_SET = set(_NEGATED_COMPLAINTS.split())
+_NON_NEGATING_PAIRS = {tuple(p.split()) for p in _NON_NEGATING.split(",")}
+_ACCENTS = str.maketrans("áéíóúüñàèìòù", "aeiouunaeiou")
+_NON_WORD = re.compile(r"[^\w|]+")
+
+
+def _norm_token(w: str) -> str:
+    return _NON_WORD.sub("", w.translate(_ACCENTS))
+
+
+def sentiment_cues(text: str) -> Tuple[str, ...]:
+    """
+    Negadores y palabras con polaridad del léxico presentes en 'text' (únicos,
+    ordenados). Dos textos con distintas señales pueden decir lo contrario
+    aunque se parezcan ("es bueno" / "no es bueno").
+    """
+    words = (_norm_token(w) for w in str(text or "").lower().split())
+    return tuple(sorted({w for w in words if w in _NEG_SET or w in _POLARITY}))
+
+
+def _emoji_balance(w: str) -> int:
+    return sum(ch in _POS_EMOJI for ch in w) - sum(ch in _NEG_EMOJI for ch in w)
+
+
+def _score_chunk(texts: pd.Series):
+    """(puntaje, masa positiva, masa negativa, señales del léxico) por review."""
+    n = len(texts)
+    # Solo dos pasadas por fila (minúsculas + signos como límite de frase);
+    # la normalización fina se hace una vez por palabra única del vocabulario
+    split = texts.str.lower().str.replace(r"[.,;:!?()\n]+", f" {_BOUNDARY} ", regex=True).str.split()
+    tokens = split.explode()
+    tokens = tokens[tokens.notna()]
+    doc = tokens.index.to_numpy(dtype=np.int64)
+    codes, raw = pd.factorize(tokens.to_numpy())
+    vocab = [_norm_token(w) for w in raw]
+    norm_codes, norm_vocab = pd.factorize(pd.Series(vocab, dtype="object"))
+    norm = norm_codes[codes]                            # palabra normalizada por posición
+
+    # Propiedades por palabra única → arrays por posición
+    def _take(fn, dtype, words=vocab):
+        return np.fromiter((fn(w) for w in words), dtype=dtype, count=len(words))[codes]
+
+    pol = _take(lambda w: _POLARITY.get(w, 0.0), float)
+    mult = _take(lambda w: _MULT.get(w, 1.0), float)
+    is_neg = _take(lambda w: w in _NEG_SET, bool)
+    is_con = _take(lambda w: w in _CONTRAST_SET, bool)
+    is_bnd = _take(lambda w: w == _BOUNDARY, bool)
+    is_un = _take(lambda w: w == "un", bool)
+    is_poco = _take(lambda w: w == "poco", bool)
+    is_cmp = _take(lambda w: w in _COMPLAINT_SET, bool)
+    emoji = _take(_emoji_balance, float, list(raw))
+
+    # "poco amable" (negativo) vs. "un poco lento" (atenuado)
+    prev_un = np.zeros_like(is_un)
+    prev_un[1:] = is_un[:-1] & (doc[1:] == doc[:-1])
+    mult = np.where(is_poco, np.where(prev_un, 0.6, -0.5), mult)
+
+    # Intensificador inmediatamente anterior (misma review)
+    w = np.ones_like(pol)
+    same = np.zeros(len(pol), bool)
+    same[1:] = doc[1:] == doc[:-1]
+    w[1:] = np.where(same[1:], mult[:-1], 1.0)
+
+    # Una palabra que intensifica a la siguiente ("bien malo") no suma su propia polaridad
+    intensifies = np.zeros(len(pol), bool)
+    intensifies[:-1] = (mult[:-1] != 1.0) & (pol[1:] != 0) & same[1:]
+    pol = np.where(intensifies, 0.0, pol)
+
+    # "sin duda", "sin embargo", "no solo": el negador no niega
+    index = {wd: i for i, wd in enumerate(norm_vocab)}
+    for first, second in _NON_NEGATING_PAIRS:
+        if first in index and second in index:
+            fixed = np.zeros(len(pol), bool)
+            fixed[:-1] = (norm[:-1] == index[first]) & (norm[1:] == index[second]) & same[1:]
+            is_neg = is_neg & ~fixed
+
+    # Negación: negador en las 3 posiciones previas, misma review y misma frase
+    frase = np.cumsum(is_bnd)
+    negated = np.zeros(len(pol), bool)
+    for k in range(1, _NEGATION_WINDOW + 1):
+        hit = np.zeros(len(pol), bool)
+        hit[k:] = is_neg[:-k] & (doc[k:] == doc[:-k]) & (frase[k:] == frase[:-k])
+        negated |= hit
+    contrib = pol * w * np.where(negated, -0.8, 1.0)    # "no bueno" es algo menos fuerte que "malo"
+    contrib = np.where(negated & is_cmp, -1.0, contrib)  # "nunca llegó", "no funciona"
+    contrib = contrib + _EMOJI_WEIGHT * emoji
+
+    # Contraste: antes de "pero" pesa menos y después, más
+    if len(pol):
+        con = np.cumsum(is_con)
+        start = np.r_[0, np.flatnonzero(~same[1:]) + 1]
+        base = np.repeat(con[start] - is_con[start], np.diff(np.r_[start, len(con)]))
+        after = (con - base) > 0
+        has_con = np.bincount(doc, weights=is_con, minlength=n)[doc] > 0
+        contrib = contrib * np.where(has_con, np.where(after, _CONTRAST_AFTER, _CONTRAST_BEFORE), 1.0)
+
+    pos = np.bincount(doc, weights=np.clip(contrib, 0, None), minlength=n)
+    neg = np.bincount(doc, weights=np.clip(-contrib, 0, None), minlength=n)
+    hits = np.bincount(doc, weights=(contrib != 0), minlength=n)
+    return pos - neg, pos, neg, hits
+
+
+def lexicon_sentiment(reviews: List[str]) -> pd.DataFrame:
+    """
+    Sentimiento por léxico, una fila por review (mismo orden):
+    columnas sentiment (positivo|neutral|negativo), confidence (0–1) y score (−1..1).
+    - confidence combina la fuerza del puntaje con el acuerdo entre señales
+      (palabras positivas y negativas mezcladas la bajan); un "neutral" sin
+      ninguna palabra del léxico tiene confianza baja (no hay evidencia).
+    """
+    texts = pd.Series(reviews, dtype="object").fillna("").astype(str)
+    idx, uniq = pd.factorize(texts.to_numpy())          # textos repetidos se puntúan una vez
+    uniq = pd.Series(uniq, dtype="object")
+    parts = []
+    for lo in range(0, len(uniq), max(1, SENTIMENT_LOCAL_CHUNK)):
+        chunk = uniq.iloc[lo:lo + SENTIMENT_LOCAL_CHUNK].reset_index(drop=True)
+        parts.append(np.vstack(_score_chunk(chunk)).astype(float))   # bincount sin palabras da int
+    s, pos, neg, hits = (np.hstack(parts) if parts else np.zeros((4, 0)))[:, idx]
+
+    score = s / np.sqrt(s * s + _ALPHA)
+    total = pos + neg
+    agree = np.divide(np.abs(pos - neg), total, out=np.zeros_like(total), where=total > 0)
+    label = np.where(score >= 0.25, "positivo", np.where(score <= -0.25, "negativo", "neutral"))
+    conf = np.where(label == "neutral",
+                    np.where(hits == 0, _NO_EVIDENCE, 1.0 - agree) * (1.0 - np.abs(score)),
+                    np.abs(score) * agree)
+    return pd.DataFrame({"sentiment": label, "confidence": np.round(conf, 3), "score": np.round(score, 3)})
+
+
 def summarize_reviews(reviews: List[str]) -> str:
     return f"{len(reviews)} comentarios analizados. (Demo local)"
+
+
 def score_sentiment(reviews: List[str]) -> List[Dict]:
-    out=[]; 
-    for r in reviews:
-        lab = "positivo" if any(x in r.lower() for x in ["bueno","excelente","me gusta"]) else "neutral"
-        out.append({"review": r[:120], "sentiment": lab})
-    return out
+    labels = lexicon_sentiment(reviews)["sentiment"].tolist()
+    return [{"review": str(r)[:120], "sentiment": lab} for r, lab in zip(reviews, labels)]
+
+
+_LABELS = ("positivo", "neutral", "negativo")
+UNCLASSIFIED = "sin_clasificar"     # etiqueta de las reviews que el modelo no pudo clasificar
+
+
+def sentiment_distribution(rows: Iterable[Union[Dict, str]]) -> Dict[str, Any]:
+    """
+    Distribución exacta en una pasada (sirve con generadores, memoria O(1)).
+    Acepta filas {"sentiment": ...} o etiquetas sueltas; lo desconocido cuenta como
+    neutral, salvo UNCLASSIFIED, que se cuenta aparte (fuera de total y ratio).
+    {"ratio": {"positivo": 0.5, "neutral": 0.2, "negativo": 0.3},
+     "counts": {"positivo": 50, "neutral": 20, "negativo": 30}, "total": 100, "unclassified": 0}
+    """
+    counts = dict.fromkeys(_LABELS, 0)
+    unclassified = 0
+    for row in rows:
+        lab = row.get("sentiment") if isinstance(row, dict) else row
+        if lab == UNCLASSIFIED:
+            unclassified += 1
+            continue
+        counts[lab if lab in counts else "neutral"] += 1
+    total = sum(counts.values())
+    ratio = {k: (v / total if total else 0.0) for k, v in counts.items()}
+    return {"ratio": ratio, "counts": counts, "total": total, "unclassified": unclassified}
@@ -6,16 +6,58 @@
 #     * API pública (si hay GOOGLE_API_KEY)
 # - Funciones principales:
 #     * summarize_reviews_gemini: resume reviews + plan de acción + respuesta pública
+#       (map-reduce en paralelo cuando el corpus no entra en un solo prompt)
 #     * score_sentiment_gemini: clasifica sentimiento por review (positivo/neutral/negativo)
 #     * generate_customer_reply_gemini: redacta una respuesta a un comentario individual
+#     * *_async: versiones asíncronas (client.aio) de las tres anteriores
+#     * extract_themes_gemini: temas de todo el corpus (clustering por embeddings +
+#       etiquetado de los clusters; solo tamaños y muestras viajan al modelo)
+#     * iter_customer_replies_gemini: respuestas en lote para todas las reviews
+#       negativas (una plantilla por grupo de quejas parecidas + apertura
+#       personalizada por review); write_replies las vuelca en CSV/JSONL
 # - El prompting sigue la metodología RATOS-D (Rol, Audiencia, Tarea, Objetivo, Señales, Do/Don't)
-# - Incluye parsers robustos para extraer JSON incluso si el modelo devuelve texto extra.
+# - Resumen y sentimiento usan plantillas con prefijo estático (services/prompt_templates.py):
+#   el prefijo se registra como caché de contexto y solo viajan las reviews.
+# - Límites de salida automáticos (services/token_budget.py): max_output_tokens=None
+#   dimensiona la salida según la cantidad de ítems.
+# - El sentimiento se clasifica en lotes paralelos con reintentos (backoff
+#   exponencial solo para 429/5xx/red); un lote con JSON inválido se re-parte
+#   en vez de degradar todo a "neutral". Los errores que reintentar no arregla
+#   (credenciales, permisos, argumento inválido, presupuesto) se propagan.
+# - Reviews duplicadas / casi duplicadas (services/review_dedup.py) viajan una
+#   sola vez: el sentimiento se replica a cada miembro y el resumen las pondera
+#   por su multiplicidad (REVIEW_DEDUP=0 desactiva).
+# - Cascada de sentimiento: el léxico local (services/feedback.py) etiqueta las
+#   reviews claras y solo las de baja confianza llegan a Gemini.
+# - Análisis incremental: las etiquetas se guardan por review + versión del
+#   clasificador (services/label_store.py); al re-subir un export solo se
+#   clasifican las reviews nuevas. Las etiquetas heredadas de un grupo de
+#   casi duplicados no se guardan.
+# - Pide salida JSON con response_schema (services/structured.py); los parsers por
+#   regex quedan como respaldo y cada parseo se cuenta en parse_stats().
 # -----------------------------------------------------------------------------
 
-import os, json, re
-from typing import List, Dict, Any, Optional
+import os, csv, json, math, re, time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import IO, Iterable, Iterator, List, Dict, Any, Optional, Tuple, Union
 from dotenv import load_dotenv
 
+from .genai_client import get_client, get_client_async
+from .image_prep import prepare_images
+from .structured import json_config, parse_json
+from .prompt_templates import register_template, with_context_cache, with_context_cache_async
+from .token_budget import (
+    BudgetExceeded, check_request, chunk_by_tokens, clip_to_tokens, estimate_tokens, output_budget,
+    record_usage, split_for_budget,
+)
+from .async_utils import gather_bounded
+from .review_dedup import REVIEW_DEDUP, group_reviews, normalize_review
+from .feedback import UNCLASSIFIED, lexicon_sentiment
+from .label_store import LABEL_STORE, label_store
+from .response_cache import make_key
+from .review_clusters import cluster_reviews, embed_texts_gemini
+
 load_dotenv()  # Carga variables de entorno desde .env (si existe) al proceso
 
 # -----------------------------
@@ -31,29 +73,19 @@ GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")  # Modelo por
 # -----------------------------
 def _client():
     """
-    Devuelve un cliente de google-genai.
+    Devuelve el cliente de google-genai compartido por el proceso.
     - Intenta primero Vertex AI si hay GCP_PROJECT (y credenciales válidas).
     - Si falla, usa API pública con GOOGLE_API_KEY (si existe).
-    - Si no hay nada configurado, levanta una excepción con instrucción.
+    - La validación de Vertex se cachea (ver services/genai_client.py), así que
+      varias llamadas seguidas (resumen + sentimiento + respuesta) no repiten models.list().
     """
-    from google import genai
-    if GCP_PROJECT:
-        try:
-            # Cliente en modo Vertex AI (requiere credenciales y API habilitada)
-            c = genai.Client(vertexai=True, project=GCP_PROJECT, location=GCP_LOCATION)
-            _ = c.models.list()  # Llamada simple para validar acceso
-            return c
-        except Exception:
-            # Si Vertex falla y hay API key, hacemos fallback a la API pública
-            if GOOGLE_API_KEY:
-                return genai.Client(api_key=GOOGLE_API_KEY)
-            # Sin fallback posible → propagamos error
-            raise
-    # Si no hay GCP_PROJECT, probamos con API key pública
-    if GOOGLE_API_KEY:
-        return genai.Client(api_key=GOOGLE_API_KEY)
-    # Nada configurado
-    raise RuntimeError("Configura GCP_PROJECT o GOOGLE_API_KEY.")
+    c, _ = get_client(GCP_LOCATION)
+    return c
+
+async def _client_async():
+    """Como _client, sin bloquear el event loop si hay que validar/crear el cliente."""
+    c, _ = await get_client_async(GCP_LOCATION)
+    return c
 
 # ---------- Helpers de compatibilidad para construir parts/contents ----------
 def _make_text_part(text: str):
@@ -100,7 +132,7 @@ def _build_contents_robusto(prompt: str, images: Optional[List[bytes]] = None):
         return prompt  # El cliente acepta 'contents' como string simple
     from google.genai import types
     parts = [_make_text_part(prompt)]
-    for b in images:
+    for b in prepare_images(images):  # reducidas, sin duplicados y dentro del presupuesto
         parts.append(_make_image_part(b, mime="image/jpeg"))
     return [types.Content(role="user", parts=parts)]
 
@@ -154,35 +186,72 @@ def _clip(s: str, n: int = 160) -> str:
     return (s[:n] + "…") if len(s) > n else s
 
 # -----------------------------
-# Resumen de reviews (RATOS-D) → JSON
+# Esquemas de salida estructurada (response_schema)
 # -----------------------------
-def summarize_reviews_gemini(
-    reviews: List[str],
-    temperature: float = 0.4,
-    top_p: float = 0.9,
-    max_output_tokens: int = 768,
-    max_reviews: int = 300
-) -> Dict[str, Any]:
-    """
-    Resume un conjunto de reviews y devuelve un JSON con:
-    {
-      "bullets": ["...", "...", "..."],          # 3–5 bullets concisos
-      "recommendation": "párrafo con acción prioritaria",
-      "sentiment_ratio": {"positivo":0.00,"neutral":0.00,"negativo":0.00},  # fracciones 0..1 (aprox.)
-      "action_plan": ["Paso; responsable; plazo", ...],                     # 3–5 pasos
-      "customer_reply": "Respuesta pública breve (3–6 oraciones)",
-      "sample_size": int,                          # tamaño de muestra usado (≤ max_reviews)
-      "raw": "texto original devuelto por el modelo (para debug)"
-    }
-    """
-    from google.genai import types
-    c = _client()
+# Describen exactamente los JSON que piden los prompts; con ellos el modelo
+# devuelve JSON válido y el parseo por regex queda solo como respaldo.
+_STR_LIST = {"type": "ARRAY", "items": {"type": "STRING"}}
 
-    # Subconjunto a analizar (limita el costo y el prompt)
-    subset = [str(x) for x in reviews[:max_reviews]]
+_SUMMARY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "bullets": _STR_LIST,
+        "recommendation": {"type": "STRING"},
+        "action_plan": _STR_LIST,
+        "customer_reply": {"type": "STRING"},
+        "sample_size": {"type": "INTEGER"},
+    },
+    "required": ["bullets", "recommendation", "action_plan", "customer_reply"],
+    "property_ordering": ["bullets", "recommendation", "action_plan", "customer_reply", "sample_size"],
+}
 
-    # Prompt siguiendo RATOS-D + formato JSON estricto
-    prompt = f"""
+_SENTIMENT_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "review": {"type": "STRING"},
+            "sentiment": {"type": "STRING", "enum": ["positivo", "neutral", "negativo"]},
+            "rationale": {"type": "STRING"},
+        },
+        "required": ["review", "sentiment", "rationale"],
+        "property_ordering": ["review", "sentiment", "rationale"],
+    },
+}
+
+# Protocolo compacto: el modelo NO repite la review, solo su id y un código
+# (1 = positivo, 0 = neutral, -1 = negativo), con o sin un motivo corto.
+_SENTIMENT_COMPACT_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "i": {"type": "INTEGER"},
+            "s": {"type": "INTEGER", "enum": [-1, 0, 1]},
+            "r": {"type": "STRING"},
+        },
+        "required": ["i", "s", "r"],
+        "property_ordering": ["i", "s", "r"],
+    },
+}
+
+_SENTIMENT_IDS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {"type": "ARRAY", "items": {"type": "INTEGER"}},  # [id, código]
+}
+
+_REPLY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"reply": {"type": "STRING"}},
+    "required": ["reply"],
+}
+
+# -----------------------------
+# Resumen de reviews (RATOS-D) → JSON
+# -----------------------------
+# Prefijo estático (se cachea como contexto, ver services/prompt_templates.py)
+# y bloque de datos al final con las reviews del lote.
+_SUMMARY_TEMPLATE = register_template("summary", """
 [ROL] Analista senior de Customer Experience en Perú.
 [AUDIENCIA] Equipo de producto/marketing y atención al cliente.
 [TAREA]
@@ -190,43 +259,66 @@ def summarize_reviews_gemini(
 2) Da 1 recomendación prioritaria (parrafo corto).
 3) Propón un plan de acción en 3–5 pasos (con responsable y plazo sugerido).
 4) Redacta una respuesta pública al cliente (3–6 oraciones, tono empático/profesional, sin admitir culpa legal).
-[DATOS] REVIEWS_JSON (UTF-8): {json.dumps(subset, ensure_ascii=False)}
+Los comentarios llegan al final, en [DATOS].
 [REGLAS]
 - Español claro, conciso, sin jerga técnica.
 - No inventes; usa solo patrones repetidos.
+- Un prefijo [xN] indica N reviews casi idénticas agrupadas: pondera ese patrón por N.
 - En la respuesta pública: agradece, reconoce la experiencia, ofrece canal de contacto y pide datos (orden, contacto) si corresponde.
 [FORMATO DE SALIDA — SOLO JSON]
 Devuelve únicamente:
-{{
+{
   "bullets": ["3 a 5 bullets; 8–18 palabras; sin punto final"],
   "recommendation": "1 párrafo con la acción prioritaria para mejorar CX",
-  "sentiment_ratio": {{"positivo":0.0,"neutral":0.0,"negativo":0.0}},
   "action_plan": ["Paso; Responsable; Plazo (ej. 2 semanas)", "…"],
   "customer_reply": "Respuesta pública breve (3–6 oraciones, tono empático)",
-  "sample_size": {len(subset)}
-}}
+  "sample_size": "número de reviews analizadas (SAMPLE_SIZE en [DATOS])"
+}
 [CHECKLIST]
 - ¿JSON válido? ¿3–5 bullets? ¿3–5 pasos en plan? ¿respuesta 3–6 oraciones? ¿sin texto extra?
-""".strip()
+""", """
+[DATOS] SAMPLE_SIZE: {n}
+REVIEWS_JSON (UTF-8): {reviews_json}
+""")
+
+def _summary_request(reviews: List[str], temperature: float, top_p: float,
+                     max_output_tokens: Optional[int], max_reviews: int,
+                     sample_size: Optional[int] = None):
+    """
+    Arma (contents, config, subset) del resumen; compartido por la versión sync y async.
+    sample_size: reviews reales representadas (con dedup, mayor que len(subset)).
+    """
+
+    # Subconjunto a analizar (limita el costo y el prompt)
+    subset = [str(x) for x in reviews[:max_reviews]]
+
+    # Prompt RATOS-D: prefijo estático de la plantilla + reviews al final
+    prompt = _SUMMARY_TEMPLATE.render(reviews_json=json.dumps(subset, ensure_ascii=False),
+                                     n=sample_size or len(subset))
 
     # Construcción robusta del 'contents' según versión del SDK
     contents = _build_contents_robusto(prompt, images=None)
 
-    # Configuración de sampling (controla creatividad y longitud)
-    cfg = types.GenerateContentConfig(
+    # Configuración de sampling (controla creatividad y longitud) + salida JSON con esquema
+    cfg = json_config(
+        _SUMMARY_SCHEMA,
         temperature=temperature,
         top_p=top_p,
-        max_output_tokens=max_output_tokens,
+        max_output_tokens=int(max_output_tokens or output_budget("summary")),
     )
+    return contents, cfg, subset
 
-    # Llamada al modelo
-    resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
-    text = (resp.text or "").strip()
-
+def _parse_summary(text: str, subset: List[str], strict: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Parsea y normaliza la salida del resumen (con fallback si no hay JSON).
+    strict=True devuelve None en vez del fallback (lo usa el map-reduce).
+    """
     # Parseo de JSON con fallback si falla
     try:
-        data = _extract_json_obj(text)
+        data = parse_json(text, _extract_json_obj, "summary")
     except Exception:
+        if strict:
+            return None
         # Fallback mínimo si no se pudo extraer JSON:
         bullets = []
         for s in subset[:5]:
@@ -236,7 +328,6 @@ Devuelve únicamente:
         return {
             "bullets": bullets[:5] or ["Sin datos"],
             "recommendation": "Revisar comentarios negativos y priorizar mejoras repetidas.",
-            "sentiment_ratio": {"positivo": 0.33, "neutral": 0.34, "negativo": 0.33},
             "action_plan": ["Revisar tickets abiertos; CX; 2 semanas"],
             "customer_reply": "¡Gracias por tu comentario! Queremos ayudarte. Escríbenos por DM con tu número de pedido para revisar tu caso y darte una solución.",
             "sample_size": len(subset),
@@ -258,20 +349,6 @@ Devuelve únicamente:
     if not reco:
         reco = "Prioriza una intervención concreta sobre el punto de mayor fricción repetido."
 
-    # Ratios → dict con fracciones 0..1 que sumen ~1 (si viene 0..100, reescalamos)
-    sr = data.get("sentiment_ratio") or {}
-    def _f(k):
-        try:
-            return float(sr.get(k, 0))
-        except Exception:
-            return 0.0
-    srn = {"positivo": _f("positivo"), "neutral": _f("neutral"), "negativo": _f("negativo")}
-    ssum = sum(srn.values())
-    if ssum > 0:
-        srn = {k: v / ssum for k, v in srn.items()}
-    else:
-        srn = {"positivo": 0.33, "neutral": 0.34, "negativo": 0.33}
-
     # Plan de acción → lista (máx. 5). Si viene str, lo partimos por separadores comunes.
     plan = data.get("action_plan") or []
     if isinstance(plan, str):
@@ -290,7 +367,6 @@ Devuelve únicamente:
     out = {
         "bullets": bullets or ["Sin hallazgos destacables."],
         "recommendation": reco,
-        "sentiment_ratio": srn,
         "action_plan": plan,
         "customer_reply": reply,
         "sample_size": int(data.get("sample_size") or len(subset)),
@@ -298,6 +374,186 @@ Devuelve únicamente:
     }
     return out
 
+def summarize_reviews_gemini(
+    reviews: List[str],
+    temperature: float = 0.4,
+    top_p: float = 0.9,
+    max_output_tokens: Optional[int] = None,
+    max_reviews: Optional[int] = None,
+    dedup: Optional[bool] = None
+) -> Dict[str, Any]:
+    """
+    Resume un conjunto de reviews y devuelve un JSON con:
+    {
+      "bullets": ["...", "...", "..."],          # 3–5 bullets concisos
+      "recommendation": "párrafo con acción prioritaria",
+      "action_plan": ["Paso; responsable; plazo", ...],                     # 3–5 pasos
+      "customer_reply": "Respuesta pública breve (3–6 oraciones)",
+      "sample_size": int,                          # reviews efectivamente resumidas
+      "raw": "texto original devuelto por el modelo (para debug)"
+    }
+    - max_reviews=None resume TODAS las reviews: si no entran en un prompt
+      (SUMMARY_CHUNK_TOKENS) se resumen por lotes en paralelo y se reducen
+      (map-reduce); sample_size suma los conteos reales de cada lote.
+    - max_output_tokens=None dimensiona la salida automáticamente (token_budget).
+    - dedup (None = REVIEW_DEDUP): los casi duplicados se envían una sola vez
+      con su multiplicidad ("[xN] texto") y pesan N en sample_size.
+    - La distribución de sentimiento NO sale de aquí: se cuenta exacta sobre las
+      etiquetas por review (feedback.sentiment_distribution).
+    """
+    c = _client()
+    chunks = _summary_chunks(reviews, max_reviews, dedup)
+    if len(chunks) <= 1:
+        only, n = chunks[0] if chunks else ([], 0)
+        contents, cfg, subset = _summary_request(only, temperature, top_p, max_output_tokens, len(only), n)
+        est = check_request(contents, cfg.max_output_tokens, c, GEMINI_MODEL)  # rechaza antes de enviar
+        contents, cfg = with_context_cache(c, GEMINI_MODEL, _SUMMARY_TEMPLATE, contents, cfg)  # prefijo desde caché (si aplica)
+
+        # Llamada al modelo
+        resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+        record_usage("summary", est, cfg.max_output_tokens, resp)
+        return _partial(_parse_summary((resp.text or "").strip(), subset), n)
+
+    def _call(kind, tpl, contents, cfg):
+        est = check_request(contents, cfg.max_output_tokens, c, GEMINI_MODEL)
+        contents, cfg = with_context_cache(c, GEMINI_MODEL, tpl, contents, cfg)
+        resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+        record_usage(kind, est, cfg.max_output_tokens, resp)
+        return (resp.text or "").strip()
+
+    def _map(item):
+        chunk, n = item
+        contents, cfg, _ = _summary_request(chunk, temperature, top_p, max_output_tokens, len(chunk), n)
+        return _retry(lambda: _partial(_parse_summary(_call("summary", _SUMMARY_TEMPLATE, contents, cfg),
+                                                      chunk, strict=True), n))
+
+    def _reduce(group):
+        if len(group) == 1:
+            return group[0]
+        contents, cfg = _reduce_request(group, temperature, top_p, max_output_tokens)
+        text = _retry(lambda: _call("summary_reduce", _REDUCE_TEMPLATE, contents, cfg))
+        return _merge_partials(group, text)
+
+    with ThreadPoolExecutor(max_workers=max(1, SUMMARY_CONCURRENCY)) as pool:
+        partials = [p for p in pool.map(_map, chunks) if p]
+        if not partials:
+            return _parse_summary("", [r for ch, _ in chunks for r in ch])
+        while len(partials) > 1:
+            groups = [partials[i:i + SUMMARY_REDUCE_FANIN] for i in range(0, len(partials), SUMMARY_REDUCE_FANIN)]
+            partials = list(pool.map(_reduce, groups))
+    return partials[0]
+
+# -----------------------------
+# Resumen map-reduce (corpus completo)
+# -----------------------------
+# - Map: lotes de ≤SUMMARY_CHUNK_TOKENS (estimados) resumidos en paralelo con el
+#   mismo esquema que el resumen simple.
+# - Reduce: los parciales se combinan de a SUMMARY_REDUCE_FANIN (jerárquico)
+#   hasta quedar uno; sample_size NO lo decide el modelo: es la suma de la
+#   cantidad real de reviews de cada lote.
+# - Un lote que falla (tras SUMMARY_RETRIES) se descarta y no suma.
+# - Una review que sola excede SUMMARY_CHUNK_TOKENS se recorta a ese tope (va
+#   sola en su lote) en vez de abortar el resumen.
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "24000"))  # entrada por lote (map)
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))       # lotes en vuelo
+SUMMARY_REDUCE_FANIN = max(2, int(os.getenv("SUMMARY_REDUCE_FANIN", "12")))  # parciales por reduce
+SUMMARY_RETRIES = int(os.getenv("SUMMARY_RETRIES", "1"))               # reintentos por lote
+
+_REDUCE_TEMPLATE = register_template("summary_reduce", """
+[ROL] Analista senior de Customer Experience en Perú.
+[AUDIENCIA] Equipo de producto/marketing y atención al cliente.
+[TAREA]
+Recibes, al final en [DATOS], RESÚMENES PARCIALES (JSON) de lotes de reviews del mismo negocio,
+cada uno con su sample_size. Combínalos en UN resumen global:
+1) 3–5 bullets con los patrones más repetidos (pondera por sample_size; prioriza lo que aparece en varios lotes).
+2) 1 recomendación prioritaria (parrafo corto).
+3) Plan de acción en 3–5 pasos (con responsable y plazo sugerido), sin pasos duplicados.
+4) Una respuesta pública al cliente (3–6 oraciones, tono empático/profesional, sin admitir culpa legal).
+[REGLAS]
+- Español claro, conciso, sin jerga técnica.
+- No inventes; usa solo lo que aparece en los parciales.
+- No copies un parcial completo: sintetiza.
+[FORMATO DE SALIDA — SOLO JSON]
+Devuelve únicamente:
+{
+  "bullets": ["3 a 5 bullets; 8–18 palabras; sin punto final"],
+  "recommendation": "1 párrafo con la acción prioritaria para mejorar CX",
+  "action_plan": ["Paso; Responsable; Plazo (ej. 2 semanas)", "…"],
+  "customer_reply": "Respuesta pública breve (3–6 oraciones, tono empático)",
+  "sample_size": "suma de los sample_size (SAMPLE_SIZE en [DATOS])"
+}
+[CHECKLIST]
+- ¿JSON válido? ¿3–5 bullets? ¿3–5 pasos en plan? ¿respuesta 3–6 oraciones? ¿sin texto extra?
+""", """
+[DATOS] SAMPLE_SIZE: {n}
+PARCIALES_JSON (UTF-8): {partials_json}
+""")
+
+def _summary_chunks(reviews: List[str], max_reviews: Optional[int],
+                    dedup: Optional[bool] = None) -> List[Tuple[List[str], int]]:
+    """
+    Reviews a resumir (todas si max_reviews=None) partidas en lotes por tokens.
+    Con dedup, cada grupo de casi duplicados viaja una sola vez como "[xN] texto".
+    Devuelve [(textos del lote, reviews reales que representa)].
+    """
+    subset = [str(x) for x in (reviews if max_reviews is None else reviews[:max_reviews])]
+    if REVIEW_DEDUP if dedup is None else dedup:
+        groups = group_reviews(subset)
+        items = list(zip(groups.representatives, groups.weights))
+    else:
+        items = [(r, 1) for r in subset]
+    marker = ' "[x00] ",'                                   # prefijo [xN] + sintaxis JSON de cada ítem
+    limit = max(1, SUMMARY_CHUNK_TOKENS - estimate_tokens(marker))
+    items = [(clip_to_tokens(t, limit), w) for t, w in items]
+    chunks = chunk_by_tokens(items, SUMMARY_CHUNK_TOKENS, text_of=lambda it: it[0] + marker)
+    return [([t if w == 1 else f"[x{w}] {t}" for t, w in ch], sum(w for _, w in ch)) for ch in chunks]
+
+def _retry(fn):
+    """Ejecuta fn hasta SUMMARY_RETRIES+1 veces; devuelve None si nunca da resultado."""
+    for attempt in range(SUMMARY_RETRIES + 1):
+        try:
+            out = fn()
+            if out:
+                return out
+        except Exception:
+            if attempt == SUMMARY_RETRIES:
+                return None
+    return None
+
+def _partial(out: Optional[Dict[str, Any]], n: int) -> Optional[Dict[str, Any]]:
+    """Fija el sample_size real del lote (el del modelo es solo orientativo)."""
+    if out is None:
+        return None
+    out["sample_size"] = n
+    return out
+
+def _reduce_request(partials: List[Dict[str, Any]], temperature: float, top_p: float,
+                    max_output_tokens: Optional[int]):
+    """Arma (contents, config) del paso reduce; compartido por sync y async."""
+    slim = [{k: v for k, v in p.items() if k != "raw"} for p in partials]
+    prompt = _REDUCE_TEMPLATE.render(
+        partials_json=json.dumps(slim, ensure_ascii=False),
+        n=sum(p["sample_size"] for p in partials),
+    )
+    cfg = json_config(
+        _SUMMARY_SCHEMA,
+        temperature=temperature,
+        top_p=top_p,
+        max_output_tokens=int(max_output_tokens or output_budget("summary")),
+    )
+    return _build_contents_robusto(prompt, images=None), cfg
+
+def _merge_partials(partials: List[Dict[str, Any]], text: Optional[str]) -> Dict[str, Any]:
+    """
+    Resultado del reduce con el sample_size total. Si el modelo falló, se
+    conserva el parcial más grande como texto.
+    """
+    merged = _parse_summary(text, [], strict=True) if text else None
+    if merged is None:
+        merged = dict(max(partials, key=lambda p: p["sample_size"]))
+    merged["sample_size"] = sum(p["sample_size"] for p in partials)
+    return merged
+
 # -----------------------------
 # Scoring de sentimiento (RATOS-D) → lista de dicts
 # -----------------------------
@@ -318,24 +574,8 @@ def _normalize_label(x: str) -> str:
         return xl
     return _SYNONYMS.get(xl, "neutral")
 
-def score_sentiment_gemini(
-    reviews: List[str],
-    temperature: float = 0.2,
-    top_p: float = 0.9,
-    max_output_tokens: int = 2048,
-    max_reviews: int = 200
-) -> List[Dict]:
-    """
-    Clasifica sentimiento por review, devolviendo una lista de dicts:
-    [{"review":"(≤160c)","sentiment":"positivo|neutral|negativo","rationale":"..."}]
-    """
-    from google.genai import types
-    c = _client()
-
-    subset = [str(x) for x in reviews[:max_reviews]]
-
-    # Prompt RATOS-D con formato de salida SOLO JSON (array)
-    sys = """
+# Prefijo estático de la clasificación (formato de salida SOLO JSON, array)
+_SENTIMENT_TEMPLATE = register_template("sentiment", """
 [ROL] Analista de sentimiento.
 [TAREA] Clasifica cada review en 'positivo', 'negativo' o 'neutral' y explica brevemente por qué.
 [REGLAS]
@@ -348,32 +588,131 @@ Devuelve SOLO un array JSON:
 ]
 [CHECKLIST]
 - ¿JSON válido? ¿Etiquetas SOLO entre positivo/neutral/negativo? ¿sin texto extra?
-""".strip()
+""", """
+REVIEWS_JSON:
+{reviews_json}
+""")
 
-    # Construcción robusta del 'contents'
-    prompt = sys + "\nREVIEWS_JSON:\n" + json.dumps(subset, ensure_ascii=False)
+# Variante compacta: reviews con id numérico; el modelo devuelve solo id + código
+_COMPACT_STATIC = """
+[ROL] Analista de sentimiento.
+[TAREA] Clasifica cada review (identificada por su id) como positiva, neutral o negativa.
+[REGLAS]
+- Usa solo el texto de cada review; no inventes hechos.
+- Códigos: 1 = positivo, 0 = neutral, -1 = negativo.
+- NO repitas el texto de la review.
+[FORMATO — SOLO JSON]
+{formato}
+[CHECKLIST]
+- ¿JSON válido? ¿UNA entrada por id recibido? ¿códigos solo 1/0/-1? ¿sin texto extra?
+"""
+_COMPACT_DATA = """
+REVIEWS_JSON ([id, texto]):
+{reviews_json}
+"""
+_SENTIMENT_COMPACT_TEMPLATE = register_template("sentiment_compact", _COMPACT_STATIC.replace("{formato}", """
+Devuelve SOLO un array JSON con un objeto por review:
+[{"i": id, "s": código, "r": "motivo en ≤8 palabras"}]
+""".strip()), _COMPACT_DATA)
+_SENTIMENT_IDS_TEMPLATE = register_template("sentiment_ids", _COMPACT_STATIC.replace("{formato}", """
+Devuelve SOLO un array JSON de pares [id, código], p. ej. [[1,1],[2,-1],[3,0]]
+""".strip()), _COMPACT_DATA)
+
+# Formatos de clasificación: (plantilla, esquema, tipo de presupuesto de salida)
+_SENTIMENT_MODES = {
+    "full": (_SENTIMENT_TEMPLATE, _SENTIMENT_SCHEMA, "sentiment"),
+    "compact": (_SENTIMENT_COMPACT_TEMPLATE, _SENTIMENT_COMPACT_SCHEMA, "sentiment_compact"),
+    "ids": (_SENTIMENT_IDS_TEMPLATE, _SENTIMENT_IDS_SCHEMA, "sentiment_ids"),
+}
+
+def _sentiment_mode(compact: Optional[bool], rationale: bool) -> str:
+    if compact is None:
+        compact = SENTIMENT_COMPACT
+    if not compact:
+        return "full"
+    return "compact" if rationale else "ids"
+
+def _sentiment_request(reviews: List[str], temperature: float, top_p: float,
+                       max_output_tokens: Optional[int], max_reviews: int, mode: str = "full"):
+    """
+    Arma (contents, config, subset) de la clasificación; compartido por sync y async.
+    La salida se dimensiona por cantidad de reviews (max_output_tokens actúa como tope).
+    En los modos compactos las reviews viajan como [id, texto] con id 1..n.
+    """
+    tpl, schema, kind = _SENTIMENT_MODES[mode]
+    subset = [str(x) for x in reviews[:max_reviews]]
+
+    # Prompt RATOS-D (prefijo estático de la plantilla) + reviews al final
+    payload = subset if mode == "full" else [[i + 1, r] for i, r in enumerate(subset)]
+    prompt = tpl.render(reviews_json=json.dumps(payload, ensure_ascii=False))
     contents = _build_contents_robusto(prompt, images=None)
 
-    # Configuración conservadora para clasificación (baja temperature)
-    cfg = types.GenerateContentConfig(
+    # Configuración conservadora para clasificación (baja temperature) + salida JSON con esquema
+    cfg = json_config(
+        schema,
         temperature=temperature,
         top_p=top_p,
-        max_output_tokens=max_output_tokens,
+        max_output_tokens=output_budget(kind, len(subset), cap=max_output_tokens),
     )
+    return contents, cfg, subset
 
-    # Llamada al modelo
-    resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
-    text = (resp.text or "").strip()
+_CODES = {1: "positivo", 0: "neutral", -1: "negativo"}
+
+def _parse_sentiment_compact(text: str, subset: List[str]) -> Optional[Dict[int, Dict]]:
+    """
+    Une la respuesta compacta ([id, código] o {"i","s","r"}) con el texto local.
+    Devuelve {posición: fila} con las ids válidas (puede ser parcial) o None si
+    no hay JSON.
+    """
+    try:
+        rows = parse_json(text, _extract_json_arr, "sentiment", expect=list)
+    except Exception:
+        return None
+    out: Dict[int, Dict] = {}
+    for r in rows:
+        try:
+            if isinstance(r, dict):
+                i, code, why = int(r.get("i")), int(r.get("s")), str(r.get("r") or "")
+            else:
+                i, code, why = int(r[0]), int(r[1]), (str(r[2]) if len(r) > 2 else "")
+        except (TypeError, ValueError, IndexError):
+            continue
+        if 1 <= i <= len(subset) and code in _CODES:
+            out[i - 1] = {"review": _clip(subset[i - 1]), "sentiment": _CODES[code], "rationale": _clip(why, 240)}
+    return out
 
+def _parse_sentiment(text: str, subset: List[str], strict: bool = False) -> Optional[List[Dict]]:
+    """
+    Parsea y limpia las filas de sentimiento (con fallback a neutrales).
+    strict=True exige una fila por review (alineadas por posición, con el texto
+    de entrada) y devuelve None si no se cumple, para reintentar o re-partir.
+    """
     # Intento de parsear como array JSON, con fallback simple
     try:
-        rows = _extract_json_arr(text)
+        rows = parse_json(text, _extract_json_arr, "sentiment", expect=list)
     except Exception:
+        if strict:
+            return None
         return [{"review": _clip(r), "sentiment": "neutral", "rationale": ""} for r in subset[:50]]
 
+    if strict:
+        rows = [r for r in rows if isinstance(r, dict)]
+        if len(rows) != len(subset):
+            return None
+        return [
+            {
+                "review": _clip(src),
+                "sentiment": _normalize_label(str(r.get("sentiment") or "neutral")),
+                "rationale": _clip(str(r.get("rationale") or ""), 240),
+            }
+            for src, r in zip(subset, rows)
+        ]
+
     # Limpieza y normalización de filas
     clean: List[Dict[str, Any]] = []
     for r in rows:
+        if not isinstance(r, dict):
+            continue
         review = _clip(str(r.get("review") or ""))
         label = _normalize_label(str(r.get("sentiment") or "neutral"))
         rationale = _clip(str(r.get("rationale") or ""), 240)
@@ -386,22 +725,384 @@ Devuelve SOLO un array JSON:
         clean = [{"review": _clip(r), "sentiment": "neutral", "rationale": ""} for r in subset[:50]]
     return clean
 
+# Clasificación por lotes
+# - Lotes de SENTIMENT_BATCH_SIZE reviews (o menos si no entran en el tope de
+#   salida), clasificados en paralelo (SENTIMENT_CONCURRENCY).
+# - Cada lote se reintenta SENTIMENT_RETRIES veces. Los errores transitorios
+#   (429, 5xx, timeouts de red) esperan SENTIMENT_BACKOFF_S·2^intento antes del
+#   siguiente intento; si persisten, las reviews del lote quedan sin clasificar.
+#   Cualquier otro error (401/403, 400, BudgetExceeded, …) se propaga y corta
+#   todo el job.
+# - Si el modelo responde pero el JSON es inválido o faltan filas, el lote se
+#   parte en dos y se reintenta cada mitad, hasta SENTIMENT_MAX_SPLIT_DEPTH
+#   niveles; lo que siga sin etiqueta queda sin clasificar.
+#   En el protocolo compacto solo se re-piden las ids que faltaron.
+# - Si NINGUNA review enviada al modelo se pudo clasificar, se lanza el último
+#   error (no se devuelve un resultado "todo neutral").
+# - Los resultados se unen en el orden original de las reviews.
+# - Cascada: el léxico local (services/feedback.py) resuelve las reviews con
+#   confianza ≥ SENTIMENT_LOCAL_MIN_CONFIDENCE y solo el resto va a Gemini.
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "25"))    # reviews por request
+SENTIMENT_COMPACT = os.getenv("SENTIMENT_COMPACT", "1").lower() in ("1", "true", "yes")  # protocolo id + código
+SENTIMENT_CONCURRENCY = int(os.getenv("SENTIMENT_CONCURRENCY", "8"))  # lotes en vuelo
+SENTIMENT_RETRIES = int(os.getenv("SENTIMENT_RETRIES", "1"))          # reintentos antes de re-partir
+SENTIMENT_BACKOFF_S = float(os.getenv("SENTIMENT_BACKOFF_S", "1.0"))  # espera base ante 429/5xx
+SENTIMENT_MAX_SPLIT_DEPTH = int(os.getenv("SENTIMENT_MAX_SPLIT_DEPTH", "2"))  # niveles de re-partición
+SENTIMENT_LOCAL_FIRST = os.getenv("SENTIMENT_LOCAL_FIRST", "1").lower() in ("1", "true", "yes")
+SENTIMENT_LOCAL_MIN_CONFIDENCE = float(os.getenv("SENTIMENT_LOCAL_MIN_CONFIDENCE", "0.5"))
+_FAILED = "_failed"   # marca interna de filas de respaldo (se quita antes de devolver)
+_COPIED = "_copied"   # marca interna de filas heredadas del representante del grupo (no se guardan)
+
+def _local_tier(subset: List[str], local_first: Optional[bool]):
+    """
+    Primer nivel de la cascada: filas resueltas por el léxico local (None =
+    confianza baja) y posiciones que hay que escalar a Gemini.
+    """
+    if not (SENTIMENT_LOCAL_FIRST if local_first is None else local_first):
+        return [None] * len(subset), list(range(len(subset)))
+    lex = lexicon_sentiment(subset)
+    rows: List[Optional[Dict]] = [None] * len(subset)
+    pending: List[int] = []
+    for i, (lab, conf) in enumerate(zip(lex["sentiment"].tolist(), lex["confidence"].tolist())):
+        if conf >= SENTIMENT_LOCAL_MIN_CONFIDENCE:
+            rows[i] = {"review": _clip(subset[i]), "sentiment": lab,
+                       "rationale": f"Léxico local (confianza {conf:.2f})"}
+        else:
+            pending.append(i)
+    return rows, pending
+
+def _merge_tiers(rows: List[Optional[Dict]], pending: List[int], model_rows: List[Dict]) -> List[Dict]:
+    for i, row in zip(pending, model_rows):
+        rows[i] = row
+    return rows
+
+def _sentiment_batches(subset: List[str], max_output_tokens: Optional[int],
+                       mode: str = "full", dedup: Optional[bool] = None):
+    """
+    Lotes a clasificar y, con dedup, la agrupación de casi duplicados
+    (solo viaja un representante por grupo). Devuelve (lotes, grupos | None).
+    """
+    groups = group_reviews(subset) if (REVIEW_DEDUP if dedup is None else dedup) else None
+    targets = groups.representatives if groups is not None else subset
+    batches = split_for_budget(targets, _SENTIMENT_MODES[mode][2], max_output=max_output_tokens,
+                               max_items=SENTIMENT_BATCH_SIZE)
+    return batches, groups
+
+def _expand(rows: List[Dict], groups) -> List[Dict]:
+    """
+    Una fila por review original: cada miembro hereda la etiqueta de su grupo.
+    Las filas copiadas (todas menos la del representante) quedan marcadas.
+    """
+    if groups is None:
+        return rows
+    out = groups.expand(rows, _clip)
+    for i, g in enumerate(groups.group_of):
+        if groups.first[g] != i:
+            out[i][_COPIED] = True
+    return out
+
+def _parse_batch(text: str, batch: List[str], mode: str) -> Optional[Dict[int, Dict]]:
+    """{posición: fila} de un lote; el modo completo es todo o nada."""
+    if mode != "full":
+        return _parse_sentiment_compact(text, batch)
+    rows = _parse_sentiment(text, batch, strict=True)
+    return dict(enumerate(rows)) if rows is not None else None
+
+def _unclassified(batch: List[str]) -> List[Dict]:
+    """
+    Filas de respaldo cuando el modelo no pudo clasificar: etiqueta UNCLASSIFIED
+    (fuera de la distribución) y sin guardar en el store.
+    """
+    return [{"review": _clip(r), "sentiment": UNCLASSIFIED, "rationale": "No se pudo clasificar", _FAILED: True}
+            for r in batch]
+
+def _retryable(e: BaseException) -> bool:
+    """True para errores transitorios (429, 408, 5xx, red); False si reintentar no sirve."""
+    if isinstance(e, BudgetExceeded):
+        return False
+    code = getattr(e, "code", None)                 # google.genai.errors.APIError (código HTTP)
+    if isinstance(code, int) and code >= 400:
+        return code in (408, 429) or code >= 500
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(e, httpx.TransportError)
+
+def _backoff_s(attempt: int) -> float:
+    return min(30.0, SENTIMENT_BACKOFF_S * (2.0 ** attempt))
+
+def _resolve_failed(batch: List[str], done: Dict[int, Dict], depth: int, transient: bool):
+    """
+    Qué hacer con lo que quedó sin etiqueta tras los reintentos:
+    ("ok" | "unclassified" | "retry" | "split", posiciones pendientes).
+    """
+    pending = [i for i in range(len(batch)) if i not in done]
+    if not pending:
+        return "ok", pending
+    if transient or depth >= SENTIMENT_MAX_SPLIT_DEPTH or len(batch) == 1:
+        return "unclassified", pending
+    return ("retry" if len(pending) < len(batch) else "split"), pending
+
+def _check_job(rows: List[Dict], errors: List[BaseException]) -> None:
+    """Lanza si ninguna review enviada al modelo obtuvo etiqueta."""
+    if rows and all(r.get(_FAILED) for r in rows):
+        if errors:
+            raise errors[-1]
+        raise RuntimeError(f"Gemini no devolvió clasificaciones válidas para ninguna de las {len(rows)} reviews")
+
+def _label_version(mode: str, local_first: Optional[bool]) -> str:
+    """Versión del clasificador: cambia con el modelo, el prompt o la cascada."""
+    local = SENTIMENT_LOCAL_FIRST if local_first is None else local_first
+    return make_key(GEMINI_MODEL, _SENTIMENT_MODES[mode][0].digest, mode,
+                    SENTIMENT_LOCAL_MIN_CONFIDENCE if local else None)[:16]
+
+def _stored_tier(subset: List[str], version: str, use_store: Optional[bool]):
+    """Etiquetas ya guardadas en el store (None = falta) y posiciones a clasificar."""
+    if not (LABEL_STORE if use_store is None else use_store):
+        return None, [None] * len(subset), list(range(len(subset)))
+    store = label_store()
+    hit = store.get_many(version, subset)
+    known: List[Optional[Dict]] = [{"review": _clip(r), **hit[i]} if i in hit else None
+                                   for i, r in enumerate(subset)]
+    return store, known, [i for i in range(len(subset)) if i not in hit]
+
+def _finish(store, version: str, subset: List[str], known: List[Optional[Dict]],
+            todo: List[int], new_rows: List[Dict]) -> List[Dict]:
+    """
+    Guarda en el store las etiquetas nuevas propias de cada review (no las de
+    respaldo ni las heredadas de su grupo) y une todo en orden.
+    """
+    keep = []
+    for i, row in zip(todo, new_rows):
+        failed, copied = row.pop(_FAILED, False), row.pop(_COPIED, False)
+        if not (failed or copied):
+            keep.append((subset[i], row))
+    if store is not None and keep:
+        store.put_many(version, [r for r, _ in keep], [row for _, row in keep])
+    return _merge_tiers(known, todo, new_rows)
+
+def estimate_sentiment_calls(reviews: List[str], local_first: Optional[bool] = None) -> Dict[str, int]:
+    """
+    Cota superior de lo que score_sentiment_gemini enviaría a Gemini:
+    {"reviews": a clasificar, "to_model": dudosas para el léxico, "calls": requests}.
+    El store y la agrupación de duplicados solo pueden bajarla.
+    """
+    subset = [str(x) for x in reviews]
+    _, pending = _local_tier(subset, local_first)
+    return {"reviews": len(subset), "to_model": len(pending),
+            "calls": math.ceil(len(pending) / max(1, SENTIMENT_BATCH_SIZE))}
+
+def score_sentiment_gemini(
+    reviews: List[str],
+    temperature: float = 0.2,
+    top_p: float = 0.9,
+    max_output_tokens: Optional[int] = None,
+    max_reviews: int = 200,
+    compact: Optional[bool] = None,
+    rationale: bool = True,
+    dedup: Optional[bool] = None,
+    local_first: Optional[bool] = None,
+    use_store: Optional[bool] = None
+) -> List[Dict]:
+    """
+    Clasifica sentimiento por review, devolviendo una lista de dicts
+    (una fila por review, en el mismo orden de entrada):
+    [{"review":"(≤160c)","sentiment":"positivo|neutral|negativo","rationale":"..."}]
+    - Las reviews que el modelo no pudo clasificar llevan sentiment
+      feedback.UNCLASSIFIED; si no se pudo ninguna, se lanza el error.
+    - max_output_tokens es el tope POR REQUEST (None = automático).
+    - compact (None = SENTIMENT_COMPACT): el modelo devuelve solo id + código y
+      el texto se une localmente; rationale=False omite también el motivo.
+    - dedup (None = REVIEW_DEDUP): los duplicados y casi duplicados se
+      clasifican una sola vez y heredan la etiqueta de su representante.
+    - local_first (None = SENTIMENT_LOCAL_FIRST): el léxico local etiqueta lo
+      que tiene confianza alta y solo las reviews dudosas se envían al modelo.
+    - use_store (None = LABEL_STORE): las reviews ya etiquetadas con la misma
+      versión (modelo + prompt + cascada) se leen del store y no se re-clasifican.
+    """
+    c = _client()
+    mode = _sentiment_mode(compact, rationale)
+    tpl = _SENTIMENT_MODES[mode][0]
+
+    def _once(batch: List[str]) -> Optional[Dict[int, Dict]]:
+        contents, cfg, _ = _sentiment_request(batch, temperature, top_p, max_output_tokens, len(batch), mode)
+        est = check_request(contents, cfg.max_output_tokens, c, GEMINI_MODEL)
+        contents, cfg = with_context_cache(c, GEMINI_MODEL, tpl, contents, cfg)  # prefijo desde caché (si aplica)
+
+        # Llamada al modelo
+        resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+        record_usage("sentiment", est, cfg.max_output_tokens, resp)
+        return _parse_batch((resp.text or "").strip(), batch, mode)
+
+    errors: List[BaseException] = []          # errores transitorios vistos (el último se lanza si todo falla)
+    fatal: List[BaseException] = []           # error no recuperable: los lotes en cola no llaman al modelo
+
+    def _classify(batch: List[str], depth: int = 0) -> List[Dict]:
+        if fatal:
+            raise fatal[0]
+        done: Dict[int, Dict] = {}
+        transient = False
+        for attempt in range(SENTIMENT_RETRIES + 1):
+            pending = [i for i in range(len(batch)) if i not in done]
+            if not pending:
+                break
+            try:
+                got = _once([batch[i] for i in pending]) or {}
+                done.update({pending[j]: row for j, row in got.items()})
+                transient = False
+            except Exception as e:
+                if not _retryable(e):
+                    fatal.append(e)
+                    raise
+                errors.append(e)
+                transient = True
+                if attempt < SENTIMENT_RETRIES:
+                    time.sleep(_backoff_s(attempt))
+        action, pending = _resolve_failed(batch, done, depth, transient)
+        if action == "unclassified":
+            done.update(zip(pending, _unclassified([batch[i] for i in pending])))
+        elif action == "retry":                                # hubo avance: nuevo intento solo con lo que falta
+            done.update(zip(pending, _classify([batch[i] for i in pending], depth + 1)))
+        elif action == "split":                                # nada avanzó: re-partir en dos
+            mid = len(batch) // 2
+            done.update(enumerate(_classify(batch[:mid], depth + 1) + _classify(batch[mid:], depth + 1)))
+        return [done[i] for i in range(len(batch))]
+
+    subset = [str(x) for x in reviews[:max_reviews]]
+    version = _label_version(mode, local_first)
+    store, known, todo = _stored_tier(subset, version, use_store)   # solo lo no visto sigue
+    fresh = [subset[i] for i in todo]
+    local, pending = _local_tier(fresh, local_first)
+    batches, groups = _sentiment_batches([fresh[i] for i in pending], max_output_tokens, mode, dedup)
+    if len(batches) <= 1:
+        rows = _classify(batches[0]) if batches else []
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, SENTIMENT_CONCURRENCY)) as pool:
+            rows = [row for rows in pool.map(_classify, batches) for row in rows]  # orden original
+    _check_job(rows, errors)
+    new_rows = _merge_tiers(local, pending, _expand(rows, groups))
+    return _finish(store, version, subset, known, todo, new_rows)
+
 # -----------------------------
-# Respuesta a un comentario individual
+# Temas del corpus (clustering + etiquetado)
 # -----------------------------
-def generate_customer_reply_gemini(
-    comment: str,
-    brand_name: Optional[str] = None,
-    temperature: float = 0.4,
+# - services/review_clusters.py agrupa TODAS las reviews por embeddings
+#   (locales o de Gemini) con k-means; al modelo solo viajan, por cluster, su
+#   tamaño, palabras clave y unas pocas reviews representativas.
+# - El modelo solo nombra y describe cada cluster; tamaños y proporciones son
+#   conteos exactos.
+THEMES_SAMPLES = int(os.getenv("THEMES_SAMPLES", "5"))              # reviews representativas por cluster
+THEMES_EMBEDDINGS = os.getenv("THEMES_EMBEDDINGS", "local").lower()  # local | gemini
+
+_THEMES_TEMPLATE = register_template("themes", """
+[ROL] Analista senior de Customer Experience en Perú.
+[AUDIENCIA] Equipo de producto/marketing y atención al cliente.
+[TAREA]
+Recibes, al final en [DATOS], CLUSTERS de reviews de clientes (agrupados automáticamente).
+Cada cluster trae su id, tamaño (size), proporción (share), palabras clave y reviews representativas.
+Para CADA cluster:
+1) label: nombre del tema en ≤5 palabras (p. ej., "Demoras en la entrega").
+2) summary: 1 frase con lo que dicen los clientes.
+3) sentiment: sentimiento predominante (positivo|neutral|negativo).
+4) action: 1 acción concreta sugerida (≤15 palabras).
+[REGLAS]
+- Español claro, conciso, sin jerga técnica.
+- Usa solo lo que muestran las palabras clave y las reviews del cluster; no inventes.
+- Si dos clusters tratan el mismo tema, usa el mismo label.
+[FORMATO DE SALIDA — SOLO JSON]
+Devuelve SOLO un array JSON con una entrada por cluster recibido:
+[
+  {"id": 0, "label": "…", "summary": "…", "sentiment": "positivo|neutral|negativo", "action": "…"}
+]
+[CHECKLIST]
+- ¿JSON válido? ¿UNA entrada por id recibido? ¿labels ≤5 palabras? ¿sin texto extra?
+""", """
+[DATOS] N_REVIEWS: {n}
+CLUSTERS_JSON (UTF-8): {clusters_json}
+""")
+
+_THEMES_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "INTEGER"},
+            "label": {"type": "STRING"},
+            "summary": {"type": "STRING"},
+            "sentiment": {"type": "STRING", "enum": ["positivo", "neutral", "negativo"]},
+            "action": {"type": "STRING"},
+        },
+        "required": ["id", "label", "summary", "sentiment", "action"],
+        "property_ordering": ["id", "label", "summary", "sentiment", "action"],
+    },
+}
+
+def extract_themes_gemini(
+    reviews: List[str],
+    k: Optional[int] = None,
+    embeddings: Optional[str] = None,
+    temperature: float = 0.3,
     top_p: float = 0.9,
-    max_output_tokens: int = 512
-) -> Dict[str, str]:
+    max_output_tokens: Optional[int] = None
+) -> Dict[str, Any]:
     """
-    Genera una respuesta pública (3–6 oraciones) para un comentario individual.
-    Devuelve: {"reply":"..."}; en caso de error devuelve un reply genérico.
+    Temas de TODO el corpus:
+    {
+      "themes": [{"id", "label", "summary", "sentiment", "action",
+                  "size", "share", "keywords", "samples"}],   # por tamaño, desc.
+      "labels": [id de tema de cada review (mismo orden que la entrada)],
+      "n_reviews": int
+    }
+    - k=None → CLUSTER_K o automático (√(n/2), entre 2 y 30).
+    - embeddings (None = THEMES_EMBEDDINGS): "local" (determinista, sin API) o "gemini".
+    - Si el etiquetado falla, cada tema se nombra con sus palabras clave.
     """
-    from google.genai import types
     c = _client()
+    embed = (lambda texts: embed_texts_gemini(texts, c)) if (embeddings or THEMES_EMBEDDINGS) == "gemini" else None
+    clusters = cluster_reviews([str(x) for x in reviews], k=k, embed=embed, samples=THEMES_SAMPLES)
+    themes = [dict(cl) for cl in clusters.clusters]
+    if not themes:
+        return {"themes": [], "labels": [], "n_reviews": 0}
+
+    payload = [{"id": t["id"], "size": t["size"], "share": round(t["share"], 4), "keywords": t["keywords"],
+                "samples": [_clip(x, 200) for x in t["samples"]]} for t in themes]
+    prompt = _THEMES_TEMPLATE.render(clusters_json=json.dumps(payload, ensure_ascii=False), n=len(reviews))
+    contents = _build_contents_robusto(prompt, images=None)
+    cfg = json_config(
+        _THEMES_SCHEMA,
+        temperature=temperature,
+        top_p=top_p,
+        max_output_tokens=int(max_output_tokens or output_budget("theme", len(themes))),
+    )
+    named: Dict[int, Dict[str, Any]] = {}
+    try:
+        est = check_request(contents, cfg.max_output_tokens, c, GEMINI_MODEL)
+        contents, cfg = with_context_cache(c, GEMINI_MODEL, _THEMES_TEMPLATE, contents, cfg)
+        resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+        record_usage("theme", est, cfg.max_output_tokens, resp)
+        for row in parse_json((resp.text or "").strip(), _extract_json_arr, "themes", expect=list):
+            if isinstance(row, dict) and str(row.get("id", "")).lstrip("-").isdigit():
+                named[int(row["id"])] = row
+    except Exception:
+        pass
+
+    for t in themes:
+        row = named.get(t["id"], {})
+        t["label"] = _clip(str(row.get("label") or ", ".join(t["keywords"][:3]) or f"Tema {t['id']}"), 80)
+        t["summary"] = _clip(str(row.get("summary") or ""), 240)
+        t["sentiment"] = _normalize_label(str(row.get("sentiment") or "neutral"))
+        t["action"] = _clip(str(row.get("action") or ""), 160)
+    return {"themes": themes, "labels": clusters.labels, "n_reviews": len(reviews)}
+
+# -----------------------------
+# Respuesta a un comentario individual
+# -----------------------------
+def _reply_request(comment: str, brand_name: Optional[str], temperature: float,
+                   top_p: float, max_output_tokens: Optional[int]):
+    """Arma (contents, config) de la respuesta individual; compartido por sync y async."""
 
     # Prompt RATOS-D con reglas para no admitir culpa legal ni prometer cosas inexistentes
     prompt = f"""
@@ -426,18 +1127,18 @@ def generate_customer_reply_gemini(
     # Construcción robusta del 'contents'
     contents = _build_contents_robusto(prompt, images=None)
 
-    # Config de generación (moderada)
-    cfg = types.GenerateContentConfig(
-        temperature=temperature, top_p=top_p, max_output_tokens=max_output_tokens
+    # Config de generación (moderada) + salida JSON con esquema
+    cfg = json_config(
+        _REPLY_SCHEMA, temperature=temperature, top_p=top_p,
+        max_output_tokens=int(max_output_tokens or output_budget("reply")),
     )
+    return contents, cfg
 
-    # Llamada al modelo
-    resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
-    text = (resp.text or "").strip()
-
+def _parse_reply(text: str) -> Dict[str, str]:
+    """Extrae {"reply": ...} o devuelve un reply genérico."""
     # Parseo rígido de JSON con fallback amigable
     try:
-        data = _extract_json_obj(text)
+        data = parse_json(text, _extract_json_obj, "reply")
         reply = str(data.get("reply", "")).strip()
         if not reply:
             raise ValueError("sin campo reply")
@@ -447,3 +1148,385 @@ def generate_customer_reply_gemini(
         return {
             "reply": "¡Gracias por escribirnos! Queremos ayudarte con tu caso. Por favor envíanos un mensaje directo con tu número de pedido y datos de contacto para revisar lo ocurrido y darte una solución."
         }
+
+def generate_customer_reply_gemini(
+    comment: str,
+    brand_name: Optional[str] = None,
+    temperature: float = 0.4,
+    top_p: float = 0.9,
+    max_output_tokens: Optional[int] = None
+) -> Dict[str, str]:
+    """
+    Genera una respuesta pública (3–6 oraciones) para un comentario individual.
+    Devuelve: {"reply":"..."}; en caso de error devuelve un reply genérico.
+    """
+    c = _client()
+    contents, cfg = _reply_request(comment, brand_name, temperature, top_p, max_output_tokens)
+    est = check_request(contents, cfg.max_output_tokens, c, GEMINI_MODEL)
+
+    # Llamada al modelo
+    resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+    record_usage("reply", est, cfg.max_output_tokens, resp)
+    return _parse_reply((resp.text or "").strip())
+
+# -----------------------------
+# Respuestas en lote (todas las reviews negativas)
+# -----------------------------
+# - Las quejas parecidas se agrupan con services/review_clusters.py (≈REPLY_GROUP_SIZE
+#   reviews por grupo) y Gemini redacta UNA plantilla de respuesta por grupo.
+# - Personalización barata: una frase de apertura por review (salida corta),
+#   pedida en lotes de REPLY_OPENER_BATCH y una sola vez por texto repetido.
+# - Los grupos se procesan en paralelo (REPLY_CONCURRENCY) y sus filas se
+#   entregan apenas termina cada grupo, sin esperar al resto.
+REPLY_GROUP_SIZE = int(os.getenv("REPLY_GROUP_SIZE", "50"))        # reviews por plantilla (aprox.)
+REPLY_MAX_GROUPS = int(os.getenv("REPLY_MAX_GROUPS", "200"))       # tope de plantillas por corrida
+REPLY_OPENER_BATCH = int(os.getenv("REPLY_OPENER_BATCH", "40"))    # aperturas por request
+REPLY_CONCURRENCY = int(os.getenv("REPLY_CONCURRENCY", "8"))       # grupos en vuelo
+
+_REPLY_GROUP_TEMPLATE = register_template("reply_group", """
+[ROL] Agente senior de atención al cliente.
+[TAREA]
+Recibes, al final en [DATOS], varias quejas de clientes sobre el MISMO problema.
+Redacta UNA respuesta pública (2–5 oraciones) que sirva para cualquiera de ellas.
+[REGLAS]
+- Español peruano, tono empático y profesional.
+- NO empieces con saludo ni agradecimiento: antes de tu texto se antepone una
+  frase personalizada para cada cliente. Empieza por la solución o el siguiente paso.
+- Ofrece canal directo y solicita datos (orden, contacto).
+- No menciones detalles que no aparezcan en TODAS las quejas (montos, fechas, productos).
+- No admitir culpa legal; no prometer algo que no exista.
+- Evitar emojis y mayúsculas sostenidas.
+[FORMATO — SOLO JSON]
+{
+  "reply": "texto de la respuesta (2–5 oraciones)"
+}
+""", """
+[DATOS] MARCA: {brand}
+PALABRAS_CLAVE: {keywords}
+QUEJAS_JSON (UTF-8): {samples_json}
+""")
+
+_REPLY_OPENER_TEMPLATE = register_template("reply_opener", """
+[ROL] Agente senior de atención al cliente.
+[TAREA]
+Para CADA review en [DATOS], escribe una frase de apertura (≤25 palabras) que
+agradezca y reconozca el problema CONCRETO que cuenta ese cliente.
+[REGLAS]
+- Español peruano, empático; trato de "tú".
+- Solo una frase; sin pedir datos ni ofrecer soluciones (eso va después).
+- No admitir culpa legal; no inventar detalles que la review no diga.
+[FORMATO — SOLO JSON]
+Devuelve SOLO un array con una entrada por review, mismo "i":
+[
+  {"i": 0, "opener": "…"}
+]
+""", """
+[DATOS] MARCA: {brand}
+REVIEWS_JSON (UTF-8): {reviews_json}
+""")
+
+_REPLY_OPENER_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"i": {"type": "INTEGER"}, "opener": {"type": "STRING"}},
+        "required": ["i", "opener"],
+        "property_ordering": ["i", "opener"],
+    },
+}
+
+_REPLY_FIELDS = ("index", "review", "group", "keywords", "reply", "template")
+_GENERIC_OPENER = "Gracias por contarnos tu experiencia y lamentamos lo ocurrido."
+
+def _draft_group_reply(c, cluster: Dict[str, Any], brand: str, temperature: float, top_p: float) -> str:
+    """Plantilla de respuesta del grupo (o el reply genérico de _parse_reply si falla)."""
+    samples = [_clip(x, 300) for x in cluster["samples"]]
+    prompt = _REPLY_GROUP_TEMPLATE.render(
+        samples_json=json.dumps(samples, ensure_ascii=False),
+        keywords=", ".join(cluster["keywords"]), brand=brand,
+    )
+    contents = _build_contents_robusto(prompt, images=None)
+    cfg = json_config(_REPLY_SCHEMA, temperature=temperature, top_p=top_p,
+                      max_output_tokens=output_budget("reply"))
+    try:
+        est = check_request(contents, cfg.max_output_tokens, c, GEMINI_MODEL)
+        contents, cfg = with_context_cache(c, GEMINI_MODEL, _REPLY_GROUP_TEMPLATE, contents, cfg)
+        resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+        record_usage("reply", est, cfg.max_output_tokens, resp)
+        text = (resp.text or "").strip()
+    except Exception:
+        text = ""
+    return _parse_reply(text)["reply"]
+
+def _draft_openers(c, texts: List[str], brand: str, temperature: float, top_p: float) -> Dict[int, str]:
+    """{posición: apertura} de un lote; lo que falte o falle queda sin apertura."""
+    payload = [{"i": i, "review": _clip(t, 300)} for i, t in enumerate(texts)]
+    prompt = _REPLY_OPENER_TEMPLATE.render(reviews_json=json.dumps(payload, ensure_ascii=False), brand=brand)
+    contents = _build_contents_robusto(prompt, images=None)
+    cfg = json_config(_REPLY_OPENER_SCHEMA, temperature=temperature, top_p=top_p,
+                      max_output_tokens=output_budget("reply_opener", len(texts)))
+    try:
+        est = check_request(contents, cfg.max_output_tokens, c, GEMINI_MODEL)
+        contents, cfg = with_context_cache(c, GEMINI_MODEL, _REPLY_OPENER_TEMPLATE, contents, cfg)
+        resp = c.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+        record_usage("reply_opener", est, cfg.max_output_tokens, resp)
+        data = parse_json((resp.text or "").strip(), _extract_json_arr, "reply_opener", expect=list)
+    except Exception:
+        return {}
+    out: Dict[int, str] = {}
+    for row in data:
+        if not isinstance(row, dict) or not str(row.get("i", "")).isdigit():
+            continue
+        i, opener = int(row["i"]), str(row.get("opener") or "").strip()
+        if i < len(texts) and opener:
+            out[i] = _clip(opener, 200)
+    return out
+
+def _reply_labels(labels: Iterable[Union[Dict, str]]) -> List[str]:
+    return [_normalize_label(str(x.get("sentiment", "")) if isinstance(x, dict) else str(x)) for x in labels]
+
+def iter_customer_replies_gemini(
+    reviews: List[str],
+    brand_name: Optional[str] = None,
+    labels: Optional[Iterable[Union[Dict, str]]] = None,
+    only_negative: bool = True,
+    personalize: bool = True,
+    temperature: float = 0.4,
+    top_p: float = 0.9
+) -> Iterator[Dict[str, Any]]:
+    """
+    Respuestas públicas en lote, entregadas a medida que termina cada grupo:
+    {"index", "review", "group", "keywords", "reply", "template"}
+    - index = posición en 'reviews' (las filas NO llegan en orden).
+    - labels: sentimiento de cada review (filas de score_sentiment* o etiquetas,
+      mismo orden); None → léxico local (services/feedback.py).
+    - only_negative=False responde todas las reviews.
+    - personalize=False usa solo la plantilla del grupo (sin aperturas).
+    Memoria/tiempo: ~n/REPLY_GROUP_SIZE plantillas + n/REPLY_OPENER_BATCH requests
+    cortos, en vez de n respuestas completas.
+    """
+    texts = [str(r) for r in reviews]
+    if only_negative:
+        labs = _reply_labels(labels) if labels is not None else lexicon_sentiment(texts)["sentiment"].tolist()
+        idx = [i for i, lab in zip(range(len(texts)), labs) if lab == "negativo"]
+    else:
+        idx = list(range(len(texts)))
+    if not idx:
+        return
+
+    c = _client()
+    brand = brand_name or "n/a"
+    selected = [texts[i] for i in idx]
+    norms = [normalize_review(t) for t in selected]
+    k = max(1, min(REPLY_MAX_GROUPS, math.ceil(len(selected) / max(1, REPLY_GROUP_SIZE))))
+    clusters = cluster_reviews(selected, k=k)
+    members: Dict[int, List[int]] = {}
+    for pos, g in enumerate(clusters.labels):
+        members.setdefault(g, []).append(pos)
+
+    def _group(cluster: Dict[str, Any]) -> List[Dict[str, Any]]:
+        mine = members.get(cluster["id"], [])
+        template = _draft_group_reply(c, cluster, brand, temperature, top_p)
+        openers: Dict[str, str] = {}
+        if personalize:
+            first: Dict[str, str] = {}                 # texto normalizado → primera review (repetidas: una vez)
+            for p in mine:
+                first.setdefault(norms[p], selected[p])
+            uniq = list(first)
+            for lo in range(0, len(uniq), max(1, REPLY_OPENER_BATCH)):
+                part = uniq[lo:lo + REPLY_OPENER_BATCH]
+                got = _draft_openers(c, [first[u] for u in part], brand, temperature, top_p)
+                openers.update((part[j], o) for j, o in got.items())
+        kw = ", ".join(cluster["keywords"][:3])
+        rows = []
+        for p in mine:
+            opener = openers.get(norms[p], _GENERIC_OPENER if personalize else "")
+            rows.append({
+                "index": idx[p],
+                "review": selected[p],
+                "group": cluster["id"],
+                "keywords": kw,
+                "reply": f"{opener} {template}".strip(),
+                "template": template,
+            })
+        return rows
+
+    with ThreadPoolExecutor(max_workers=max(1, REPLY_CONCURRENCY)) as pool:
+        futures = [pool.submit(_group, cl) for cl in clusters.clusters]
+        for fut in as_completed(futures):
+            yield from fut.result()
+
+def write_replies(rows: Iterable[Dict[str, Any]], fp: IO[str], fmt: str = "csv") -> int:
+    """
+    Vuelca filas de iter_customer_replies_gemini a un archivo de texto abierto,
+    una por una (CSV con encabezado o JSONL). Devuelve cuántas filas escribió.
+    """
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError("fmt debe ser 'csv' o 'jsonl'")
+    writer = csv.DictWriter(fp, fieldnames=_REPLY_FIELDS, extrasaction="ignore") if fmt == "csv" else None
+    if writer:
+        writer.writeheader()
+    n = 0
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            fp.write(json.dumps({k: row.get(k) for k in _REPLY_FIELDS}, ensure_ascii=False) + "\n")
+        n += 1
+    return n
+
+# -----------------------------
+# Versiones asíncronas (client.aio)
+# -----------------------------
+# Mismas entradas/salidas que las síncronas, pero sin bloquear un hilo durante
+# la llamada: permiten cientos de requests en vuelo en un solo event loop.
+# El trabajo bloqueante (cliente, léxico, dedup, store SQLite) corre en hilos
+# con asyncio.to_thread para no frenar al resto de las corrutinas.
+# Para acotar la concurrencia usar services/async_utils.gather_bounded.
+
+async def summarize_reviews_gemini_async(
+    reviews: List[str],
+    temperature: float = 0.4,
+    top_p: float = 0.9,
+    max_output_tokens: Optional[int] = None,
+    max_reviews: Optional[int] = None,
+    dedup: Optional[bool] = None
+) -> Dict[str, Any]:
+    """Versión async de summarize_reviews_gemini (map-reduce con gather_bounded)."""
+    c = await _client_async()
+
+    async def _call(kind, tpl, contents, cfg):
+        est = check_request(contents, cfg.max_output_tokens)
+        contents, cfg = await with_context_cache_async(c, GEMINI_MODEL, tpl, contents, cfg)
+        resp = await c.aio.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+        record_usage(kind, est, cfg.max_output_tokens, resp)
+        return (resp.text or "").strip()
+
+    async def _retry_async(make):
+        for attempt in range(SUMMARY_RETRIES + 1):
+            try:
+                out = await make()
+                if out:
+                    return out
+            except Exception:
+                if attempt == SUMMARY_RETRIES:
+                    return None
+        return None
+
+    chunks = await asyncio.to_thread(_summary_chunks, reviews, max_reviews, dedup)   # dedup: CPU
+    if len(chunks) <= 1:
+        only, n = chunks[0] if chunks else ([], 0)
+        contents, cfg, subset = _summary_request(only, temperature, top_p, max_output_tokens, len(only), n)
+        return _partial(_parse_summary(await _call("summary", _SUMMARY_TEMPLATE, contents, cfg), subset), n)
+
+    async def _map(item):
+        chunk, n = item
+        contents, cfg, _ = _summary_request(chunk, temperature, top_p, max_output_tokens, len(chunk), n)
+
+        async def _once():
+            text = await _call("summary", _SUMMARY_TEMPLATE, contents, cfg)
+            return _partial(_parse_summary(text, chunk, strict=True), n)
+        return await _retry_async(_once)
+
+    async def _reduce(group):
+        if len(group) == 1:
+            return group[0]
+        contents, cfg = _reduce_request(group, temperature, top_p, max_output_tokens)
+        text = await _retry_async(lambda: _call("summary_reduce", _REDUCE_TEMPLATE, contents, cfg))
+        return _merge_partials(group, text)
+
+    partials = [p for p in await gather_bounded(
+        ((lambda ch=ch: _map(ch)) for ch in chunks), limit=SUMMARY_CONCURRENCY) if p]
+    if not partials:
+        return _parse_summary("", [r for ch, _ in chunks for r in ch])
+    while len(partials) > 1:
+        groups = [partials[i:i + SUMMARY_REDUCE_FANIN] for i in range(0, len(partials), SUMMARY_REDUCE_FANIN)]
+        partials = await gather_bounded(((lambda g=g: _reduce(g)) for g in groups), limit=SUMMARY_CONCURRENCY)
+    return partials[0]
+
+async def score_sentiment_gemini_async(
+    reviews: List[str],
+    temperature: float = 0.2,
+    top_p: float = 0.9,
+    max_output_tokens: Optional[int] = None,
+    max_reviews: int = 200,
+    compact: Optional[bool] = None,
+    rationale: bool = True,
+    dedup: Optional[bool] = None,
+    local_first: Optional[bool] = None,
+    use_store: Optional[bool] = None
+) -> List[Dict]:
+    """Versión async de score_sentiment_gemini (lotes con gather_bounded)."""
+    c = await _client_async()
+    mode = _sentiment_mode(compact, rationale)
+    tpl = _SENTIMENT_MODES[mode][0]
+
+    async def _once(batch: List[str]) -> Optional[Dict[int, Dict]]:
+        contents, cfg, _ = _sentiment_request(batch, temperature, top_p, max_output_tokens, len(batch), mode)
+        est = check_request(contents, cfg.max_output_tokens)
+        contents, cfg = await with_context_cache_async(c, GEMINI_MODEL, tpl, contents, cfg)
+        resp = await c.aio.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+        record_usage("sentiment", est, cfg.max_output_tokens, resp)
+        return _parse_batch((resp.text or "").strip(), batch, mode)
+
+    errors: List[BaseException] = []
+    fatal: List[BaseException] = []
+
+    async def _classify(batch: List[str], depth: int = 0) -> List[Dict]:
+        if fatal:
+            raise fatal[0]
+        done: Dict[int, Dict] = {}
+        transient = False
+        for attempt in range(SENTIMENT_RETRIES + 1):
+            pending = [i for i in range(len(batch)) if i not in done]
+            if not pending:
+                break
+            try:
+                got = await _once([batch[i] for i in pending]) or {}
+                done.update({pending[j]: row for j, row in got.items()})
+                transient = False
+            except Exception as e:
+                if not _retryable(e):
+                    fatal.append(e)
+                    raise
+                errors.append(e)
+                transient = True
+                if attempt < SENTIMENT_RETRIES:
+                    await asyncio.sleep(_backoff_s(attempt))
+        action, pending = _resolve_failed(batch, done, depth, transient)
+        if action == "unclassified":
+            done.update(zip(pending, _unclassified([batch[i] for i in pending])))
+        elif action == "retry":
+            done.update(zip(pending, await _classify([batch[i] for i in pending], depth + 1)))
+        elif action == "split":
+            mid = len(batch) // 2
+            done.update(enumerate((await _classify(batch[:mid], depth + 1)) + (await _classify(batch[mid:], depth + 1))))
+        return [done[i] for i in range(len(batch))]
+
+    subset = [str(x) for x in reviews[:max_reviews]]
+    version = _label_version(mode, local_first)
+    store, known, todo = await asyncio.to_thread(_stored_tier, subset, version, use_store)
+    fresh = [subset[i] for i in todo]
+    local, pending = await asyncio.to_thread(_local_tier, fresh, local_first)
+    batches, groups = await asyncio.to_thread(_sentiment_batches, [fresh[i] for i in pending],
+                                              max_output_tokens, mode, dedup)
+    results = await gather_bounded(((lambda b=b: _classify(b)) for b in batches), limit=SENTIMENT_CONCURRENCY)
+    rows = [row for rows in results for row in rows]
+    _check_job(rows, errors)
+    new_rows = _merge_tiers(local, pending, _expand(rows, groups))
+    return await asyncio.to_thread(_finish, store, version, subset, known, todo, new_rows)
+
+async def generate_customer_reply_gemini_async(
+    comment: str,
+    brand_name: Optional[str] = None,
+    temperature: float = 0.4,
+    top_p: float = 0.9,
+    max_output_tokens: Optional[int] = None
+) -> Dict[str, str]:
+    """Versión async de generate_customer_reply_gemini."""
+    c = await _client_async()
+    contents, cfg = _reply_request(comment, brand_name, temperature, top_p, max_output_tokens)
+    est = check_request(contents, cfg.max_output_tokens)
+    resp = await c.aio.models.generate_content(model=GEMINI_MODEL, contents=contents, config=cfg)
+    record_usage("reply", est, cfg.max_output_tokens, resp)
+    return _parse_reply((resp.text or "").strip())
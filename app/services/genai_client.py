@@ -0,0 +1,180 @@
+# services/genai_client.py
+# -----------------------------------------------------------------------------
+# Registro de clientes google-genai compartido por todo el proceso.
+# - Un único cliente por (ubicación, modo forzado) reutilizado entre llamadas,
+#   de modo que las conexiones HTTP (keep-alive) se comparten.
+# - La validación de Vertex (models.list) se hace UNA vez y se repite solo
+#   cuando vence el TTL (GENAI_VALIDATE_TTL_S), no en cada request.
+# - El registro solo se lee/escribe bajo el lock global; validar o crear un
+#   cliente (red) va con un lock por (ubicación, modo). Mientras un hilo
+#   re-valida, los demás siguen usando el cliente existente en vez de esperar.
+# - Pool de conexiones y timeouts configurables por .env:
+#     * GENAI_POOL_SIZE          → conexiones máximas por cliente (defecto 20)
+#     * GENAI_TIMEOUT_MS         → timeout HTTP por request en ms (defecto 120000)
+#     * GENAI_VALIDATE_TTL_S     → cada cuánto se re-valida Vertex (defecto 900)
+# - get_client_async: para las versiones *_async; si hay que validar o crear el
+#   cliente (red), lo hace en un hilo y no bloquea el event loop.
+# - Lo usan llm_gemini.py, feedback_gemini.py y video_veo.py.
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()  # Carga variables de entorno desde .env (si existe) al proceso
+
+# -----------------------------
+# Variables de entorno / Config
+# -----------------------------
+GCP_PROJECT = os.getenv("GCP_PROJECT")                     # ID de proyecto GCP (para Vertex)
+GCP_LOCATION = os.getenv("GCP_LOCATION", "global")         # Región por defecto para Vertex
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")               # API key pública (Gemini API)
+
+POOL_SIZE = int(os.getenv("GENAI_POOL_SIZE", "20"))                # conexiones HTTP máximas por cliente
+TIMEOUT_MS = int(os.getenv("GENAI_TIMEOUT_MS", "120000"))          # timeout por request (ms)
+VALIDATE_TTL_S = float(os.getenv("GENAI_VALIDATE_TTL_S", "900"))   # re-validación de Vertex (s)
+
+# (ubicación, forzar_pública) -> {"client", "mode", "checked_at"}
+_REGISTRY: Dict[Tuple[str, bool], Dict[str, Any]] = {}
+_LOCK = threading.Lock()
+_KEY_LOCKS: Dict[Tuple[str, bool], threading.Lock] = {}
+
+
+def _key_lock(key: Tuple[str, bool]) -> threading.Lock:
+    with _LOCK:
+        return _KEY_LOCKS.setdefault(key, threading.Lock())
+
+
+def _fresh(entry: Optional[Dict[str, Any]], now: float) -> bool:
+    return bool(entry) and now - entry["checked_at"] < VALIDATE_TTL_S
+
+
+def _http_options(pool_size: Optional[int] = None, timeout_ms: Optional[int] = None):
+    """
+    Construye HttpOptions con un pool de conexiones acotado y timeout.
+    El mismo pool (httpx) se reutiliza en todas las llamadas del cliente.
+    """
+    import httpx
+    from google.genai import types
+
+    size = max(1, int(pool_size or POOL_SIZE))
+    limits = httpx.Limits(max_connections=size, max_keepalive_connections=size)
+    return types.HttpOptions(
+        timeout=int(timeout_ms or TIMEOUT_MS),
+        client_args={"limits": limits},
+        async_client_args={"limits": limits},
+    )
+
+
+def _validate_vertex(c) -> None:
+    """Llamada mínima (una sola página) para validar acceso/permisos a Vertex."""
+    pager = c.models.list(config={"page_size": 1})
+    next(iter(pager), None)
+
+
+def _build(location: str, force_public: bool) -> Tuple[Any, str]:
+    """
+    Crea un cliente nuevo siguiendo la misma prioridad de siempre:
+    - API pública si se fuerza y hay API key.
+    - Vertex AI si hay GCP_PROJECT (validado con models.list).
+    - Fallback a API pública si Vertex falla y hay GOOGLE_API_KEY.
+    """
+    from google import genai
+    opts = _http_options()
+    if force_public and GOOGLE_API_KEY:
+        return genai.Client(api_key=GOOGLE_API_KEY, http_options=opts), "public"
+
+    if GCP_PROJECT:
+        try:
+            c = genai.Client(vertexai=True, project=GCP_PROJECT, location=location, http_options=opts)
+            _validate_vertex(c)
+            return c, "vertex"
+        except Exception:
+            if GOOGLE_API_KEY:
+                return genai.Client(api_key=GOOGLE_API_KEY, http_options=opts), "public"
+            raise RuntimeError("Fallo Vertex y no hay GOOGLE_API_KEY para fallback.")
+
+    if GOOGLE_API_KEY:
+        return genai.Client(api_key=GOOGLE_API_KEY, http_options=opts), "public"
+
+    raise RuntimeError("Configura GCP_PROJECT o GOOGLE_API_KEY.")
+
+
+def get_client(location: Optional[str] = None, force_public: bool = False) -> Tuple[Any, str]:
+    """
+    Devuelve (cliente, modo) compartido para la ubicación indicada.
+    - Reutiliza el cliente existente mientras su validación siga vigente (TTL).
+    - Al vencer el TTL en modo Vertex, re-valida el MISMO cliente (conserva el pool);
+      si la validación falla, se reconstruye (con fallback a API pública).
+    - Al vencer el TTL en modo público con GCP_PROJECT, se vuelve a intentar Vertex.
+    - La red (validar/crear) corre fuera del lock global; si otro hilo ya está
+      re-validando un cliente vencido, se devuelve ese cliente sin esperar.
+    """
+    loc = location or GCP_LOCATION
+    key = (loc, bool(force_public))
+    with _LOCK:
+        entry = _REGISTRY.get(key)
+    if _fresh(entry, time.monotonic()):
+        return entry["client"], entry["mode"]
+
+    lock = _key_lock(key)
+    if entry and not lock.acquire(blocking=False):
+        return entry["client"], entry["mode"]      # otro hilo re-valida: seguir con el cliente actual
+    if not entry:
+        lock.acquire()                             # arranque en frío: no hay cliente que servir
+    try:
+        with _LOCK:
+            entry = _REGISTRY.get(key)
+        now = time.monotonic()
+        if _fresh(entry, now):                     # otro hilo ya lo validó/creó
+            return entry["client"], entry["mode"]
+
+        if entry and entry["mode"] == "vertex":
+            try:
+                _validate_vertex(entry["client"])
+                with _LOCK:
+                    entry["checked_at"] = now
+                return entry["client"], entry["mode"]
+            except Exception:
+                pass
+        elif entry and not (GCP_PROJECT and not force_public):
+            # Modo público sin alternativa Vertex: no hay nada que re-validar
+            with _LOCK:
+                entry["checked_at"] = now
+            return entry["client"], entry["mode"]
+
+        c, mode = _build(loc, bool(force_public))
+        with _LOCK:
+            _REGISTRY[key] = {"client": c, "mode": mode, "checked_at": time.monotonic()}
+        return c, mode
+    finally:
+        lock.release()
+
+
+async def get_client_async(location: Optional[str] = None, force_public: bool = False) -> Tuple[Any, str]:
+    """
+    Versión para corrutinas de get_client: con el cliente vigente responde sin
+    salir del event loop; si hay que validarlo o crearlo, corre en un hilo.
+    """
+    with _LOCK:
+        entry = _REGISTRY.get((location or GCP_LOCATION, bool(force_public)))
+    if _fresh(entry, time.monotonic()):
+        return entry["client"], entry["mode"]
+    return await asyncio.to_thread(get_client, location, force_public)
+
+
+def invalidate_client(location: Optional[str] = None) -> None:
+    """
+    Descarta el/los cliente(s) registrados (p. ej., tras un error de credenciales).
+    Sin argumentos limpia todo el registro.
+    """
+    with _LOCK:
+        if location is None:
+            _REGISTRY.clear()
+            return
+        for key in [k for k in _REGISTRY if k[0] == location]:
+            _REGISTRY.pop(key, None)
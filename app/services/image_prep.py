@@ -0,0 +1,161 @@
+# services/image_prep.py
+# -----------------------------------------------------------------------------
+# Preprocesamiento de imágenes antes de enviarlas al modelo (entradas multimodales).
+# - Reduce cada imagen a un lado máximo apropiado para el modelo (IMAGE_MAX_EDGE,
+#   768 px por defecto: Gemini tesela las imágenes en bloques de 768 px, así que
+#   más resolución solo suma bytes y tokens).
+# - Decodifica JPEG con draft() (decodificación reducida directa desde el DCT)
+#   y corrige la orientación EXIF.
+# - Elimina duplicados / casi duplicados por hash perceptual (dHash de 64 bits).
+# - Decodifica y re-codifica en paralelo (Pillow libera el GIL en estas etapas).
+# - Respeta un presupuesto total de bytes (IMAGE_MAX_TOTAL_BYTES): baja calidad
+#   y luego resolución; si aun así no entra, descarta las últimas imágenes.
+# - Memoiza el resultado por digest de los bytes originales (reruns de Streamlit).
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "768"))                      # lado mayor (px)
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))               # calidad JPEG inicial
+IMAGE_MAX_COUNT = int(os.getenv("IMAGE_MAX_COUNT", "6"))                      # imágenes por request
+IMAGE_MAX_TOTAL_BYTES = int(os.getenv("IMAGE_MAX_TOTAL_BYTES", str(2 * 1024 * 1024)))  # presupuesto total
+IMAGE_DEDUP_DISTANCE = int(os.getenv("IMAGE_DEDUP_DISTANCE", "6"))            # bits de diferencia (dHash)
+
+_MIN_QUALITY = 60
+_MIN_EDGE = 384
+
+_MEMO: "OrderedDict[str, Tuple[Image.Image, int]]" = OrderedDict()  # digest → (imagen reducida, dhash)
+_MEMO_MAX = 64
+_MEMO_LOCK = threading.Lock()
+
+
+def _dhash(img: Image.Image) -> int:
+    """Hash perceptual por diferencias (9×8 en escala de grises → 64 bits)."""
+    g = np.asarray(img.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (g[:, 1:] > g[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _decode(data: bytes, max_edge: int) -> Optional[Tuple[Image.Image, int]]:
+    """Decodifica, orienta y reduce una imagen; devuelve (imagen RGB, dhash) o None si no es imagen."""
+    digest = hashlib.sha256(data).hexdigest() + f":{max_edge}"
+    with _MEMO_LOCK:
+        if digest in _MEMO:
+            _MEMO.move_to_end(digest)
+            return _MEMO[digest]
+    try:
+        img = Image.open(BytesIO(data))
+        if img.format == "JPEG":
+            img.draft("RGB", (max_edge, max_edge))   # decodificación reducida (1/2, 1/4, 1/8)
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    except Exception:
+        return None
+    res = (img, _dhash(img))
+    with _MEMO_LOCK:
+        _MEMO[digest] = res
+        while len(_MEMO) > _MEMO_MAX:
+            _MEMO.popitem(last=False)
+    return res
+
+
+def _encode(img: Image.Image, quality: int, max_edge: Optional[int] = None) -> bytes:
+    if max_edge and max(img.size) > max_edge:
+        img = img.copy()
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    bio = BytesIO()
+    img.save(bio, format="JPEG", quality=int(quality), optimize=True)
+    return bio.getvalue()
+
+
+def prepare_images(
+    images: Optional[List[bytes]],
+    max_edge: int = IMAGE_MAX_EDGE,
+    quality: int = IMAGE_JPEG_QUALITY,
+    max_count: int = IMAGE_MAX_COUNT,
+    max_total_bytes: int = IMAGE_MAX_TOTAL_BYTES,
+    dedup_distance: int = IMAGE_DEDUP_DISTANCE,
+    workers: int = 4,
+    report: Optional[Dict[str, Any]] = None,
+) -> List[bytes]:
+    """
+    Devuelve las imágenes listas para el modelo (JPEG reducidos, sin duplicados,
+    dentro del presupuesto de bytes), en el mismo orden de entrada.
+    - Los archivos que no son imagen se descartan.
+    - Si se pasa 'report' (dict), se completa con bytes_in, bytes_out,
+      duplicates, dropped y elapsed_s.
+    """
+    t0 = time.perf_counter()
+    images = [b for b in (images or []) if b]
+    if not images:
+        return []
+
+    n_workers = max(1, min(int(workers), len(images)))
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        decoded = list(pool.map(lambda b: _decode(b, int(max_edge)), images))
+
+    # Deduplicación por distancia de Hamming entre dHash
+    kept: List[Image.Image] = []
+    hashes: List[int] = []
+    duplicates = 0
+    for res in decoded:
+        if res is None:
+            continue
+        img, h = res
+        if any(bin(h ^ other).count("1") <= dedup_distance for other in hashes):
+            duplicates += 1
+            continue
+        kept.append(img)
+        hashes.append(h)
+    dropped = max(0, len(kept) - int(max_count))
+    kept = kept[: int(max_count)]
+
+    # Codificación en paralelo; si se pasa del presupuesto, bajar calidad y luego resolución
+    q, edge = int(quality), int(max_edge)
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        while True:
+            out = list(pool.map(lambda im: _encode(im, q, edge), kept))
+            if sum(len(b) for b in out) <= max_total_bytes:
+                break
+            if q > _MIN_QUALITY:
+                q = max(_MIN_QUALITY, q - 10)
+            elif edge > _MIN_EDGE:
+                edge = max(_MIN_EDGE, int(edge * 0.75))
+            else:
+                break
+
+    # Último recurso: descartar las imágenes finales que no entran
+    total = 0
+    final: List[bytes] = []
+    for b in out:
+        if final and total + len(b) > max_total_bytes:
+            dropped += 1
+            continue
+        final.append(b)
+        total += len(b)
+
+    if report is not None:
+        report.update({
+            "bytes_in": sum(len(b) for b in images),
+            "bytes_out": total,
+            "images_in": len(images),
+            "images_out": len(final),
+            "duplicates": duplicates,
+            "dropped": dropped,
+            "quality": q,
+            "max_edge": edge,
+            "elapsed_s": round(time.perf_counter() - t0, 3),
+        })
+    return final
@@ -1,14 +1,35 @@
 from typing import List, Tuple, Optional
 import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
 import math
 
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageChops
+from PIL import Image, ImageDraw, ImageFilter, ImageChops
 
 from dotenv import load_dotenv
-import vertexai
-from vertexai.preview.vision_models import ImageGenerationModel
+
+from .layer_cache import layer_cache
+from .text_layout import FACE_BOLD, FACE_REGULAR, font, line_height, text_lock, text_width, wrap_lines
+
+load_dotenv()  # Carga variables de entorno desde .env (si existe) al proceso
+
+IMAGEN_CONCURRENCY = int(os.getenv("IMAGEN_CONCURRENCY", "4"))          # llamadas a Imagen en vuelo
+IMAGEN_IMAGES_PER_CALL = int(os.getenv("IMAGEN_IMAGES_PER_CALL", "1"))  # fondos por llamada (1–4)
+IMAGEN_TOPUP_ROUNDS = int(os.getenv("IMAGEN_TOPUP_ROUNDS", "2"))        # rondas extra si faltan fondos
+
+
+class PromoShortfall(RuntimeError):
+    """
+    Se compusieron menos creatividades que las pedidas (filtro de seguridad o
+    llamadas fallidas, aun tras reintentar). 'creatives' trae las que sí salieron.
+    """
+
+    def __init__(self, message: str, creatives: List[np.ndarray]):
+        super().__init__(message)
+        self.creatives = creatives
 
 
 # ==========================
@@ -20,12 +41,6 @@ def _hex_to_rgb(h: Optional[str]) -> tuple:
         return (20, 20, 20)
     return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
 
-def _font(sz: int, bold: bool = True):
-    try:
-        return ImageFont.truetype("DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf", sz)
-    except Exception:
-        return ImageFont.load_default()
-
 def _fit_shadow(img: Image.Image, max_w: int, max_h: int) -> Image.Image:
     """Redimensiona con sombra suave alrededor (queda con halo)."""
     img = img.convert("RGBA")
@@ -39,12 +54,49 @@ def _fit_shadow(img: Image.Image, max_w: int, max_h: int) -> Image.Image:
     can.alpha_composite(img, (0, 0))
     return can
 
-def _quarter_circle_mask(W: int, H: int, R: int) -> Image.Image:
-    """Máscara 'L' de un círculo centrado en (W, H) recortada al canvas: deja visible el cuarto inferior derecho."""
-    mask_big = Image.new("L", (W + R, H + R), 0)
-    d = ImageDraw.Draw(mask_big)
-    d.ellipse((W - R, H - R, W + R, H + R), fill=255)
-    return mask_big.crop((0, 0, W, H))
+class PreparedPackshot:
+    """
+    Packshot direccionado por el digest de sus bytes: se decodifica una sola vez y
+    cada versión escalada con halo (fitted) se calcula una vez por tamaño; ambas
+    quedan en la caché de capas, así que sirven para todas las variantes y para
+    requests siguientes con la misma imagen.
+    """
+
+    __slots__ = ("digest", "_data")
+
+    def __init__(self, data: bytes):
+        self.digest = hashlib.sha256(data).hexdigest()
+        self._data = data
+
+    @property
+    def image(self) -> Image.Image:
+        return layer_cache().get_or_render(
+            ("packshot", self.digest), lambda: Image.open(BytesIO(self._data)).convert("RGBA"))
+
+    def fitted(self, target: int) -> Image.Image:
+        """Packshot reducido a target×target con sombra suave (ver _fit_shadow). No modificar."""
+        return layer_cache().get_or_render(
+            ("packshot_fit", self.digest, int(target)), lambda: _fit_shadow(self.image, target, target))
+
+def _fit_background(img: Image.Image, W: int, H: int) -> Image.Image:
+    """Única remuestra del fondo al canvas (en RGB, más barata que en RGBA) y paso a RGBA para componer."""
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != (W, H):
+        img = img.resize((W, H), Image.LANCZOS)
+    return img.convert("RGBA")
+
+def _quarter_circle_mask(R: int) -> Image.Image:
+    """
+    Máscara 'L' R×R del cuarto visible de un círculo de radio R centrado en la
+    esquina inferior derecha del canvas; se aplica en la caja (W-R, H-R, W, H).
+    """
+    mask = Image.new("L", (R, R), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, 2 * R, 2 * R), fill=255)
+    return mask
+
+def _empty_layer() -> Tuple[Image.Image, Tuple[int, int]]:
+    return Image.new("RGBA", (1, 1), (0, 0, 0, 0)), (0, 0)
 
 def _draw_texts_and_cta(
     bg: Image.Image,
@@ -58,50 +110,40 @@ def _draw_texts_and_cta(
     W, H = bg.size
     d = ImageDraw.Draw(bg)
 
-    fH = _font(int(H * 0.06), bold=True)
-    fS = _font(int(H * 0.035), bold=False)
-    fC = _font(int(H * 0.035), bold=False)
+    # Fuentes cacheadas por (archivo, tamaño) y maquetado cacheado por
+    # (texto, fuente, caja): ver services/text_layout.py
+    sH, sS = int(H * 0.06), int(H * 0.035)
+    fC = font(FACE_REGULAR, sS)
 
     x0, y0, text_w = int(W * 0.07), int(H * 0.18), int(W * 0.42)
 
-    def draw_wrap(text, box, font, fill=(20, 20, 20)):
+    def draw_wrap(text, box, face, size, fill=(20, 20, 20)):
         x0b, y0b, x1b, _ = box
-        max_w = x1b - x0b
-        words = (text or "").split()
-        cur, lines = "", []
-        for w in words:
-            t = (cur + " " + w).strip()
-            if d.textlength(t, font=font) <= max_w:
-                cur = t
-            else:
-                if cur:
-                    lines.append(cur)
-                cur = w
-        if cur:
-            lines.append(cur)
+        fnt = font(face, size)
         y = y0b
-        lh = (font.size + 6 if hasattr(font, "size") else 22)
-        for ln in lines:
-            d.text((x0b, y), ln, font=font, fill=fill)
+        lh = line_height(fnt)
+        for ln in wrap_lines(text or "", face, size, x1b - x0b):
+            d.text((x0b, y), ln, font=fnt, fill=fill)
             y += lh
         return y
 
-    y = draw_wrap(headline, (x0, y0, x0 + text_w, y0 + int(H * 0.18)), fH, headline_rgb)
-    y += int(H * 0.02)
-    y = draw_wrap(subheadline, (x0, y, x0 + text_w, y + int(H * 0.16)), fS, subheadline_rgb)
-    y += int(H * 0.04)
-
-    # CTA pill
-    btn_w, btn_h = int(text_w * 0.75), int(H * 0.08)
-    btn_x, btn_y = x0, y
-    d.rounded_rectangle([btn_x, btn_y, btn_x + btn_w, btn_y + btn_h], radius=int(btn_h / 2), fill=(255, 255, 255, 230))
-    tw = d.textlength(cta or "", font=fC)
-    d.text(
-        (btn_x + (btn_w - tw) / 2, btn_y + btn_h / 2 - (fC.size if hasattr(fC, "size") else 18) / 2),
-        cta or "",
-        font=fC,
-        fill=cta_rgb
-    )
+    with text_lock():
+        y = draw_wrap(headline, (x0, y0, x0 + text_w, y0 + int(H * 0.18)), FACE_BOLD, sH, headline_rgb)
+        y += int(H * 0.02)
+        y = draw_wrap(subheadline, (x0, y, x0 + text_w, y + int(H * 0.16)), FACE_REGULAR, sS, subheadline_rgb)
+        y += int(H * 0.04)
+
+        # CTA pill
+        btn_w, btn_h = int(text_w * 0.75), int(H * 0.08)
+        btn_x, btn_y = x0, y
+        d.rounded_rectangle([btn_x, btn_y, btn_x + btn_w, btn_y + btn_h], radius=int(btn_h / 2), fill=(255, 255, 255, 230))
+        tw = text_width(FACE_REGULAR, sS, cta or "")
+        d.text(
+            (btn_x + (btn_w - tw) / 2, btn_y + btn_h / 2 - (fC.size if hasattr(fC, "size") else 18) / 2),
+            cta or "",
+            font=fC,
+            fill=cta_rgb
+        )
 
 def _rays_layer(
     W: int, H: int,
@@ -111,8 +153,11 @@ def _rays_layer(
     spread_deg: float,
     color_hex: Optional[str],
     opacity: int
-) -> Image.Image:
-    """Crea una capa RGBA con 'rayos' saliendo desde la esquina inferior derecha (W,H)."""
+) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Crea una capa RGBA con 'rayos' saliendo desde la esquina inferior derecha (W,H).
+    Devuelve (capa del tamaño de la caja que ocupan los rayos, posición (x, y) en el canvas).
+    """
     color = _hex_to_rgb(color_hex or "#FFD700")
     alpha = max(0, min(255, int(opacity)))
     length = int(min(W, H) * max(0.05, min(1.5, length_pct)))  # admite >100% si se desea
@@ -122,11 +167,8 @@ def _rays_layer(
     base_angle_deg = 225.0  # hacia arriba-izquierda
     half_spread = spread / 2.0
 
-    layer = Image.new("RGBA", (W, H), (0, 0, 0, 0))
-    d = ImageDraw.Draw(layer)
-
     if count <= 0:
-        return layer
+        return _empty_layer()
 
     angles = []
     if count == 1:
@@ -136,12 +178,24 @@ def _rays_layer(
             t = i / (count - 1)  # 0..1
             angles.append(base_angle_deg - half_spread + t * spread)
 
+    ends = []
     for ang in angles:
         rad = math.radians(ang)
-        ex = int(W + length * math.cos(rad))
-        ey = int(H + length * math.sin(rad))
-        d.line([(W, H), (ex, ey)], fill=color + (alpha,), width=thickness)
-    return layer
+        ends.append((int(W + length * math.cos(rad)), int(H + length * math.sin(rad))))
+
+    # Caja de los rayos (+ grosor), recortada al canvas
+    x0 = max(0, min(ex for ex, _ in ends) - thickness)
+    y0 = max(0, min(ey for _, ey in ends) - thickness)
+    if x0 >= W or y0 >= H:
+        return _empty_layer()
+
+    layer = Image.new("RGBA", (W - x0, H - y0), (0, 0, 0, 0))
+    d = ImageDraw.Draw(layer)
+    for ex, ey in ends:
+        d.line([(W - x0, H - y0), (ex - x0, ey - y0)], fill=color + (alpha,), width=thickness)
+    return layer, (x0, y0)
+
+_BLUR_REACH = 3   # GaussianBlur(r) no toca píxeles a más de ~3·r del borde de la figura
 
 def _ground_shadow_layer(
     W: int, H: int,
@@ -150,11 +204,11 @@ def _ground_shadow_layer(
     offset_y_px: int,
     opacity: int,
     blur_radius: int
-) -> Image.Image:
-    """Crea una elipse difuminada como sombra de base debajo del packshot."""
-    layer = Image.new("RGBA", (W, H), (0, 0, 0, 0))
-    d = ImageDraw.Draw(layer)
-
+) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Crea una elipse difuminada como sombra de base debajo del packshot.
+    Devuelve (capa del tamaño de la elipse + margen del blur, posición (x, y) en el canvas).
+    """
     cx = px + w // 2
     cy = py + h + int(offset_y_px)
 
@@ -167,19 +221,30 @@ def _ground_shadow_layer(
     y1 = cy + eh // 2
 
     alpha = max(0, min(255, int(opacity)))
-    d.ellipse([x0, y0, x1, y1], fill=(0, 0, 0, alpha))
-
     blur = max(0, int(blur_radius))
+
+    # Solo la caja de la elipse + el alcance del blur (recortada al canvas);
+    # fuera de ella la capa completa sería transparente
+    pad = _BLUR_REACH * blur + 2
+    bx0, by0 = max(0, x0 - pad), max(0, y0 - pad)
+    bx1, by1 = min(W, x1 + pad + 1), min(H, y1 + pad + 1)
+    if bx1 <= bx0 or by1 <= by0:
+        return _empty_layer()
+
+    layer = Image.new("RGBA", (bx1 - bx0, by1 - by0), (0, 0, 0, 0))
+    d = ImageDraw.Draw(layer)
+    d.ellipse([x0 - bx0, y0 - by0, x1 - bx0, y1 - by0], fill=(0, 0, 0, alpha))
+
     if blur > 0:
         layer = layer.filter(ImageFilter.GaussianBlur(blur))
-    return layer
+    return layer, (bx0, by0)
 
 
 # ==========================
 # Composición principal
 # ==========================
 def _compose_with_packshot(
-    base_bytes: bytes,
+    packshot: PreparedPackshot,
     canvas_size: Tuple[int, int],
     headline: str,
     subheadline: str,
@@ -217,21 +282,27 @@ def _compose_with_packshot(
     cta_rgb = _hex_to_rgb(cta_hex)
 
     # Fondo de Vertex (capa base)
-    bg = background_img.convert("RGBA").resize((W, H), Image.LANCZOS)
+    bg = _fit_background(background_img, W, H)
 
-    # 1) Placa en cuarto de circunferencia (debajo de todo lo demás)
+    # 1) Placa en cuarto de circunferencia (debajo de todo lo demás);
+    #    solo se rellena la caja R×R de la esquina, con la máscara del cuarto de círculo
     quarter_radius_pct = max(0.2, min(0.95, quarter_radius_pct))
     R = int(min(W, H) * quarter_radius_pct)
-    quarter_mask = _quarter_circle_mask(W, H, R)
 
-    if plate_hex and plate_opacity > 0:
-        plate_rgb = _hex_to_rgb(plate_hex)
-        plate = Image.new("RGBA", (W, H), plate_rgb + (max(0, min(255, int(plate_opacity))),))
-        bg.paste(plate, (0, 0), quarter_mask)
+    # Las capas estáticas (máscara, rayos, sombra) solo dependen del canvas y del
+    # estilo: se reutilizan entre variantes y reruns (services/layer_cache.py)
+    cache = layer_cache()
+
+    if plate_hex and plate_opacity > 0 and R > 0:
+        plate_rgba = _hex_to_rgb(plate_hex) + (max(0, min(255, int(plate_opacity))),)
+        mask = cache.get_or_render(("plate_mask", R), lambda: _quarter_circle_mask(R))
+        bg.paste(plate_rgba, (W - R, H - R, W, H), mask)
 
     # 2) Rayos (entre la placa y el packshot)
     if rays_enabled and rays_count > 0:
-        rays = _rays_layer(
+        rays_args = (W, H, int(rays_count), float(rays_length_pct), int(rays_thickness_px),
+                     float(rays_spread_deg), _hex_to_rgb(rays_color_hex or "#FFD700"), int(rays_opacity))
+        rays, rays_pos = cache.get_or_render(("rays",) + rays_args, lambda: _rays_layer(
             W, H,
             count=int(rays_count),
             length_pct=float(rays_length_pct),
@@ -239,14 +310,13 @@ def _compose_with_packshot(
             spread_deg=float(rays_spread_deg),
             color_hex=rays_color_hex,
             opacity=int(rays_opacity)
-        )
-        bg.alpha_composite(rays)
+        ))
+        bg.alpha_composite(rays, rays_pos)
 
     # 3) Packshot (encima de la placa y rayos) con sombra SOLO en la base
-    prod = Image.open(BytesIO(base_bytes)).convert("RGBA")
     pack_scale_pct = max(0.2, min(2.0, pack_scale_pct))  # 20% a 200% del tamaño base relativo a R
     target = int(R * 0.9 * pack_scale_pct)
-    prod_fit = _fit_shadow(prod, target, target)  # mantiene halo, pero lo ocultaremos con sombra base
+    prod_fit = packshot.fitted(target)  # mantiene halo, pero lo ocultaremos con sombra base
 
     # Posición
     margin_right = int(min(W, H) * max(0.0, min(0.5, margin_right_pct)))
@@ -255,7 +325,9 @@ def _compose_with_packshot(
     py = H - margin_bottom - prod_fit.height
 
     # Sombra de base (elipse) — debajo del packshot
-    shadow = _ground_shadow_layer(
+    shadow_args = (W, H, px, py, prod_fit.width, prod_fit.height, float(shadow_scale_x), float(shadow_scale_y),
+                   int(shadow_offset_y_px), int(shadow_opacity), int(shadow_blur_px))
+    shadow, shadow_pos = cache.get_or_render(("shadow",) + shadow_args, lambda: _ground_shadow_layer(
         W, H,
         px, py, prod_fit.width, prod_fit.height,
         scale_x=shadow_scale_x,
@@ -263,8 +335,8 @@ def _compose_with_packshot(
         offset_y_px=shadow_offset_y_px,
         opacity=shadow_opacity,
         blur_radius=shadow_blur_px
-    )
-    bg.alpha_composite(shadow)
+    ))
+    bg.alpha_composite(shadow, shadow_pos)
 
     # Pegamos el packshot encima
     bg.alpha_composite(prod_fit, (px, py))
@@ -278,15 +350,16 @@ def _compose_with_packshot(
 # ==========================
 # Generación con Vertex (Imagen 3)
 # ==========================
-def _vertex_generate_background(
-    W: int,
-    H: int,
-    prompt: str,
-    brand_hex: str,
-    negative_prompt: Optional[str] = None
-) -> Image.Image:
-    """Genera un fondo con Vertex Imagen 3 (usa tamaño por defecto del modelo y luego resize)."""
-    load_dotenv()
+_MODEL = None
+_MODEL_KEY: Optional[Tuple[str, str, str]] = None
+_MODEL_LOCK = threading.Lock()
+
+def _imagen_model():
+    """
+    Modelo de Imagen listo para usar: vertexai.init + from_pretrained una sola vez
+    por proceso (se recarga solo si cambian proyecto, región o modelo).
+    """
+    global _MODEL, _MODEL_KEY
     project = os.getenv("GCP_PROJECT")
     location = os.getenv("GCP_LOCATION", "us-central1")
     model_name = os.getenv("GEMINI_IMAGE_MODEL", "imagen-3.0-generate-001")
@@ -295,19 +368,43 @@ def _vertex_generate_background(
     if not project or not location or not creds:
         raise RuntimeError("Faltan variables en .env: GCP_PROJECT, GCP_LOCATION o GOOGLE_APPLICATION_CREDENTIALS.")
 
-    vertexai.init(project=project, location=location)
-    model = ImageGenerationModel.from_pretrained(model_name)
+    key = (project, location, model_name)
+    with _MODEL_LOCK:
+        if _MODEL is None or _MODEL_KEY != key:
+            # SDK de Vertex solo al generar (la composición local no lo necesita)
+            import vertexai
+            from vertexai.preview.vision_models import ImageGenerationModel
+
+            vertexai.init(project=project, location=location)
+            _MODEL = ImageGenerationModel.from_pretrained(model_name)
+            _MODEL_KEY = key
+        return _MODEL
+
+def _vertex_generate_backgrounds(
+    count: int,
+    prompt: str,
+    brand_hex: str,
+    negative_prompt: Optional[str] = None
+) -> List[Image.Image]:
+    """
+    Genera hasta 'count' fondos (1–4) en UNA llamada a Vertex Imagen 3, al tamaño
+    por defecto del modelo; el compositor los lleva a W×H. Si el filtro de
+    seguridad descarta alguno, devuelve menos (posiblemente ninguno): quien
+    llama completa lo que falte.
+    """
+    model = _imagen_model()
 
     # Mejoramos el prompt: fotografía de estudio limpia y minimal, espacio negativo y soft light.
     brand_hint = f" Paleta coherente con el color #{(brand_hex or '').lstrip('#')}."
     base_prompt = (prompt or "").strip()
     full_prompt = (base_prompt + brand_hint).strip()
+    count = max(1, min(4, int(count)))
 
     # Intentamos usar negative_prompt si el SDK lo soporta; si no, fallback sin romper.
     try:
         gen = model.generate_images(
             prompt=full_prompt,
-            number_of_images=1,
+            number_of_images=count,
             safety_filter_level="block_few",
             negative_prompt=(negative_prompt or None)
         )
@@ -315,17 +412,16 @@ def _vertex_generate_background(
         # Algunas versiones no aceptan negative_prompt
         gen = model.generate_images(
             prompt=full_prompt,
-            number_of_images=1,
+            number_of_images=count,
             safety_filter_level="block_few"
         )
 
-    img_obj = gen.images[0]
-    img_bytes = getattr(img_obj, "image_bytes", None) or getattr(img_obj, "_image_bytes", None)
-    if not img_bytes:
-        raise RuntimeError("No se obtuvieron bytes de imagen desde el SDK de Vertex.")
-
-    bg = Image.open(BytesIO(img_bytes)).convert("RGB").resize((W, H), Image.LANCZOS)
-    return bg
+    out: List[Image.Image] = []
+    for img_obj in gen.images:
+        img_bytes = getattr(img_obj, "image_bytes", None) or getattr(img_obj, "_image_bytes", None)
+        if img_bytes:
+            out.append(Image.open(BytesIO(img_bytes)).convert("RGB"))
+    return out
 
 
 # ==========================
@@ -382,19 +478,21 @@ def generate_promos_with_gemini_background(
     - Packshot encima de la placa y rayos.
     - Sombra únicamente en la base.
     - Parámetros de placa, rayos, tamaño y posición del packshot configurables.
+    - Los fondos se piden en paralelo (IMAGEN_CONCURRENCY llamadas en vuelo, de
+      IMAGEN_IMAGES_PER_CALL imágenes cada una) y cada uno se compone apenas
+      llega, mientras los demás siguen generándose: n creatividades tardan
+      aproximadamente lo mismo que una. Se devuelven en orden de pedido.
+    - Si el filtro de seguridad descarta fondos o alguna llamada falla, se piden
+      los que faltan (hasta IMAGEN_TOPUP_ROUNDS rondas extra). Devuelve
+      exactamente n creatividades o lanza: el error original si no salió
+      ninguna por fallas, o PromoShortfall con las que sí se compusieron.
     """
-    W, H = canvas_size
-    outs: List[np.ndarray] = []
+    n = max(1, int(n))
+    packshot = PreparedPackshot(base_bytes)   # decodificado y escalado una vez para todas las variantes
 
-    for _ in range(max(1, int(n))):
-        bg_img = _vertex_generate_background(
-            W, H,
-            prompt=bg_prompt,
-            brand_hex=brand_hex,
-            negative_prompt=bg_negative
-        )
-        arr = _compose_with_packshot(
-            base_bytes=base_bytes,
+    def _compose(bg_img: Image.Image) -> np.ndarray:
+        return _compose_with_packshot(
+            packshot=packshot,
             canvas_size=canvas_size,
             headline=headline,
             subheadline=subheadline,
@@ -422,6 +520,49 @@ def generate_promos_with_gemini_background(
             shadow_opacity=int(shadow_opacity),
             shadow_blur_px=int(shadow_blur_px),
         )
-        outs.append(arr)
 
+    per_call = max(1, min(4, IMAGEN_IMAGES_PER_CALL))
+    outs: List[np.ndarray] = []
+    errors: List[Exception] = []
+    filtered = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, IMAGEN_CONCURRENCY)) as gen_pool, \
+            ThreadPoolExecutor(max_workers=max(1, min(n, os.cpu_count() or 1))) as compose_pool:
+        for _ in range(1 + max(0, IMAGEN_TOPUP_ROUNDS)):
+            missing = n - len(outs)
+            if missing <= 0:
+                break
+            calls = [min(per_call, missing - i) for i in range(0, missing, per_call)]
+            composed: List[list] = [[] for _ in calls]
+            pending = {
+                gen_pool.submit(_vertex_generate_backgrounds, k, bg_prompt, brand_hex, bg_negative): i
+                for i, k in enumerate(calls)
+            }
+            round_errors = 0
+            for fut in as_completed(pending):
+                try:
+                    bgs = fut.result()
+                except Exception as e:            # una llamada fallida no descarta las demás
+                    errors.append(e)
+                    round_errors += 1
+                    continue
+                filtered += calls[pending[fut]] - len(bgs)
+                composed[pending[fut]] = [compose_pool.submit(_compose, bg) for bg in bgs]
+            before = len(outs)
+            for futs in composed:
+                for f in futs:
+                    try:
+                        outs.append(f.result())
+                    except Exception as e:
+                        errors.append(e)
+                        round_errors += 1
+            if round_errors and len(outs) == before:
+                break                             # falla persistente (credenciales, cuota…): no insistir
+
+    outs = outs[:n]
+    if len(outs) < n:
+        if not outs and errors:
+            raise errors[0]
+        cause = str(errors[-1]) if errors else f"el filtro de seguridad de Imagen descartó {filtered} fondo(s)"
+        raise PromoShortfall(f"Se generaron {len(outs)} de {n} creatividades: {cause}", outs)
     return outs
@@ -0,0 +1,122 @@
+# services/label_store.py
+# -----------------------------------------------------------------------------
+# Store persistente de etiquetas de sentimiento por review (análisis incremental).
+# - Clave: SHA-256 de la "versión" del clasificador (modelo + digest del prompt
+#   + modo/umbral de la cascada) y del texto ORIGINAL de la review, solo con
+#   mayúsculas plegadas y espacios colapsados: "Muy  bueno" y "muy bueno"
+#   comparten etiqueta, pero "👍" y "😡" (o reviews en otro alfabeto) no.
+# - Solo se guardan etiquetas que el clasificador dio a ESA review; las
+#   heredadas de un representante de grupo (review_dedup) no se persisten.
+# - Al re-subir un export que crece cada día, solo se clasifican las reviews
+#   nuevas; las ya vistas se leen del store. Cambiar de modelo o de prompt
+#   cambia la versión, así que nunca se mezclan etiquetas de versiones distintas.
+# - Backend: SQLite (stdlib), seguro entre hilos; lecturas/escrituras por lotes.
+# Variables de entorno:
+#     * LABEL_STORE       → 1/0 (defecto 1)
+#     * LABEL_STORE_PATH  → archivo SQLite (defecto GENAI_CACHE_DIR/labels.sqlite3)
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .response_cache import CACHE_DIR
+
+LABEL_STORE = os.getenv("LABEL_STORE", "1").lower() in ("1", "true", "yes")
+LABEL_STORE_PATH = os.getenv("LABEL_STORE_PATH", os.path.join(CACHE_DIR, "labels.sqlite3"))
+
+_BATCH = 900        # parámetros por consulta (SQLite antiguo admite 999)
+
+
+def label_key(version: str, review: str) -> str:
+    h = hashlib.sha256(version.encode("utf-8"))
+    h.update(b"\x00")
+    h.update(" ".join(str(review or "").casefold().split()).encode("utf-8"))
+    return h.hexdigest()
+
+
+class LabelStore:
+    """
+    Etiquetas por (versión, review sin mayúsculas ni espacios extra) en SQLite.
+    - get_many(version, reviews) → {posición: {"sentiment", "rationale"}} de las ya vistas.
+    - put_many(version, reviews, rows) → guarda (o reemplaza) las etiquetas nuevas.
+    """
+
+    def __init__(self, path: str = LABEL_STORE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS labels ("
+            " key TEXT PRIMARY KEY, version TEXT, sentiment TEXT, rationale TEXT, created_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_version ON labels(version)")
+        self._conn.commit()
+
+    def get_many(self, version: str, reviews: List[str]) -> Dict[int, Dict[str, str]]:
+        keys = [label_key(version, r) for r in reviews]
+        found: Dict[str, Tuple[str, str]] = {}
+        uniq = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(uniq), _BATCH):
+                part = uniq[i:i + _BATCH]
+                q = f"SELECT key, sentiment, rationale FROM labels WHERE key IN ({','.join('?' * len(part))})"
+                found.update((k, (s, r)) for k, s, r in self._conn.execute(q, part))
+        out = {i: {"sentiment": found[k][0], "rationale": found[k][1]} for i, k in enumerate(keys) if k in found}
+        self.hits += len(out)
+        self.misses += len(keys) - len(out)
+        return out
+
+    def put_many(self, version: str, reviews: Iterable[str], rows: Iterable[Dict[str, Any]]) -> int:
+        now = time.time()
+        data = [(label_key(version, r), version, str(row.get("sentiment") or "neutral"),
+                 str(row.get("rationale") or ""), now) for r, row in zip(reviews, rows)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO labels (key, version, sentiment, rationale, created_at) VALUES (?, ?, ?, ?, ?)",
+                data,
+            )
+            self._conn.commit()
+        return len(data)
+
+    def prune(self, keep_version: Optional[str] = None) -> int:
+        """Borra las etiquetas de otras versiones (o todas si keep_version=None)."""
+        with self._lock:
+            if keep_version is None:
+                cur = self._conn.execute("DELETE FROM labels")
+            else:
+                cur = self._conn.execute("DELETE FROM labels WHERE version != ?", (keep_version,))
+            self._conn.commit()
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de la sesión (hits = reviews no re-clasificadas) + etiquetas en disco."""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries": int(size),
+        }
+
+
+_STORE: Optional[LabelStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def label_store() -> LabelStore:
+    """Store compartido (por proceso)."""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = LabelStore()
+        return _STORE
@@ -0,0 +1,113 @@
+# services/layer_cache.py
+# -----------------------------------------------------------------------------
+# Caché LRU en memoria de capas ya renderizadas (Pillow), acotada por bytes.
+# - Pensada para el compositor de promos (images_gemini): máscara de la placa,
+#   rayos y sombra de base dependen solo del tamaño del canvas y del estilo,
+#   así que se dibujan una vez y se reutilizan entre variantes y reruns.
+# - La clave la arma quien llama (tupla de parámetros ya normalizados).
+# - El tamaño de cada entrada se estima por los píxeles de las imágenes que
+#   contiene; al superar el tope se evictan las menos usadas recientemente.
+# - Los valores cacheados se comparten: quien los usa NO debe modificarlos
+#   (alpha_composite / paste solo los leen).
+# Variables de entorno:
+#     * PROMO_LAYER_CACHE_MB → tope de memoria de la caché (defecto 64)
+# -----------------------------------------------------------------------------
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from PIL import Image
+
+PROMO_LAYER_CACHE_MB = float(os.getenv("PROMO_LAYER_CACHE_MB", "64"))
+
+
+def _nbytes(value: Any) -> int:
+    """Bytes aproximados de una imagen o de tuplas/listas que contengan imágenes."""
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+class LayerCache:
+    """
+    LRU por bytes.
+    - get(key) → valor o None (cuenta hit/miss).
+    - put(key, value) → guarda y evicta lo más antiguo si se supera max_bytes.
+    - get_or_render(key, render) → valor cacheado o render() (y lo guarda).
+    """
+
+    def __init__(self, max_bytes: int = int(PROMO_LAYER_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max(0, int(max_bytes))
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = _nbytes(value)
+        if size > self.max_bytes:          # no cabe: no desplazar todo lo demás por una sola entrada
+            return
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._sizes[key]
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._sizes[key] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._data:
+                old, _ = self._data.popitem(last=False)
+                self._bytes -= self._sizes.pop(old)
+
+    def get_or_render(self, key: Hashable, render: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = render()          # fuera del lock: dos hilos pueden renderizar lo mismo, sin bloquearse
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, used = len(self._data), self._bytes
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries": entries,
+            "mb": round(used / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+        }
+
+
+_CACHE: Optional[LayerCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def layer_cache() -> LayerCache:
+    """Caché compartida (por proceso)."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = LayerCache()
+        return _CACHE
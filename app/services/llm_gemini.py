@@ -1,7 +1,18 @@
 import os, re, json                              # Módulos estándar: entorno (os), expresiones regulares (re), y JSON (json)
-from typing import Dict, List, Optional          # Tipos para anotaciones (mejor legibilidad/ayuda del IDE)
+import hashlib                                   # Digest de los bytes de imagen para la clave de caché
+import asyncio                                   # to_thread para no bloquear el event loop en las versiones async
+from typing import Dict, Iterator, List, Optional, Tuple  # Tipos para anotaciones (mejor legibilidad/ayuda del IDE)
 from dotenv import load_dotenv                   # Para cargar variables desde un archivo .env
 load_dotenv()                                    # Carga las variables del archivo .env al entorno del proceso
+from .genai_client import get_client, get_client_async  # Registro de clientes compartido (pool + validación con TTL)
+from .response_cache import description_cache, make_key  # Caché de respuestas en disco
+from .image_prep import (                        # Reducción/dedup/presupuesto de imágenes
+    IMAGE_DEDUP_DISTANCE, IMAGE_JPEG_QUALITY, IMAGE_MAX_COUNT, IMAGE_MAX_EDGE, IMAGE_MAX_TOTAL_BYTES,
+    prepare_images,
+)
+from .structured import json_config, parse_json, IncrementalJSONObject  # Salida JSON con esquema + parseo rápido con métricas
+from .prompt_templates import register_template, with_context_cache, with_context_cache_async  # Prefijo estático + caché de contexto
+from .token_budget import check_request, output_budget, record_usage  # Presupuesto de tokens (entrada/salida)
 
 GCP_PROJECT = os.getenv("GCP_PROJECT")           # ID del proyecto de Google Cloud (para usar Vertex AI)
 GCP_LOCATION = os.getenv("GCP_LOCATION", "global")  # Región de Vertex AI (por defecto "global"; común: "us-central1")
@@ -11,41 +22,84 @@ FORCE_PUBLIC = os.getenv("FORCE_GEMINI_PUBLIC", "").lower() in ("1", "true", "ye
 
 # ============================================================================
 # Función para obtener el cliente de Google Generative AI y el modo de conexión
-# - Intenta primero usar Vertex AI si está configurado.
-# - Si falla, usa la API pública con API key.
+# - Delega en el registro compartido (services/genai_client.py): el cliente se
+#   crea y valida una sola vez por proceso y se re-valida al vencer el TTL.
+# - Prioridad: API pública forzada → Vertex AI → fallback a API pública.
 # - Lanza error si no hay credenciales válidas.
 # ============================================================================
 def _get_client_and_mode():
-    from google import genai                     # Import local para evitar cargar si no se usa
-    if FORCE_PUBLIC and GOOGLE_API_KEY:          # Si se fuerza API pública y existe API key...
-        return genai.Client(api_key=GOOGLE_API_KEY), "public"  # ...usar cliente público
+    return get_client(GCP_LOCATION, force_public=FORCE_PUBLIC)  # (cliente, "vertex"|"public") reutilizado
 
-    if GCP_PROJECT:                               # Si hay proyecto configurado, intentar Vertex
-        try:
-            c = genai.Client(vertexai=True, project=GCP_PROJECT, location=GCP_LOCATION)  # Cliente orientado a Vertex
-            _ = c.models.list()                   # Llamada simple para validar acceso/permisos a Vertex
-            return c, "vertex"                    # Si funciona, devolvemos cliente + modo "vertex"
-        except Exception:                         # Si falla Vertex (falta API habilitada, permisos, etc.)
-            if GOOGLE_API_KEY:                    # ...y tenemos API key pública
-                return genai.Client(api_key=GOOGLE_API_KEY), "public"  # hacemos fallback a pública
-            raise RuntimeError("Fallo Vertex y no hay GOOGLE_API_KEY para fallback.")  # sin fallback posible -> error
 
-    if GOOGLE_API_KEY:                            # Si no hay proyecto pero sí API key, usar pública
-        return genai.Client(api_key=GOOGLE_API_KEY), "public"
+async def _get_client_and_mode_async():
+    return await get_client_async(GCP_LOCATION, force_public=FORCE_PUBLIC)  # validación/creación en un hilo
 
-    raise RuntimeError("Configura GCP_PROJECT o GOOGLE_API_KEY.")  # Si no hay nada configurado, avisamos
+
+# Estructura JSON de UNA descripción (se reutiliza en el modo multicanal)
+_DESC_SCHEMA_TEXT = """{
+  "short":   "≤160 caracteres; 1 frase con el principal valor percibido",
+  "long":    "400–600 caracteres; 2–4 oraciones: qué es → beneficios → uso/mantenimiento",
+  "bullets": ["4–6 viñetas; 6–14 palabras; concretas; sin punto final"],
+  "hashtags":["5–8 hashtags en minúscula, sin acentos, con #; p. ej. #desayuno #cereales"]
+}"""
+
+
+# Esquema (response_schema) equivalente: obliga al modelo a devolver JSON con esta forma
+_DESC_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "short": {"type": "STRING"},
+        "long": {"type": "STRING"},
+        "bullets": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "hashtags": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["short", "long", "bullets", "hashtags"],
+    "property_ordering": ["short", "long", "bullets", "hashtags"],
+}
+
+
+def _multichannel_schema(channels: List[str]) -> dict:
+    """Esquema multicanal: un objeto _DESC_SCHEMA por cada canal pedido."""
+    return {
+        "type": "OBJECT",
+        "properties": {ch: _DESC_SCHEMA for ch in channels},
+        "required": list(channels),
+        "property_ordering": list(channels),
+    }
 
 
 # ============================================================================
-# Función para construir el contenido del prompt para el modelo Gemini
-# - Incluye formato, instrucciones y modificadores por canal.
-# - Admite imágenes adicionales como entrada multimodal.
+# Plantilla RATOS-D de descripciones (services/prompt_templates.py)
+# - Prefijo estático (rol, reglas, formato, modificadores, checklist, few-shot)
+#   separado del bloque [DATOS] por producto, que va al final: el prefijo se
+#   reutiliza entre llamadas (caché de contexto explícita o implícita).
+# - Una variante por juego de canales (el formato multicanal cambia el prefijo).
 # ============================================================================
-def _build_contents(name: str, attrs: str, channel: str, images: Optional[List[bytes]]):
-    from google.genai import types               # Tipos del SDK para construir mensajes/partes
+_DESC_DATA = """
+[DATOS]
+Producto: {name}
+Atributos: {attrs}
+{datos_canal}
+
+Devuelve solo el JSON.
+"""
+
+
+def _description_template(channels: Optional[List[str]] = None):
+    if channels:                                 # Modo multicanal: un objeto por canal
+        keyed = ",\n".join(f'  "{ch}": ' + _DESC_SCHEMA_TEXT.replace("\n", "\n  ") for ch in channels)
+        formato = (
+            "Devuelve EXCLUSIVAMENTE un JSON con UNA clave por canal (exactamente: "
+            + ", ".join(f'"{ch}"' for ch in channels)
+            + ") y, en cada una, esta estructura adaptada a ese canal (sin backticks ni texto extra):\n"
+            + "{\n" + keyed + "\n}"
+        )
+    else:
+        formato = ("Devuelve EXCLUSIVAMENTE un JSON con esta estructura (sin backticks ni texto extra):\n"
+                   + _DESC_SCHEMA_TEXT)
 
     # ========================= PROMPT MEJORADO (RATOS-D) =========================
-    prompt = f"""
+    static = f"""
 [ROL]
 Eres un redactor senior de e-commerce en Perú, experto en conversión y SEO.
 
@@ -53,16 +107,11 @@ Eres un redactor senior de e-commerce en Perú, experto en conversión y SEO.
 Escribe en español peruano, claro y natural. Adapta el lenguaje al canal indicado.
 
 [TAREA]
-Redacta descripciones de producto a partir de:
+Redacta descripciones de producto a partir de los [DATOS] al final:
 - Nombre del producto
 - Atributos declarados (NO inventar)
 - Canal de publicación
 
-[DATOS]
-Producto: {name}
-Atributos: {attrs}
-Canal: {channel}
-
 [REGLAS DE CONTENIDO]
 - No inventes características que no estén en los atributos; si falta un dato, omítelo.
 - Sin claims absolutos (“el mejor”, “#1”) ni beneficios de salud no sustentados.
@@ -72,13 +121,7 @@ Canal: {channel}
 - Tono: cercano pero profesional; gramática limpia; tuteo o neutro.
 
 [FORMATO DE SALIDA — SOLO JSON VÁLIDO]
-Devuelve EXCLUSIVAMENTE un JSON con esta estructura (sin backticks ni texto extra):
-{{
-  "short":   "≤160 caracteres; 1 frase con el principal valor percibido",
-  "long":    "400–600 caracteres; 2–4 oraciones: qué es → beneficios → uso/mantenimiento",
-  "bullets": ["4–6 viñetas; 6–14 palabras; concretas; sin punto final"],
-  "hashtags":["5–8 hashtags en minúscula, sin acentos, con #; p. ej. #desayuno #cereales"]
-}}
+{formato}
 
 [MODIFICADORES POR CANAL]
 - "IG": tono ligeramente más cercano; enfoca visualidad/ocasión de uso; evita cifras técnicas.
@@ -92,13 +135,12 @@ Devuelve EXCLUSIVAMENTE un JSON con esta estructura (sin backticks ni texto extr
 - ¿4–6 bullets sin punto final?
 - ¿5–8 hashtags; todos con #; sin espacios ni acentos?
 - ¿Nada fuera de lo declarado en atributos?
-
-Devuelve solo el JSON.
 """.strip()
     # ============================================================================
 
     # (Opcional) Few-shot para mayor estabilidad: actívalo con PROMPT_FEWSHOT_EXAMPLE=1 en .env
-    if os.getenv("PROMPT_FEWSHOT_EXAMPLE", "").lower() in ("1", "true", "yes"):
+    fewshot_on = os.getenv("PROMPT_FEWSHOT_EXAMPLE", "").lower() in ("1", "true", "yes")
+    if fewshot_on:
         few_shot = """
 [EJEMPLO — NO COPIAR LITERALMENTE, SOLO REFERENCIA DE ESTILO]
 Entrada:
@@ -120,11 +162,34 @@ Salida (JSON):
   "hashtags":["#desayuno","#cereal","#fibra","#avena","#quinua","#vidasana"]
 }
 """.strip()
-        prompt = prompt + "\n\n" + few_shot
+        static = static + "\n\n" + few_shot
+
+    name = "description:" + (",".join(channels) if channels else "single") + (":fewshot" if fewshot_on else "")
+    return register_template(name, static, _DESC_DATA)
+
+
+# ============================================================================
+# Función para construir el contenido del prompt para el modelo Gemini
+# - Prefijo estático de la plantilla + bloque [DATOS] del producto.
+# - Admite imágenes adicionales como entrada multimodal.
+# - Si se pasa 'channels' (lista), pide TODOS esos canales en una sola respuesta
+#   (JSON con una clave por canal): un solo envío del prompt y de las imágenes.
+# ============================================================================
+def _render_prompt(name: str, attrs: str, channel: str, channels: Optional[List[str]] = None, tpl=None) -> str:
+    tpl = tpl or _description_template(channels)
+    datos_canal = ("Canales: " + ", ".join(channels)) if channels else f"Canal: {channel}"
+    return tpl.render(name=name, attrs=attrs, datos_canal=datos_canal)
+
+
+def _build_contents(name: str, attrs: str, channel: str, images: Optional[List[bytes]],
+                    channels: Optional[List[str]] = None, tpl=None, prompt: Optional[str] = None):
+    from google.genai import types               # Tipos del SDK para construir mensajes/partes
+
+    prompt = prompt if prompt is not None else _render_prompt(name, attrs, channel, channels, tpl)
 
     parts = [types.Part.from_text(text=prompt)]  # Creamos la parte de texto (instrucciones/prompt)
     if images:                                   # Si se pasaron imágenes (bytes)...
-        for b in images:
+        for b in prepare_images(images):         # ...reducidas, sin duplicados y dentro del presupuesto
             parts.append(types.Part.from_bytes(data=b, mime_type="image/jpeg"))  # ...adjuntarlas como partes multimodales
     return [types.Content(role="user", parts=parts)]  # Construimos el "Content" del usuario con sus parts
 
@@ -134,6 +199,7 @@ Salida (JSON):
 # - Intenta parseo directo.
 # - Busca bloques ```json ...``` si el directo falla.
 # - Si todo falla, lanza error.
+# - Con salida estructurada es solo el respaldo de parse_json (services/structured.py).
 # ============================================================================
 def _extract_json(text: str) -> dict:
     try:
@@ -169,27 +235,239 @@ def _normalize(out: dict) -> dict:
     return out
 
 
+# ============================================================================
+# Helpers compartidos por la versión síncrona y la asíncrona
+# - _description_request: arma un constructor de contents + config, la clave de
+#   caché y la plantilla. La clave usa el prompt completo, el SHA-256 de las
+#   imágenes ORIGINALES y los parámetros de preprocesamiento: un hit de caché no
+#   decodifica ni reduce imágenes (prepare_images solo corre si hay que llamar
+#   al modelo, al invocar build()).
+# - _cached_description: devuelve la entrada cacheada (o None).
+# - _finish_description: parsea, normaliza y guarda en caché.
+# ============================================================================
+# Parámetros de prepare_images que cambian las imágenes enviadas (parte de la clave)
+_IMAGE_PREP_PARAMS = {
+    "max_edge": IMAGE_MAX_EDGE, "quality": IMAGE_JPEG_QUALITY, "max_count": IMAGE_MAX_COUNT,
+    "max_total_bytes": IMAGE_MAX_TOTAL_BYTES, "dedup_distance": IMAGE_DEDUP_DISTANCE,
+}
+
+
+def _description_request(name: str, attrs_text: str, channel: str,
+                         image_files: Optional[List[bytes]],
+                         temperature: float, top_p: float, max_tokens: Optional[int],
+                         channels: Optional[List[str]] = None):
+    tpl = _description_template(channels)                          # Prefijo estático registrado
+    max_tokens = int(max_tokens or output_budget("description", len(channels or [channel])))  # Salida según canales
+    prompt = _render_prompt(name, attrs_text, channel, channels, tpl)
+    images = [b for b in (image_files or []) if b]
+    key = make_key(GEMINI_MODEL, [prompt] + ["img:" + hashlib.sha256(b).hexdigest() for b in images],  # Clave por contenido (hash)
+                   _IMAGE_PREP_PARAMS,
+                   {"temperature": temperature, "top_p": top_p, "max_tokens": max_tokens})
+    schema = _multichannel_schema(channels) if channels else _DESC_SCHEMA  # JSON estructurado (sin regex)
+    config = json_config(schema, temperature=temperature, top_p=top_p, max_output_tokens=max_tokens)
+
+    def build():                                                   # Prompt multimodal (solo en cache miss)
+        return _build_contents(name, attrs_text, channel, images, channels=channels, tpl=tpl, prompt=prompt)
+    return build, config, key, tpl
+
+
+def _cached_description(key: str) -> Optional[Dict]:
+    hit = description_cache().get(key)
+    if hit is None:
+        return None
+    out = dict(hit["data"])
+    out["raw"] = hit["raw"]
+    return out
+
+
+def _finish_description(text: str, key: str) -> Dict:
+    try:
+        parsed = parse_json(text, _extract_json, "description")  # JSON directo; regex solo como respaldo
+        out = _normalize(parsed)
+    except Exception:
+        return {"short": "", "long": "", "bullets": [], "hashtags": [], "raw": text}  # Fallback mínimo (no se cachea)
+
+    description_cache().put(key, text, out)                     # Guardar (también si se omitió la lectura)
+    out["raw"] = text                                           # Guardar texto original para depuración
+    return out
+
+
+def _finish_multichannel(text: str, key: str, channels: List[str]) -> Dict[str, Dict]:
+    """
+    Reparte la respuesta multicanal por canal y aplica _normalize a cada uno.
+    Los canales que falten quedan vacíos; solo se cachea si llegaron TODOS con
+    contenido (un resultado parcial se devuelve sin cachear para no repetirlo
+    en cada hit posterior).
+    """
+    try:
+        parsed = parse_json(text, _extract_json, "description_multichannel")
+    except Exception:
+        parsed = {}
+    by_name = {str(k).strip().lower(): v for k, v in parsed.items()} if isinstance(parsed, dict) else {}
+
+    out: Dict[str, Dict] = {}
+    for ch in channels:
+        v = by_name.get(ch.lower())
+        out[ch] = _normalize(dict(v)) if isinstance(v, dict) else _normalize({})
+    if out and all(o["short"] or o["long"] for o in out.values()):
+        description_cache().put(key, text, out)
+    for o in out.values():
+        o["raw"] = text                                         # Texto original (compartido) para depuración
+    return out
+
+
+def _cached_multichannel(key: str) -> Optional[Dict[str, Dict]]:
+    hit = description_cache().get(key)
+    if hit is None:
+        return None
+    return {ch: dict(v, raw=hit["raw"]) for ch, v in hit["data"].items()}
+
+
 # ============================================================================
 # Función principal para generar descripciones de producto usando Gemini
 # - Recibe datos del producto, canal y opcionalmente imágenes.
 # - Construye el prompt y llama al modelo configurado.
+# - Consulta antes la caché en disco (modelo + prompt + imágenes + sampling);
+#   use_cache=False fuerza una generación nueva (p. ej., para otra variación).
 # - Devuelve la respuesta parseada y normalizada.
 # ============================================================================
 def generate_product_description_gemini(name: str, attrs_text: str, channel: str,
                                         image_files: Optional[List[bytes]] = None,
                                         temperature: float = 0.9, top_p: float = 0.95,
-                                        max_tokens: int = 1024) -> Dict:
-    from google.genai import types
+                                        max_tokens: Optional[int] = None,
+                                        use_cache: bool = True) -> Dict:
+    build, config, key, tpl = _description_request(name, attrs_text, channel, image_files,
+                                                   temperature, top_p, max_tokens)
+    if use_cache:
+        hit = _cached_description(key)
+        if hit is not None:
+            return hit
+
     client, _ = _get_client_and_mode()                          # Obtener cliente y modo
-    contents = _build_contents(name, attrs_text, channel, image_files)  # Construir prompt multimodal
-    config = types.GenerateContentConfig(temperature=temperature, top_p=top_p, max_output_tokens=max_tokens)
+    contents = build()                                          # Imágenes preprocesadas solo en cache miss
+    est = check_request(contents, config.max_output_tokens, client, GEMINI_MODEL)  # Rechaza antes de enviar si no entra
+    contents, config = with_context_cache(client, GEMINI_MODEL, tpl, contents, config)  # Prefijo desde caché (si aplica)
     resp = client.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
-    text = (resp.text or "").strip()
+    record_usage("description", est, config.max_output_tokens, resp)  # Estimado vs. real
+    return _finish_description((resp.text or "").strip(), key)
 
-    try:
-        parsed = _extract_json(text)                            # Intentar extraer JSON
-        out = _normalize(parsed)
-        out["raw"] = text                                       # Guardar texto original para depuración
-        return out
-    except Exception:
-        return {"short": "", "long": "", "bullets": [], "hashtags": [], "raw": text}  # Fallback mínimo
+
+# ============================================================================
+# Versión en streaming (generate_content_stream)
+# - Emite eventos (campo, valor) a medida que cada campo del JSON se completa:
+#   primero "short", luego "long", "bullets" y "hashtags".
+# - El último evento es ("result", salida) con el mismo formato que la versión
+#   síncrona (pasa por _normalize y se guarda en la caché).
+# - Si hay hit de caché, se emiten los campos y el resultado de inmediato.
+# ============================================================================
+def stream_product_description_gemini(name: str, attrs_text: str, channel: str,
+                                      image_files: Optional[List[bytes]] = None,
+                                      temperature: float = 0.9, top_p: float = 0.95,
+                                      max_tokens: Optional[int] = None,
+                                      use_cache: bool = True) -> Iterator[Tuple[str, object]]:
+    build, config, key, tpl = _description_request(name, attrs_text, channel, image_files,
+                                                   temperature, top_p, max_tokens)
+    if use_cache:
+        hit = _cached_description(key)
+        if hit is not None:
+            for field in ("short", "long", "bullets", "hashtags"):
+                yield field, hit[field]
+            yield "result", hit
+            return
+
+    client, _ = _get_client_and_mode()
+    contents = build()
+    est = check_request(contents, config.max_output_tokens, client, GEMINI_MODEL)
+    contents, config = with_context_cache(client, GEMINI_MODEL, tpl, contents, config)
+    parser = IncrementalJSONObject()                            # Entrega cada campo apenas se cierra
+    chunk = None
+    for chunk in client.models.generate_content_stream(model=GEMINI_MODEL, contents=contents, config=config):
+        for field, value in parser.feed(chunk.text or "").items():
+            yield field, value
+    record_usage("description", est, config.max_output_tokens, chunk)  # El último chunk trae usage_metadata
+    yield "result", _finish_description(parser.buf.strip(), key)
+
+
+# ============================================================================
+# Versión asíncrona (client.aio): misma entrada/salida que la síncrona.
+# - Pensada para lanzar cientos de requests en un solo event loop
+#   (ver services/async_utils.gather_bounded para acotar la concurrencia).
+# - Caché en disco (SQLite), preparación de imágenes y validación del cliente
+#   corren en hilos (asyncio.to_thread): nada bloquea el event loop.
+# ============================================================================
+async def generate_product_description_gemini_async(name: str, attrs_text: str, channel: str,
+                                                    image_files: Optional[List[bytes]] = None,
+                                                    temperature: float = 0.9, top_p: float = 0.95,
+                                                    max_tokens: Optional[int] = None,
+                                                    use_cache: bool = True) -> Dict:
+    build, config, key, tpl = _description_request(name, attrs_text, channel, image_files,
+                                                   temperature, top_p, max_tokens)
+    if use_cache:
+        hit = await asyncio.to_thread(_cached_description, key)
+        if hit is not None:
+            return hit
+
+    client, _ = await _get_client_and_mode_async()
+    contents = await asyncio.to_thread(build)
+    est = check_request(contents, config.max_output_tokens)
+    contents, config = await with_context_cache_async(client, GEMINI_MODEL, tpl, contents, config)
+    resp = await client.aio.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
+    record_usage("description", est, config.max_output_tokens, resp)
+    return await asyncio.to_thread(_finish_description, (resp.text or "").strip(), key)
+
+
+# ============================================================================
+# Generación multicanal en UNA sola llamada
+# - Pide todos los canales (por defecto Web, IG, Ads y Marketplace) en un mismo
+#   request: el prompt RATOS-D y las imágenes se envían una sola vez.
+# - Devuelve {canal: {"short","long","bullets","hashtags","raw"}} con
+#   _normalize aplicado a cada canal (mismo formato que la versión por canal).
+# - max_tokens por defecto escala con la cantidad de canales (token_budget).
+# ============================================================================
+CHANNELS = ["Web", "IG", "Ads", "Marketplace"]                  # Canales canónicos que entiende el prompt
+
+
+def generate_multichannel_descriptions_gemini(name: str, attrs_text: str,
+                                              channels: Optional[List[str]] = None,
+                                              image_files: Optional[List[bytes]] = None,
+                                              temperature: float = 0.9, top_p: float = 0.95,
+                                              max_tokens: Optional[int] = None,
+                                              use_cache: bool = True) -> Dict[str, Dict]:
+    chs = list(channels or CHANNELS)
+    build, config, key, tpl = _description_request(name, attrs_text, chs[0], image_files, temperature, top_p,
+                                                   max_tokens, channels=chs)
+    if use_cache:
+        hit = _cached_multichannel(key)
+        if hit is not None:
+            return hit
+
+    client, _ = _get_client_and_mode()
+    contents = build()
+    est = check_request(contents, config.max_output_tokens, client, GEMINI_MODEL)
+    contents, config = with_context_cache(client, GEMINI_MODEL, tpl, contents, config)
+    resp = client.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
+    record_usage("description", est, config.max_output_tokens, resp)
+    return _finish_multichannel((resp.text or "").strip(), key, chs)
+
+
+async def generate_multichannel_descriptions_gemini_async(name: str, attrs_text: str,
+                                                          channels: Optional[List[str]] = None,
+                                                          image_files: Optional[List[bytes]] = None,
+                                                          temperature: float = 0.9, top_p: float = 0.95,
+                                                          max_tokens: Optional[int] = None,
+                                                          use_cache: bool = True) -> Dict[str, Dict]:
+    chs = list(channels or CHANNELS)
+    build, config, key, tpl = _description_request(name, attrs_text, chs[0], image_files, temperature, top_p,
+                                                   max_tokens, channels=chs)
+    if use_cache:
+        hit = await asyncio.to_thread(_cached_multichannel, key)
+        if hit is not None:
+            return hit
+
+    client, _ = await _get_client_and_mode_async()
+    contents = await asyncio.to_thread(build)
+    est = check_request(contents, config.max_output_tokens)
+    contents, config = await with_context_cache_async(client, GEMINI_MODEL, tpl, contents, config)
+    resp = await client.aio.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
+    record_usage("description", est, config.max_output_tokens, resp)
+    return await asyncio.to_thread(_finish_multichannel, (resp.text or "").strip(), key, chs)
@@ -0,0 +1,215 @@
+# services/prompt_templates.py
+# -----------------------------------------------------------------------------
+# Registro de plantillas de prompt (RATOS-D) separadas en dos partes:
+# - static: prefijo fijo (rol, reglas, formato, checklist, few-shot opcional).
+#   Es idéntico entre llamadas, así que va SIEMPRE primero en el prompt
+#   (también aprovecha la caché implícita de prefijos de Gemini).
+# - data: bloque por ítem (producto, reviews, canal...) que se rellena con
+#   str.format y va al final.
+# Caché de contexto explícita (client.caches):
+# - El prefijo estático se registra UNA vez como cached content por
+#   (cliente, modelo, plantilla) y las llamadas siguientes solo envían 'data'
+#   + config.cached_content → menos tokens de entrada facturados y menor TTFT.
+# - TTL gestionado aquí: se extiende (caches.update) cuando está por vencer y se
+#   recrea si la extensión falla; si el backend rechaza la caché (prefijo corto,
+#   modelo sin soporte) se recuerda el rechazo durante el TTL y se envía inline.
+# - Solo se cachean prefijos con al menos GEMINI_CONTEXT_CACHE_MIN_TOKENS
+#   (estimados con token_budget.estimate_tokens): el backend exige un mínimo
+#   (1024 tokens en los modelos Flash). Con los prompts actuales eso solo lo
+#   alcanzan las descripciones multicanal (≈4 canales); los prefijos más cortos
+#   (resumen, sentimiento, temas, respuestas, descripción de un canal) viajan
+#   inline y aprovechan solo la caché implícita de prefijos.
+# - Lock por plantilla: crear/extender una caché (llamada de red) solo bloquea
+#   a los hilos que usan ESA plantilla, no a todo el proceso.
+# - Config por .env:
+#     * GEMINI_CONTEXT_CACHE            → 1/0 (defecto 1)
+#     * GEMINI_CONTEXT_CACHE_TTL_S      → vida de cada caché (defecto 3600)
+#     * GEMINI_CONTEXT_CACHE_MIN_TOKENS → tamaño mínimo estimado del prefijo
+#                                         para intentar cachearlo (defecto 1024)
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from .token_budget import estimate_tokens
+
+CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_TTL_S = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_S", "3600"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+
+_SEP = "\n\n"                  # separador entre prefijo estático y datos
+_REFRESH_MARGIN = 0.2          # extender cuando quede <20% del TTL
+
+
+class PromptTemplate:
+    """Prefijo estático + bloque de datos por ítem (str.format)."""
+
+    __slots__ = ("name", "static", "data", "digest")
+
+    def __init__(self, name: str, static: str, data: str):
+        self.name = name
+        self.static = static.strip()
+        self.data = data.strip()
+        self.digest = hashlib.sha256(self.static.encode("utf-8")).hexdigest()[:16]
+
+    def render_data(self, **fields: Any) -> str:
+        return self.data.format(**fields)
+
+    def render(self, **fields: Any) -> str:
+        """Prompt completo: prefijo estático primero, datos al final."""
+        return self.static + _SEP + self.render_data(**fields)
+
+
+_TEMPLATES: Dict[str, PromptTemplate] = {}
+_TEMPLATES_LOCK = threading.Lock()
+
+
+def register_template(name: str, static: str, data: str) -> PromptTemplate:
+    """
+    Registra (o devuelve, si ya existe con el mismo prefijo) la plantilla 'name'.
+    Las variantes (p. ej., un juego de canales distinto) se registran con otro nombre.
+    """
+    tpl = PromptTemplate(name, static, data)
+    with _TEMPLATES_LOCK:
+        cur = _TEMPLATES.get(name)
+        if cur is not None and cur.digest == tpl.digest and cur.data == tpl.data:
+            return cur
+        _TEMPLATES[name] = tpl
+        return tpl
+
+
+def get_template(name: str) -> PromptTemplate:
+    with _TEMPLATES_LOCK:
+        return _TEMPLATES[name]
+
+
+# -----------------------------
+# Caché de contexto explícita
+# -----------------------------
+# (id(cliente), modelo, plantilla, digest) -> {"name": str|None, "expires_at": float, "client": cliente}
+_CACHES: Dict[Tuple[int, str, str, str], Dict[str, Any]] = {}
+_CACHES_LOCK = threading.Lock()                # protege los dicts (nunca se retiene durante la red)
+_KEY_LOCKS: Dict[Tuple[int, str, str, str], threading.Lock] = {}
+
+
+def _key_lock(key: Tuple[int, str, str, str]) -> threading.Lock:
+    with _CACHES_LOCK:
+        return _KEY_LOCKS.setdefault(key, threading.Lock())
+
+
+def _fresh(entry: Optional[Dict[str, Any]], ttl: int, now: float) -> bool:
+    return bool(entry) and now < entry["expires_at"] - ttl * _REFRESH_MARGIN
+
+
+def _create(client, model: str, tpl: PromptTemplate, ttl_s: int) -> Optional[str]:
+    from google.genai import types
+    cached = client.caches.create(
+        model=model,
+        config=types.CreateCachedContentConfig(
+            contents=[types.Content(role="user", parts=[types.Part.from_text(text=tpl.static)])],
+            ttl=f"{int(ttl_s)}s",
+            display_name=f"{tpl.name}:{tpl.digest}"[:128],
+        ),
+    )
+    return cached.name
+
+
+def _extend(client, name: str, ttl_s: int) -> None:
+    from google.genai import types
+    client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{int(ttl_s)}s"))
+
+
+def context_cache_name(client, model: str, tpl: PromptTemplate,
+                       ttl_s: Optional[int] = None) -> Optional[str]:
+    """
+    Devuelve el nombre del cached content con el prefijo de 'tpl' (o None si
+    la caché está desactivada, el prefijo es muy corto o el backend la rechazó).
+    """
+    if not CONTEXT_CACHE or estimate_tokens(tpl.static) < CONTEXT_CACHE_MIN_TOKENS:
+        return None
+    ttl = int(ttl_s or CONTEXT_CACHE_TTL_S)
+    key = (id(client), model, tpl.name, tpl.digest)
+    with _CACHES_LOCK:                                 # camino rápido: caché vigente
+        entry = _CACHES.get(key)
+        if _fresh(entry, ttl, time.time()):
+            return entry["name"]
+
+    # Crear/extender (red) con el lock de ESTA plantilla; el resto sigue libre
+    with _key_lock(key):
+        with _CACHES_LOCK:
+            entry = _CACHES.get(key)
+        now = time.time()
+        if _fresh(entry, ttl, now):                    # otro hilo ya la renovó
+            return entry["name"]
+        if entry and entry["name"] and now < entry["expires_at"]:
+            try:
+                _extend(client, entry["name"], ttl)
+                with _CACHES_LOCK:
+                    entry["expires_at"] = now + ttl
+                return entry["name"]
+            except Exception:
+                pass                                   # vencida o borrada: recrear
+        try:
+            name = _create(client, model, tpl, ttl)
+        except Exception:
+            name = None                                # rechazo: no reintentar hasta el TTL
+        with _CACHES_LOCK:
+            _CACHES[key] = {"name": name, "expires_at": now + ttl, "client": client}
+        return name
+
+
+def _strip_static(contents, static: str):
+    """Quita el prefijo estático del primer bloque de texto; None si no lo encuentra."""
+    if isinstance(contents, str):
+        return contents[len(static):].lstrip("\n") if contents.startswith(static) else None
+    from google.genai import types
+    first = contents[0]
+    head = first.parts[0]
+    text = head if isinstance(head, str) else getattr(head, "text", None)
+    if not text or not text.startswith(static):
+        return None
+    rest = types.Part.from_text(text=text[len(static):].lstrip("\n"))
+    return [types.Content(role=first.role, parts=[rest] + list(first.parts[1:]))] + list(contents[1:])
+
+
+def with_context_cache(client, model: str, tpl: PromptTemplate, contents, config):
+    """
+    Si el prefijo de 'tpl' está (o queda) en caché, devuelve (contents sin el
+    prefijo, config con cached_content); si no, devuelve la entrada sin cambios.
+    """
+    name = context_cache_name(client, model, tpl)
+    if not name:
+        return contents, config
+    stripped = _strip_static(contents, tpl.static)
+    if stripped is None:
+        return contents, config
+    return stripped, config.model_copy(update={"cached_content": name})
+
+
+async def with_context_cache_async(client, model: str, tpl: PromptTemplate, contents, config):
+    """Versión async: la creación/extensión de la caché corre en un hilo aparte."""
+    return await asyncio.to_thread(with_context_cache, client, model, tpl, contents, config)
+
+
+def clear_context_caches(delete_remote: bool = True) -> int:
+    """
+    Olvida las cachés registradas y, por defecto, las borra del backend
+    (p. ej., al terminar un lote largo para no pagar almacenamiento hasta el TTL).
+    Devuelve cuántas se borraron.
+    """
+    with _CACHES_LOCK:
+        entries = list(_CACHES.values())
+        _CACHES.clear()
+    deleted = 0
+    for e in entries:
+        if delete_remote and e["name"] and time.time() < e["expires_at"]:
+            try:
+                e["client"].caches.delete(name=e["name"])
+                deleted += 1
+            except Exception:
+                pass
+    return deleted
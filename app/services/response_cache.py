@@ -0,0 +1,159 @@
+# services/response_cache.py
+# -----------------------------------------------------------------------------
+# Caché persistente (en disco) de respuestas del modelo, direccionada por contenido.
+# - La clave es un hash SHA-256 del modelo, del prompt renderizado, de los
+#   digests de las imágenes y de los parámetros de generación.
+# - Guarda el texto crudo ("raw") y el JSON ya normalizado.
+# - Evicción LRU acotada por número de entradas + expiración por TTL.
+# - Expone contadores de hits/misses para monitoreo.
+# - Backend: SQLite (stdlib), seguro entre hilos (Streamlit / pools de workers).
+# Variables de entorno:
+#     * GENAI_CACHE_DIR          → carpeta de la caché (defecto .cache/genai)
+#     * DESC_CACHE_MAX_ENTRIES   → entradas máximas antes de evictar (defecto 5000)
+#     * DESC_CACHE_TTL_S         → vida de cada entrada en segundos (defecto 7 días)
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()  # Carga variables de entorno desde .env (si existe) al proceso
+
+CACHE_DIR = os.getenv("GENAI_CACHE_DIR", os.path.join(".cache", "genai"))
+DESC_CACHE_MAX_ENTRIES = int(os.getenv("DESC_CACHE_MAX_ENTRIES", "5000"))
+DESC_CACHE_TTL_S = float(os.getenv("DESC_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Hash estable (SHA-256) de las partes recibidas.
+    Cada parte se serializa como JSON canónico para que el orden de claves no importe.
+    """
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(json.dumps(p, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def contents_fingerprint(contents: Any) -> List[str]:
+    """
+    Huella del 'contents' enviado al modelo: el texto de cada parte tal cual
+    y el SHA-256 de cada imagen (no los bytes), en el mismo orden.
+    Acepta un string, o una lista de Content(role, parts=[...]).
+    """
+    if isinstance(contents, str):
+        return [contents]
+    out: List[str] = []
+    for content in contents or []:
+        for part in getattr(content, "parts", None) or []:
+            text = getattr(part, "text", None)
+            if text is not None:
+                out.append(text)
+                continue
+            blob = getattr(part, "inline_data", None)
+            data = getattr(blob, "data", None) if blob is not None else None
+            if data is not None:
+                out.append("img:" + hashlib.sha256(data).hexdigest())
+    return out
+
+
+class ResponseCache:
+    """
+    Caché LRU + TTL en SQLite.
+    - get(key) → {"raw": str, "data": dict} o None (cuenta hit/miss).
+    - put(key, raw, data) → guarda y evicta lo más antiguo si supera max_entries.
+    """
+
+    def __init__(self, path: str, max_entries: int = DESC_CACHE_MAX_ENTRIES, ttl_s: float = DESC_CACHE_TTL_S):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, raw TEXT, data TEXT,"
+            " created_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT raw, data, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            raw, data, created_at = row
+            if self.ttl_s > 0 and now - created_at > self.ttl_s:
+                # Expirada → se elimina y cuenta como miss
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return {"raw": raw, "data": json.loads(data)}
+
+    def put(self, key: str, raw: str, data: Dict[str, Any]) -> None:
+        now = time.time()
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, raw, data, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, raw, payload, now, now),
+            )
+            if self.ttl_s > 0:
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_s,))
+            # LRU: conservar solo las max_entries accedidas más recientemente
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de la sesión (hits, misses, hit_rate) + entradas en disco."""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries": int(size),
+            "max_entries": self.max_entries,
+        }
+
+
+_DESC_CACHE: Optional[ResponseCache] = None
+_DESC_LOCK = threading.Lock()
+
+
+def description_cache() -> ResponseCache:
+    """Caché compartida (por proceso) para descripciones de producto."""
+    global _DESC_CACHE
+    with _DESC_LOCK:
+        if _DESC_CACHE is None:
+            _DESC_CACHE = ResponseCache(os.path.join(CACHE_DIR, "descriptions.sqlite3"))
+        return _DESC_CACHE
@@ -0,0 +1,280 @@
+# services/review_clusters.py
+# -----------------------------------------------------------------------------
+# Clustering de reviews por embeddings para extraer temas de TODO el corpus.
+# - Embeddings:
+#     * local_embeddings: stand-in determinista y offline (feature hashing de
+#       palabras + 3-gramas de caracteres, con signo, normalizado L2); se
+#       calcula por bloques con NumPy, sin bucles por review.
+#     * embed_texts_gemini: client.models.embed_content por lotes en paralelo
+#       (task_type=CLUSTERING).
+# - kmeans: k-means esférico en NumPy (Lloyd si el corpus es chico,
+#   mini-batch si es grande), ponderado por la multiplicidad de cada texto
+#   (los casi duplicados se agrupan antes con review_dedup).
+# - cluster_reviews: ReviewClusters con tamaño, proporción, palabras clave y
+#   reviews representativas (las más cercanas al centroide) de cada cluster;
+#   solo eso viaja al modelo para nombrar los temas (feedback_gemini.extract_themes_gemini).
+# - Config por .env:
+#     * CLUSTER_K              → cantidad de clusters (0 = automático, defecto 0)
+#     * CLUSTER_EMBED_DIM      → dimensión de los embeddings (defecto 256)
+#     * GEMINI_EMBED_MODEL     → modelo de embeddings (defecto gemini-embedding-001)
+#     * EMBED_BATCH_SIZE       → textos por request de embeddings (defecto 100)
+#     * EMBED_CONCURRENCY      → requests de embeddings en vuelo (defecto 8)
+# -----------------------------------------------------------------------------
+
+import os
+import math
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .review_dedup import group_reviews, normalize_review
+
+CLUSTER_K = int(os.getenv("CLUSTER_K", "0"))
+CLUSTER_EMBED_DIM = int(os.getenv("CLUSTER_EMBED_DIM", "256"))
+GEMINI_EMBED_MODEL = os.getenv("GEMINI_EMBED_MODEL", "gemini-embedding-001")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
+
+_SEED = 1234
+_BLOCK = 20_000             # reviews por bloque al embeber / asignar
+_FULL_MAX = 20_000          # hasta aquí Lloyd completo; más arriba, mini-batch
+_MINIBATCH = 4096
+_MAX_ITERS = 30
+_MINIBATCH_ITERS = 150
+_EMBED_MAX_CHARS = 2000
+_STOPWORDS = set("""
+de la que el en y a los se del las un por con no una su para es al lo como mas o pero sus le ya
+fue este ha si porque esta son entre cuando muy sin sobre tambien me hasta hay donde quien desde
+todo nos durante todos uno les ni contra otros ese eso ante ellos e esto mi antes algunos que unos yo
+otro otras otra el tanto esa estos mucho quienes nada muchos cual poco ella estar estas algunas algo
+nosotros mis tu te ti tus ellas nosotras vosotros os mio mia tuyo tuya suyo suya nuestro nuestra
+estoy esta estamos estan fui era eran tengo tiene tienen tenia hacer hace solo ser han he vez verdad
+""".split())
+
+
+# -----------------------------
+# Embeddings
+# -----------------------------
+def _words(norm: pd.Series) -> pd.Series:
+    """Palabras útiles (≥3 letras, sin stopwords) por texto normalizado, en formato largo."""
+    w = norm.str.split().explode().dropna()
+    return w[(w.str.len() >= 3) & ~w.isin(_STOPWORDS) & ~w.str.isdigit()]
+
+
+def _features(token: str, dim: int) -> List[Tuple[int, float]]:
+    """Buckets (con signo) de una palabra: la palabra entera + sus 3-gramas de caracteres."""
+    grams = [token] + [f"#{token}#"[i:i + 3] for i in range(len(token))]
+    out = []
+    for j, g in enumerate(grams):
+        h = zlib.crc32(g.encode("utf-8"))
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        out.append((h % dim, sign * (1.0 if j == 0 else 0.5)))
+    return out
+
+
+def local_embeddings(texts: List[str], dim: int = CLUSTER_EMBED_DIM) -> np.ndarray:
+    """
+    Embeddings deterministas sin API (n × dim, float32, norma 1).
+    Las características se calculan una vez por palabra única del bloque y se
+    acumulan por review con np.bincount.
+    """
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for lo in range(0, len(texts), _BLOCK):
+        block = pd.Series([normalize_review(t) for t in texts[lo:lo + _BLOCK]], dtype="object")
+        words = _words(block)
+        if words.empty:
+            continue
+        doc = words.index.to_numpy(dtype=np.int64)
+        codes, vocab = pd.factorize(words.to_numpy())
+        feats = [_features(w, dim) for w in vocab]
+        ptr = np.r_[0, np.cumsum([len(f) for f in feats])]
+        f_idx = np.fromiter((b for f in feats for b, _ in f), dtype=np.int64, count=ptr[-1])
+        f_val = np.fromiter((v for f in feats for _, v in f), dtype=np.float64, count=ptr[-1])
+        n_feat = ptr[codes + 1] - ptr[codes]
+        pos = np.repeat(np.arange(len(codes)), n_feat)
+        offset = np.arange(len(pos)) - np.repeat(np.cumsum(n_feat) - n_feat, n_feat)
+        f = ptr[codes][pos] + offset
+        flat = doc[pos] * dim + f_idx[f]
+        acc = np.bincount(flat, weights=f_val[f], minlength=len(block) * dim)
+        out[lo:lo + len(block)] = acc.reshape(len(block), dim)
+    return _l2(out)
+
+
+def embed_texts_gemini(texts: List[str], client, model: str = GEMINI_EMBED_MODEL,
+                       dim: int = CLUSTER_EMBED_DIM) -> np.ndarray:
+    """Embeddings de Gemini por lotes (EMBED_BATCH_SIZE) en paralelo; n × dim, norma 1."""
+    from google.genai import types
+    cfg = types.EmbedContentConfig(task_type="CLUSTERING", output_dimensionality=int(dim))
+    batches = [[t[:_EMBED_MAX_CHARS] or " " for t in texts[i:i + EMBED_BATCH_SIZE]]
+               for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+
+    def _one(batch: List[str]) -> np.ndarray:
+        resp = client.models.embed_content(model=model, contents=batch, config=cfg)
+        return np.asarray([e.values for e in resp.embeddings], dtype=np.float32)
+
+    if not batches:
+        return np.zeros((0, dim), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=max(1, EMBED_CONCURRENCY)) as pool:
+        return _l2(np.vstack(list(pool.map(_one, batches))))
+
+
+def _l2(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms > 0, norms, 1.0)
+
+
+# -----------------------------
+# K-means esférico (NumPy)
+# -----------------------------
+def _assign(x: np.ndarray, centroids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(cluster, similitud coseno) de cada fila, por bloques."""
+    labels = np.empty(len(x), dtype=np.int64)
+    sims = np.empty(len(x), dtype=np.float32)
+    for lo in range(0, len(x), _BLOCK):
+        s = x[lo:lo + _BLOCK] @ centroids.T
+        labels[lo:lo + _BLOCK] = s.argmax(axis=1)
+        sims[lo:lo + _BLOCK] = s[np.arange(len(s)), labels[lo:lo + _BLOCK]]
+    return labels, sims
+
+
+def _init(x: np.ndarray, k: int, w: np.ndarray, rng) -> np.ndarray:
+    """k-means++ sobre una muestra (ponderada por multiplicidad)."""
+    idx = rng.choice(len(x), size=min(len(x), 20 * k + 1000), replace=False, p=w / w.sum())
+    sample, sw = x[idx], w[idx]
+    centers = [sample[rng.choice(len(sample), p=sw / sw.sum())]]
+    d = np.full(len(sample), np.inf)
+    for _ in range(1, k):
+        d = np.minimum(d, 1.0 - sample @ centers[-1])
+        p = np.clip(d, 0, None) * sw
+        if p.sum() <= 0:
+            break
+        centers.append(sample[rng.choice(len(sample), p=p / p.sum())])
+    return np.asarray(centers, dtype=np.float32)
+
+
+def _weighted_means(x: np.ndarray, labels: np.ndarray, w: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    sums = np.zeros((k, x.shape[1]), dtype=np.float64)
+    np.add.at(sums, labels, x * w[:, None])
+    return sums, np.bincount(labels, weights=w, minlength=k)
+
+
+def kmeans(x: np.ndarray, k: int, weights: Optional[np.ndarray] = None,
+           seed: int = _SEED) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    K-means esférico (coseno) sobre filas de norma 1. Devuelve (labels, centroides).
+    - n ≤ 20000: Lloyd completo hasta converger (≤30 iteraciones).
+    - n > 20000: mini-batch (Sculley) con tasa 1/conteo y asignación final por bloques.
+    """
+    n = len(x)
+    w = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+    k = max(1, min(int(k), n))
+    rng = np.random.default_rng(seed)
+    centroids = _init(x, k, w, rng)
+    k = len(centroids)
+    if n <= _FULL_MAX:
+        labels = None
+        for _ in range(_MAX_ITERS):
+            new, _ = _assign(x, centroids)
+            if labels is not None and np.array_equal(new, labels):
+                break
+            labels = new
+            sums, cnt = _weighted_means(x, labels, w, k)
+            keep = cnt > 0
+            centroids[keep] = _l2(sums[keep]).astype(np.float32)
+    else:
+        seen = np.zeros(k)
+        p = w / w.sum()
+        for _ in range(_MINIBATCH_ITERS):
+            idx = rng.choice(n, size=_MINIBATCH, p=p)
+            lab, _ = _assign(x[idx], centroids)
+            sums, cnt = _weighted_means(x[idx], lab, np.ones(len(idx)), k)
+            hit = cnt > 0
+            seen[hit] += cnt[hit]
+            eta = (cnt[hit] / seen[hit])[:, None]
+            centroids[hit] = _l2((1 - eta) * centroids[hit] + eta * sums[hit] / cnt[hit][:, None]).astype(np.float32)
+    labels, _ = _assign(x, centroids)
+    return labels, centroids
+
+
+def auto_k(n: int) -> int:
+    """Regla simple: √(n/2), entre 2 y 30."""
+    return int(min(30, max(2, round(math.sqrt(max(n, 1) / 2)))))
+
+
+# -----------------------------
+# Clusters de reviews
+# -----------------------------
+class ReviewClusters:
+    """
+    Resultado del clustering:
+    - labels: cluster de cada review original (mismo orden que la entrada).
+    - centroids: k × dim (norma 1).
+    - clusters: [{"id", "size", "share", "keywords", "samples"}] ordenados por tamaño.
+    """
+
+    __slots__ = ("labels", "centroids", "clusters")
+
+    def __init__(self, labels: List[int], centroids: np.ndarray, clusters: List[Dict]):
+        self.labels = labels
+        self.centroids = centroids
+        self.clusters = clusters
+
+
+def _keywords(norm: List[str], labels: np.ndarray, weights: np.ndarray, k: int, top: int) -> List[List[str]]:
+    """Palabras más distintivas de cada cluster (frecuencia en el cluster × idf global)."""
+    words = _words(pd.Series(norm, dtype="object"))
+    if words.empty:
+        return [[] for _ in range(k)]
+    df = pd.DataFrame({"c": labels[words.index.to_numpy()], "w": words.to_numpy(),
+                       "n": weights[words.index.to_numpy()]}).drop_duplicates(["c", "w"]).groupby(["c", "w"])["n"].sum()
+    docfreq = df.groupby(level="w").sum()
+    total = float(weights.sum())
+    score = df * np.log1p(total / docfreq.reindex(df.index.get_level_values("w")).to_numpy())
+    out: List[List[str]] = [[] for _ in range(k)]
+    for c, s in score.groupby(level="c"):
+        out[int(c)] = s.nlargest(top).index.get_level_values("w").tolist()
+    return out
+
+
+def cluster_reviews(reviews: List[str], k: Optional[int] = None,
+                    embed: Optional[Callable[[List[str]], np.ndarray]] = None,
+                    samples: int = 5, keywords: int = 8) -> ReviewClusters:
+    """
+    Agrupa todas las reviews en k temas (k=None → CLUSTER_K o automático).
+    - Los duplicados / casi duplicados se embeben una sola vez y pesan por su
+      multiplicidad.
+    - embed: función textos → matriz (None = local_embeddings).
+    """
+    groups = group_reviews([str(r) for r in reviews])
+    reps = groups.representatives
+    weights = np.asarray(groups.weights, dtype=np.float64)
+    if not reps:
+        return ReviewClusters([], np.zeros((0, CLUSTER_EMBED_DIM), dtype=np.float32), [])
+    x = (embed or local_embeddings)(reps)
+    k = int(k or CLUSTER_K or auto_k(len(reps)))
+    labels, centroids = kmeans(x, k, weights)
+    k = len(centroids)
+    _, sims = _assign(x, centroids)
+
+    norm = [normalize_review(r) for r in reps]
+    kw = _keywords(norm, labels, weights, k, keywords)
+    sizes = np.bincount(labels, weights=weights, minlength=k)
+    total = float(weights.sum())
+    clusters = []
+    for c in np.argsort(-sizes):
+        if sizes[c] <= 0:
+            continue
+        members = np.flatnonzero(labels == c)
+        best = members[np.argsort(-sims[members])][:samples]   # más cercanas al centroide
+        clusters.append({
+            "id": int(c),
+            "size": int(sizes[c]),
+            "share": float(sizes[c] / total),
+            "keywords": kw[c],
+            "samples": [reps[i] for i in best],
+        })
+    review_labels = [int(labels[g]) for g in groups.group_of]
+    return ReviewClusters(review_labels, centroids, clusters)
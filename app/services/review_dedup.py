@@ -0,0 +1,191 @@
+# services/review_dedup.py
+# -----------------------------------------------------------------------------
+# Agrupación de reviews duplicadas / casi duplicadas ANTES de llamar al modelo.
+# - Normaliza (minúsculas, sin tildes, sin signos repetidos) y agrupa primero
+#   los duplicados exactos ("Muy bueno!!" == "muy bueno").
+# - Casi duplicados: MinHash sobre 3-gramas de caracteres + LSH por bandas
+#   (REVIEW_DEDUP_BANDS × REVIEW_DEDUP_ROWS) y confirmación con la similitud
+#   de Jaccard estimada ≥ REVIEW_DEDUP_THRESHOLD (defecto 0.8).
+#   Agrupación en estrella: cada review se compara con el representante del
+#   grupo, no con cualquier miembro (sin cadenas A≈B≈C).
+# - Un casi duplicado solo se fusiona si tiene los MISMOS negadores y palabras
+#   con polaridad (feedback.sentiment_cues): "es bueno" y "no es bueno" se
+#   parecen en 3-gramas pero dicen lo contrario.
+# - Un texto que normalizado queda vacío (solo emojis o signos: "👍", "😡",
+#   "!!!") se agrupa solo con copias exactas de su texto original.
+# - ReviewGroups: representantes (uno por grupo, en orden de aparición), peso
+#   de cada grupo (cantidad de miembros) y expand() para devolver a cada review
+#   original la etiqueta de su representante.
+# - REVIEW_DEDUP=0 desactiva la agrupación en feedback_gemini.
+# -----------------------------------------------------------------------------
+
+import os
+import re
+import unicodedata
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .feedback import sentiment_cues
+
+REVIEW_DEDUP = os.getenv("REVIEW_DEDUP", "1").lower() in ("1", "true", "yes")
+REVIEW_DEDUP_THRESHOLD = float(os.getenv("REVIEW_DEDUP_THRESHOLD", "0.8"))
+REVIEW_DEDUP_BANDS = int(os.getenv("REVIEW_DEDUP_BANDS", "16"))
+REVIEW_DEDUP_ROWS = int(os.getenv("REVIEW_DEDUP_ROWS", "4"))
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MASK32 = np.uint64(0xFFFFFFFF)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_SEED = 1234
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_review(text: str) -> str:
+    """Minúsculas, sin tildes (ASCII), signos repetidos colapsados y espacios simples."""
+    t = unicodedata.normalize("NFKD", str(text or "").lower()).encode("ascii", "ignore").decode("ascii")
+    t = _NON_WORD.sub(" ", t)
+    return _SPACES.sub(" ", t).strip()
+
+
+def _shingle_pairs(texts: List[str]):
+    """
+    3-gramas de caracteres de todos los textos (ASCII) en un solo paso NumPy.
+    Devuelve (doc, hash) únicos ordenados por doc; el 3-grama se codifica como
+    b0<<16 | b1<<8 | b2 y se mezcla a 32 bits (hash multiplicativo).
+    """
+    enc = [f" {t} ".ljust(3).encode("ascii") for t in texts]
+    lens = np.fromiter((len(e) for e in enc), dtype=np.int64, count=len(enc))
+    flat = np.frombuffer(b"".join(enc), dtype=np.uint8).astype(np.uint64)
+    codes = (flat[:-2] << np.uint64(16)) | (flat[1:-1] << np.uint64(8)) | flat[2:]
+    doc = np.repeat(np.arange(len(enc), dtype=np.uint64), lens)[:-2]
+    ends = np.cumsum(lens)
+    pos = np.arange(len(codes))
+    valid = pos + 2 < ends[doc.astype(np.int64)]              # el 3-grama no cruza al texto siguiente
+    pairs = np.sort((doc[valid] << np.uint64(24)) | codes[valid])
+    pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]   # únicos por texto
+    mixed = ((pairs & np.uint64(0xFFFFFF)) * _GOLDEN) >> np.uint64(32)   # 3-grama → 32 bits pseudoaleatorios
+    return (pairs >> np.uint64(24)).astype(np.int64), mixed
+
+
+def _signatures(texts: List[str], a: np.ndarray, b: np.ndarray, block: int = 200_000) -> np.ndarray:
+    """
+    Firmas MinHash (n_textos × n_perm, uint32) calculadas por bloques de shingles:
+    (a·x + b) mod p con a, x < 2^32 (el producto cabe en uint64) y mínimo por texto
+    con np.minimum.reduceat.
+    """
+    doc, codes = _shingle_pairs(texts)
+    starts = np.searchsorted(doc, np.arange(len(texts)))      # cada texto tiene ≥1 shingle
+    sigs = np.empty((len(texts), len(a)), dtype=np.uint32)
+    lo = 0
+    while lo < len(texts):
+        hi = int(np.searchsorted(starts, starts[lo] + block, side="right"))
+        hi = max(hi, lo + 1)
+        s0 = starts[lo]
+        s1 = starts[hi] if hi < len(texts) else len(codes)
+        hashed = (a[:, None] * codes[None, s0:s1] + b[:, None]) % _PRIME
+        sigs[lo:hi] = (np.minimum.reduceat(hashed, starts[lo:hi] - s0, axis=1) & _MASK32).T
+        lo = hi
+    return sigs
+
+
+class ReviewGroups:
+    """
+    Resultado de la agrupación:
+    - representatives: textos a enviar al modelo (uno por grupo, orden de aparición).
+    - weights: cantidad de reviews de cada grupo (mismo orden).
+    - group_of: índice de grupo de cada review original.
+    - first: posición (en reviews) del representante de cada grupo.
+    """
+
+    __slots__ = ("reviews", "representatives", "weights", "group_of", "first")
+
+    def __init__(self, reviews: List[str], group_of: List[int]):
+        self.reviews = reviews
+        self.group_of = group_of
+        n_groups = (max(group_of) + 1) if group_of else 0
+        reps: List[Optional[str]] = [None] * n_groups
+        weights = [0] * n_groups
+        self.first = [0] * n_groups
+        for i, g in enumerate(group_of):
+            if reps[g] is None:
+                reps[g] = reviews[i]
+                self.first[g] = i
+            weights[g] += 1
+        self.representatives: List[str] = [r for r in reps if r is not None]
+        self.weights = weights
+
+    @property
+    def duplicates(self) -> int:
+        return len(self.reviews) - len(self.representatives)
+
+    def expand(self, rep_rows: List[Dict], text_of: Callable[[str], str] = lambda s: s) -> List[Dict]:
+        """
+        Una fila por review original (en orden) copiando la fila de su
+        representante; 'review' se reemplaza por el texto propio (text_of).
+        """
+        out: List[Dict] = []
+        for text, g in zip(self.reviews, self.group_of):
+            row = dict(rep_rows[g])
+            row["review"] = text_of(text)
+            out.append(row)
+        return out
+
+
+def group_reviews(reviews: List[str], threshold: float = REVIEW_DEDUP_THRESHOLD,
+                  bands: int = REVIEW_DEDUP_BANDS, rows: int = REVIEW_DEDUP_ROWS) -> ReviewGroups:
+    """
+    Agrupa duplicados exactos (tras normalizar) y casi duplicados (MinHash + LSH)
+    con las mismas señales de sentimiento. threshold ≥ 1 deja solo la agrupación exacta.
+    """
+    reviews = [str(r) for r in reviews]
+    memo: Dict[str, str] = {}
+    norms = [memo[r] if r in memo else memo.setdefault(r, normalize_review(r)) for r in reviews]
+
+    # 1) Duplicados exactos tras normalizar (vacío → texto original)
+    first_of: Dict[Tuple[bool, str], int] = {}
+    uniq: List[int] = []                      # índice (en reviews) de cada texto normalizado único
+    canon = [0] * len(reviews)                # review → posición en 'uniq'
+    for i, t in enumerate(norms):
+        key = (True, t) if t else (False, reviews[i].strip())
+        j = first_of.get(key)
+        if j is None:
+            j = first_of[key] = len(uniq)
+            uniq.append(i)
+        canon[i] = j
+
+    # 2) Casi duplicados entre los únicos (MinHash + LSH por bandas)
+    root = list(range(len(uniq)))             # representante de cada único (agrupación en estrella)
+    if threshold < 1 and len(uniq) > 1:
+        n_perm = bands * rows
+        rng = np.random.default_rng(_SEED)
+        a = rng.integers(1, 1 << 32, size=n_perm, dtype=np.uint64)
+        b = rng.integers(0, 1 << 32, size=n_perm, dtype=np.uint64)
+        sigs = _signatures([norms[i] for i in uniq], a, b)
+        cues = [sentiment_cues(norms[i]) if norms[i] else None for i in uniq]
+        cands: Dict[int, List[int]] = {}
+        for band in range(bands):
+            # Bucket por banda: el candidato de cada texto es el primero de su bucket
+            keys = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+            keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * rows))).ravel()
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            leader = first[inverse.ravel()]
+            cand = np.nonzero(leader != np.arange(len(uniq)))[0]
+            for j, k in zip(cand.tolist(), leader[cand].tolist()):
+                cands.setdefault(j, []).append(k)
+        # Cada texto se une al grupo de un candidato anterior solo si se parece
+        # a su REPRESENTANTE (evita cadenas A≈B≈C que junten textos distintos)
+        for j in sorted(cands):
+            if cues[j] is None:
+                continue
+            for k in dict.fromkeys(root[k] for k in cands[j]):
+                if cues[k] == cues[j] and (sigs[j] == sigs[k]).mean() >= threshold:
+                    root[j] = k
+                    break
+
+    # 3) Grupos numerados por orden de aparición
+    group_ids: Dict[int, int] = {}
+    group_of: List[int] = []
+    for i in range(len(reviews)):
+        group_of.append(group_ids.setdefault(root[canon[i]], len(group_ids)))
+    return ReviewGroups(reviews, group_of)
@@ -0,0 +1,194 @@
+# services/review_ingest.py
+# -----------------------------------------------------------------------------
+# Lectura de exports de reviews (CSV/TSV, Parquet, JSONL) con memoria acotada.
+# - El formato se detecta por extensión y "magic bytes" (PAR1 = Parquet,
+#   '{' al inicio = JSONL); el dialecto CSV (separador, comillas) y la
+#   codificación (UTF-8 / Latin-1 de Excel) se detectan con los primeros KB,
+#   sin leer el archivo entero.
+# - iter_text_column: lee por bloques (motor C de pandas / iter_batches de
+#   pyarrow) SOLO la columna de texto elegida y devuelve listas de str.
+# - preview: columnas + primeras filas para la UI. En JSONL cada registro puede
+#   traer claves distintas: las columnas salen de los primeros
+#   INGEST_SAMPLE_ROWS registros (no solo del primero) y un bloque sin la
+#   columna elegida se lee como vacío.
+# - Acepta rutas o archivos abiertos en binario (p. ej., UploadedFile de Streamlit).
+# - Config por .env:
+#     * INGEST_CHUNK_ROWS  → filas por bloque (defecto 100000)
+#     * INGEST_SNIFF_BYTES → bytes usados para detectar el dialecto (defecto 65536)
+#     * INGEST_SAMPLE_ROWS → filas leídas para descubrir columnas (defecto 1000)
+# Parquet requiere pyarrow (en requirements.txt); sin él, parquet_available()
+# devuelve False y la página rechaza el archivo con un mensaje claro.
+# -----------------------------------------------------------------------------
+
+import os
+import csv
+from typing import IO, Iterator, List, Optional, Tuple, Union
+
+import pandas as pd
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "100000"))
+INGEST_SNIFF_BYTES = int(os.getenv("INGEST_SNIFF_BYTES", "65536"))
+INGEST_SAMPLE_ROWS = int(os.getenv("INGEST_SAMPLE_ROWS", "1000"))
+
+_DELIMITERS = ",;\t|"
+Source = Union[str, os.PathLike, IO[bytes]]
+
+
+# -----------------------------
+# Detección de formato y dialecto
+# -----------------------------
+def _name(src: Source) -> str:
+    return str(getattr(src, "name", src) or "").lower()
+
+
+def _head(src: Source, n: int) -> bytes:
+    """Primeros n bytes sin consumir el archivo (rebobina si es un objeto)."""
+    if isinstance(src, (str, os.PathLike)):
+        with open(src, "rb") as f:
+            return f.read(n)
+    src.seek(0)
+    data = src.read(n)
+    src.seek(0)
+    return data
+
+
+def detect_format(src: Source) -> str:
+    """'parquet' | 'jsonl' | 'csv'."""
+    name = _name(src)
+    head = _head(src, 4096)
+    if name.endswith(".parquet") or head[:4] == b"PAR1":
+        return "parquet"
+    if name.endswith((".jsonl", ".ndjson")) or head.lstrip(b"\xef\xbb\xbf \r\n\t")[:1] == b"{":
+        return "jsonl"
+    return "csv"
+
+
+def _encoding(head: bytes) -> str:
+    if head.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 4:          # no es solo un carácter cortado al final del bloque
+            return "latin-1"
+    return "utf-8"
+
+
+def sniff_csv(src: Source) -> Tuple[str, str, str]:
+    """(separador, comilla, codificación) a partir de los primeros INGEST_SNIFF_BYTES."""
+    head = _head(src, INGEST_SNIFF_BYTES)
+    enc = _encoding(head)
+    text = head.decode(enc, errors="ignore")
+    text = text[: text.rfind("\n") + 1] or text            # solo líneas completas
+    try:
+        d = csv.Sniffer().sniff(text, delimiters=_DELIMITERS)
+        return d.delimiter, d.quotechar or '"', enc
+    except csv.Error:
+        first = text.splitlines()[0] if text else ""
+        return max(_DELIMITERS, key=first.count) if first else ",", '"', enc
+
+
+# -----------------------------
+# Lectura por bloques
+# -----------------------------
+def _csv_reader(src: Source, chunksize: int, usecols=None, nrows: Optional[int] = None):
+    sep, quote, enc = sniff_csv(src)
+    if not isinstance(src, (str, os.PathLike)):
+        src.seek(0)
+    return pd.read_csv(
+        src, sep=sep, quotechar=quote, encoding=enc, engine="c", dtype=str,
+        usecols=usecols, chunksize=chunksize, nrows=nrows, on_bad_lines="skip",
+        encoding_errors="replace",
+    )
+
+
+PARQUET_MISSING = "Para leer Parquet instala pyarrow: pip install pyarrow"
+
+
+def parquet_available() -> bool:
+    """True si pyarrow está instalado (lectura de Parquet)."""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _parquet_file(src: Source):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(PARQUET_MISSING) from e
+    if not isinstance(src, (str, os.PathLike)):
+        src.seek(0)
+    return pq.ParquetFile(src)
+
+
+def _iter_frames(src: Source, column: Optional[str], chunksize: int,
+                 nrows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    fmt = detect_format(src)
+    if fmt == "parquet":
+        pf = _parquet_file(src)
+        for batch in pf.iter_batches(batch_size=chunksize, columns=[column] if column else None):
+            yield batch.to_pandas()
+        return
+    if fmt == "jsonl":
+        if not isinstance(src, (str, os.PathLike)):
+            src.seek(0)
+        with pd.read_json(src, lines=True, chunksize=chunksize, dtype=False, nrows=nrows,
+                          encoding="utf-8", encoding_errors="replace") as reader:
+            for df in reader:
+                yield df.reindex(columns=[column]) if column else df   # bloque sin la clave → NaN
+        return
+    usecols = [column] if column else None
+    with _csv_reader(src, chunksize, usecols, nrows) as reader:
+        yield from reader
+
+
+def _resolve(columns: List[str], column: str) -> str:
+    """Nombre real de la columna (la UI los muestra en minúsculas y sin espacios)."""
+    if column in columns:
+        return column
+    for c in columns:
+        if str(c).strip().lower() == column:
+            return c
+    raise KeyError(f"Columna '{column}' no encontrada")
+
+
+def _sample(src: Source, n: int = INGEST_SAMPLE_ROWS) -> pd.DataFrame:
+    """Primeras n filas con los nombres de columna originales (unión de claves en JSONL)."""
+    return next(_iter_frames(src, None, max(1, n), nrows=max(1, n)), pd.DataFrame())
+
+
+def preview(src: Source, n: int = 5) -> pd.DataFrame:
+    """
+    Primeras n filas con columnas normalizadas (minúsculas, sin espacios extremos);
+    las columnas son las de la muestra de INGEST_SAMPLE_ROWS filas.
+    """
+    df = _sample(src, max(n, INGEST_SAMPLE_ROWS)).head(n)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+
+def iter_text_column(src: Source, column: str, chunksize: int = INGEST_CHUNK_ROWS) -> Iterator[List[str]]:
+    """
+    Bloques de textos no vacíos de 'column' (acepta el nombre normalizado de preview).
+    Memoria acotada por 'chunksize' filas de una sola columna.
+    """
+    real = _resolve([str(c) for c in _sample(src).columns], column)
+    for df in _iter_frames(src, real, chunksize):
+        s = df[real].dropna().astype(str)
+        s = s[s.str.strip() != ""]
+        if len(s):
+            yield s.tolist()
+
+
+def read_text_column(src: Source, column: str, limit: Optional[int] = None,
+                     chunksize: int = INGEST_CHUNK_ROWS) -> List[str]:
+    """Todos los textos de 'column' (o los primeros 'limit'), leídos por bloques."""
+    out: List[str] = []
+    for block in iter_text_column(src, column, chunksize):
+        out.extend(block)
+        if limit is not None and len(out) >= limit:
+            return out[:limit]
+    return out
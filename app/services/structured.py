@@ -0,0 +1,147 @@
+# services/structured.py
+# -----------------------------------------------------------------------------
+# Salida estructurada (JSON + response_schema) para los servicios de Gemini.
+# - json_config: GenerateContentConfig con response_mime_type="application/json"
+#   y un esquema que describe la forma exacta esperada; el modelo queda obligado
+#   a devolver JSON válido, sin backticks ni texto extra.
+# - parse_json: camino rápido (json.loads directo) y, solo si falla, el extractor
+#   por regex de siempre como respaldo.
+# - Contadores por tipo de llamada (structured / fallback / failed) para medir
+#   cuántas respuestas siguen necesitando el respaldo o terminan en fallback.
+# - IncrementalJSONObject: parser incremental para respuestas en streaming
+#   (entrega cada campo de primer nivel apenas se cierra).
+# - GEMINI_STRUCTURED_OUTPUT=0 desactiva el esquema (p. ej., modelos antiguos).
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional
+
+STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1").lower() in ("1", "true", "yes")
+
+_COUNTS: Dict[str, Dict[str, int]] = defaultdict(lambda: {"structured": 0, "fallback": 0, "failed": 0})
+_LOCK = threading.Lock()
+
+
+def json_config(schema: Optional[Dict[str, Any]] = None, **sampling):
+    """
+    Construye GenerateContentConfig pidiendo JSON con el esquema indicado.
+    Si el SDK instalado no acepta response_schema, cae a la config sin esquema.
+    """
+    from google.genai import types
+    if STRUCTURED_OUTPUT and schema is not None:
+        try:
+            return types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=schema,
+                **sampling,
+            )
+        except Exception:
+            pass
+    return types.GenerateContentConfig(**sampling)
+
+
+def _record(kind: str, outcome: str) -> None:
+    with _LOCK:
+        _COUNTS[kind][outcome] += 1
+
+
+def parse_json(text: str, extract: Callable[[str], Any], kind: str, expect: type = dict) -> Any:
+    """
+    Parsea la respuesta del modelo:
+    1) json.loads directo (lo normal con salida estructurada) → "structured".
+    2) extractor por regex (fences ```json, primer {...}/[...]) → "fallback".
+    3) si nada funciona, cuenta "failed" y lanza ValueError.
+    """
+    try:
+        data = json.loads(text)
+        if isinstance(data, expect):
+            _record(kind, "structured")
+            return data
+    except ValueError:
+        pass
+    try:
+        data = extract(text)
+        if isinstance(data, expect):
+            _record(kind, "fallback")
+            return data
+    except Exception:
+        pass
+    _record(kind, "failed")
+    raise ValueError(f"No se pudo extraer JSON ({kind})")
+
+
+def parse_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Contadores por tipo de llamada, p. ej.:
+    {"sentiment": {"structured": 40, "fallback": 1, "failed": 0, "total": 41, "failure_rate": 0.0}}
+    """
+    with _LOCK:
+        snap = {k: dict(v) for k, v in _COUNTS.items()}
+    for v in snap.values():
+        v["total"] = v["structured"] + v["fallback"] + v["failed"]
+        v["failure_rate"] = (v["failed"] / v["total"]) if v["total"] else 0.0
+    return snap
+
+
+class IncrementalJSONObject:
+    """
+    Parser incremental para el objeto JSON de primer nivel que llega por streaming.
+    - feed(chunk) devuelve solo los campos de primer nivel que se COMPLETARON con
+      ese chunk (p. ej., {"short": "..."}), ya decodificados con json.loads.
+    - Ignora texto previo a la primera '{' (p. ej., un fence ```json).
+    - Recorre cada carácter una sola vez: costo lineal sobre el total recibido.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0            # siguiente carácter por examinar
+        self.depth = 0          # profundidad de {}/[] fuera de strings
+        self.in_str = False
+        self.escape = False
+        self.seg_start = -1     # inicio del par "clave": valor en curso (nivel 1)
+        self.fields: Dict[str, Any] = {}
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        self.buf += chunk or ""
+        done: Dict[str, Any] = {}
+        buf = self.buf
+        for i in range(self.pos, len(buf)):
+            ch = buf[i]
+            if self.in_str:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_str = False
+                continue
+            if ch == '"':
+                if self.depth >= 1:
+                    self.in_str = True
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.seg_start = i + 1
+            elif ch in "}]":
+                if self.depth == 1:
+                    done.update(self._close_segment(buf[self.seg_start:i]))
+                self.depth = max(0, self.depth - 1)
+            elif ch == "," and self.depth == 1:
+                done.update(self._close_segment(buf[self.seg_start:i]))
+                self.seg_start = i + 1
+        self.pos = len(buf)
+        self.fields.update(done)
+        return done
+
+    @staticmethod
+    def _close_segment(segment: str) -> Dict[str, Any]:
+        if not segment.strip():
+            return {}
+        try:
+            val = json.loads("{" + segment + "}")
+        except ValueError:
+            return {}
+        return val if isinstance(val, dict) else {}
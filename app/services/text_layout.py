@@ -0,0 +1,87 @@
+# services/text_layout.py
+# -----------------------------------------------------------------------------
+# Maquetado de texto para las creatividades (titular, subtítulo y CTA).
+# - font(face, size): cada fuente TrueType se carga del disco una sola vez por
+#   (archivo, tamaño) y se reutiliza entre creatividades y reruns.
+# - text_width: ancho de un fragmento memoizado por (fuente, tamaño, texto).
+# - wrap_lines: partición greedy en líneas que mide cada palabra UNA vez (con su
+#   espacio previo, así el ancho de la línea es la suma de anchos) en vez de
+#   re-medir la línea completa que va creciendo; el resultado se cachea por
+#   (texto, fuente, tamaño, ancho de caja), así variantes y re-renders con la
+#   misma copy no vuelven a medir.
+# - FreeType no es seguro para usar la misma fuente desde varios hilos a la
+#   vez: medir y dibujar pasa por text_lock() (el compositor corre en paralelo).
+# Variables de entorno:
+#     * TEXT_LAYOUT_CACHE → maquetados en caché (defecto 1024)
+# -----------------------------------------------------------------------------
+
+import os
+import threading
+from functools import lru_cache
+from typing import Tuple
+
+from PIL import ImageFont
+
+TEXT_LAYOUT_CACHE = int(os.getenv("TEXT_LAYOUT_CACHE", "1024"))
+
+FACE_BOLD = "DejaVuSans-Bold.ttf"
+FACE_REGULAR = "DejaVuSans.ttf"
+
+_FT_LOCK = threading.RLock()
+
+
+def text_lock() -> threading.RLock:
+    """Lock compartido para medir/dibujar con fuentes FreeType desde varios hilos."""
+    return _FT_LOCK
+
+
+@lru_cache(maxsize=64)
+def font(face: str, size: int):
+    """Fuente TrueType cacheada por (archivo, tamaño); fuente por defecto si no existe."""
+    try:
+        return ImageFont.truetype(face, int(size))
+    except Exception:
+        return ImageFont.load_default()
+
+
+def line_height(fnt) -> int:
+    return fnt.size + 6 if hasattr(fnt, "size") else 22
+
+
+@lru_cache(maxsize=65536)
+def text_width(face: str, size: int, text: str) -> float:
+    """Ancho en px de 'text' con la fuente (face, size), memoizado."""
+    with _FT_LOCK:
+        return font(face, size).getlength(text)
+
+
+@lru_cache(maxsize=TEXT_LAYOUT_CACHE)
+def wrap_lines(text: str, face: str, size: int, max_w: int) -> Tuple[str, ...]:
+    """
+    Líneas de 'text' que entran en max_w px (greedy por palabras, como antes).
+    Una palabra más ancha que la caja queda sola en su línea.
+    """
+    lines, cur, cur_w = [], [], 0.0
+    for w in (text or "").split():
+        if not cur:
+            cur, cur_w = [w], text_width(face, size, w)
+            continue
+        add = text_width(face, size, " " + w)        # la palabra con su espacio previo, medida una vez
+        if cur_w + add <= max_w:
+            cur.append(w)
+            cur_w += add
+        else:
+            lines.append(" ".join(cur))
+            cur, cur_w = [w], text_width(face, size, w)
+    if cur:
+        lines.append(" ".join(cur))
+    return tuple(lines)
+
+
+def cache_info() -> dict:
+    """Aciertos de las cachés (fuentes, anchos, maquetados)."""
+    return {
+        "fonts": font.cache_info()._asdict(),
+        "widths": text_width.cache_info()._asdict(),
+        "layouts": wrap_lines.cache_info()._asdict(),
+    }
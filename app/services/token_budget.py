@@ -0,0 +1,215 @@
+# services/token_budget.py
+# -----------------------------------------------------------------------------
+# Presupuesto de tokens para las llamadas a Gemini.
+# - Estimación de entrada: local (≈3.6 caracteres por token en español y 258
+#   tokens por imagen); si la estimación se acerca al límite del modelo se
+#   confirma con client.models.count_tokens (un round-trip solo cuando importa).
+# - Límite de salida automático según la cantidad de ítems y la longitud
+#   esperada de sus campos (OUTPUT_TOKENS_PER_ITEM), en vez de sliders fijos.
+# - chunk_by_tokens / split_for_budget: parten una lista de ítems en lotes que
+#   entran en el presupuesto de salida/entrada; check_request rechaza (BudgetExceeded)
+#   lo que no entra ANTES de enviarlo. clip_to_tokens recorta un ítem suelto
+#   que no cabe en un lote.
+# - record_usage / usage_stats: estimado vs. real (usage_metadata) por tipo de
+#   llamada, incluidas las respuestas cortadas por MAX_TOKENS.
+# - Config por .env:
+#     * GEMINI_MAX_INPUT_TOKENS   → ventana de entrada del modelo (defecto 1048576)
+#     * GEMINI_MAX_OUTPUT_TOKENS  → tope de salida por request (defecto 8192)
+# -----------------------------------------------------------------------------
+
+import os
+import math
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+MAX_INPUT_TOKENS = int(os.getenv("GEMINI_MAX_INPUT_TOKENS", "1048576"))
+MAX_OUTPUT_TOKENS = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "8192"))
+
+_CHARS_PER_TOKEN = 3.6          # español con tildes: algo menos de 4
+_IMAGE_TOKENS = 258             # costo fijo por imagen ≤768 px (ver image_prep.py)
+_REMOTE_COUNT_FROM = 0.5        # confirmar con count_tokens desde el 50% del límite
+
+# Tokens de salida esperados por ítem (campos + sintaxis JSON)
+OUTPUT_TOKENS_PER_ITEM = {
+    "sentiment": 96,            # review ≤160c + rationale breve + claves
+    "sentiment_compact": 24,    # {"i","s","r"} con motivo ≤8 palabras
+    "sentiment_ids": 8,         # [id, código]
+    "description": 480,         # short 160c + long 600c + 4–6 bullets + 5–8 hashtags
+    "summary": 640,             # bullets + recomendación + plan + respuesta
+    "reply": 224,               # 3–6 oraciones
+    "reply_opener": 48,         # {"i","opener"} con 1 frase ≤25 palabras
+    "theme": 112,               # id + etiqueta ≤5 palabras + resumen 1 frase + acción
+}
+_OVERHEAD = 32                  # llaves/corchetes del JSON externo
+_MARGIN = 1.25                  # holgura frente a respuestas más largas de lo normal
+
+log = logging.getLogger(__name__)
+
+
+class BudgetExceeded(ValueError):
+    """La request no entra en la ventana del modelo aunque se parta."""
+
+
+# -----------------------------
+# Estimación de entrada
+# -----------------------------
+def estimate_tokens(text: str) -> int:
+    return int(math.ceil(len(text or "") / _CHARS_PER_TOKEN))
+
+
+def clip_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta 'text' para que su estimación no pase de max_tokens (añade '…' si recorta)."""
+    text = text or ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max(0, int(max_tokens * _CHARS_PER_TOKEN) - 1)
+    return text[:keep] + "…"
+
+
+def estimate_contents_tokens(contents) -> int:
+    """Estimación local para contents (str, lista de Content/Part o mezcla)."""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_contents_tokens(c) for c in contents)
+    parts = getattr(contents, "parts", None)
+    if parts is not None:
+        return sum(estimate_contents_tokens(p) for p in parts)
+    if getattr(contents, "inline_data", None) is not None:
+        return _IMAGE_TOKENS
+    return estimate_tokens(getattr(contents, "text", None) or "")
+
+
+def count_input_tokens(contents, client=None, model: Optional[str] = None) -> int:
+    """
+    Tokens de entrada: estimación local y, si está cerca del límite y hay
+    cliente, el conteo exacto de count_tokens (con fallback a la estimación).
+    """
+    est = estimate_contents_tokens(contents)
+    if client is None or not model or est < MAX_INPUT_TOKENS * _REMOTE_COUNT_FROM:
+        return est
+    try:
+        return int(client.models.count_tokens(model=model, contents=contents).total_tokens or est)
+    except Exception:
+        return est
+
+
+# -----------------------------
+# Presupuesto de salida y partición
+# -----------------------------
+def output_budget(kind: str, n_items: int = 1, cap: Optional[int] = None) -> int:
+    """Límite de salida para n ítems de 'kind' (múltiplo de 64, acotado a cap)."""
+    per = OUTPUT_TOKENS_PER_ITEM.get(kind, 256)
+    need = int(math.ceil((max(1, n_items) * per + _OVERHEAD) * _MARGIN))
+    need = int(math.ceil(need / 64.0) * 64)
+    return min(need, int(cap or MAX_OUTPUT_TOKENS))
+
+
+def items_per_request(kind: str, cap: Optional[int] = None) -> int:
+    """Cuántos ítems de 'kind' caben en un request con salida ≤ cap."""
+    per = OUTPUT_TOKENS_PER_ITEM.get(kind, 256)
+    usable = int(cap or MAX_OUTPUT_TOKENS) / _MARGIN - _OVERHEAD
+    return max(1, int(usable // per))
+
+
+def chunk_by_tokens(items: Sequence[Any], max_tokens: int, max_items: Optional[int] = None,
+                    text_of: Callable[[Any], str] = str) -> List[List[Any]]:
+    """
+    Parte 'items' (en orden) en lotes de como máximo 'max_tokens' de entrada
+    estimados y, opcionalmente, 'max_items' ítems por lote.
+    Un ítem que por sí solo excede 'max_tokens' lanza BudgetExceeded.
+    """
+    chunks: List[List[Any]] = []
+    cur: List[Any] = []
+    cur_in = 0
+    for it in items:
+        t = estimate_tokens(text_of(it))
+        if t > max_tokens:
+            raise BudgetExceeded(f"Un ítem ({t} tokens) excede el lote de entrada ({max_tokens}).")
+        if cur and ((max_items and len(cur) >= max_items) or cur_in + t > max_tokens):
+            chunks.append(cur)
+            cur, cur_in = [], 0
+        cur.append(it)
+        cur_in += t
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+def split_for_budget(items: Sequence[Any], kind: str, max_output: Optional[int] = None,
+                     max_input: Optional[int] = None, max_items: Optional[int] = None,
+                     text_of: Callable[[Any], str] = str) -> List[List[Any]]:
+    """
+    Parte 'items' (en orden) en lotes que respetan el tope de salida (por
+    cantidad de ítems), el de entrada (por tokens estimados de cada ítem) y,
+    si se indica, un tamaño de lote fijo (max_items).
+    """
+    in_cap = int(max_input or MAX_INPUT_TOKENS * 0.8)   # margen para el prefijo del prompt
+    per_req = items_per_request(kind, max_output)
+    if max_items:
+        per_req = min(per_req, int(max_items))
+    return chunk_by_tokens(items, in_cap, per_req, text_of)
+
+
+def check_request(contents, max_output_tokens: Optional[int], client=None,
+                  model: Optional[str] = None) -> int:
+    """
+    Valida la request antes de enviarla; devuelve los tokens de entrada estimados.
+    Lanza BudgetExceeded si la entrada (o entrada + salida) no entra.
+    """
+    n_in = count_input_tokens(contents, client, model)
+    if n_in + int(max_output_tokens or 0) > MAX_INPUT_TOKENS:
+        raise BudgetExceeded(
+            f"Request de ~{n_in} tokens de entrada + {max_output_tokens} de salida "
+            f"excede la ventana del modelo ({MAX_INPUT_TOKENS})."
+        )
+    return n_in
+
+
+# -----------------------------
+# Estimado vs. real
+# -----------------------------
+_USAGE: Dict[str, Dict[str, int]] = defaultdict(lambda: {
+    "calls": 0, "est_input": 0, "input": 0, "budget_output": 0, "output": 0, "truncated": 0,
+})
+_LOCK = threading.Lock()
+
+
+def record_usage(kind: str, est_input: int, budget_output: Optional[int], resp) -> None:
+    """Registra estimado vs. real (usage_metadata) de una respuesta."""
+    um = getattr(resp, "usage_metadata", None)
+    actual_in = int(getattr(um, "prompt_token_count", 0) or 0)
+    actual_out = int(getattr(um, "candidates_token_count", 0) or 0)
+    truncated = False
+    for cand in getattr(resp, "candidates", None) or []:
+        reason = getattr(cand, "finish_reason", None)
+        if reason is not None and "MAX_TOKENS" in str(reason):
+            truncated = True
+    with _LOCK:
+        u = _USAGE[kind]
+        u["calls"] += 1
+        u["est_input"] += int(est_input or 0)
+        u["input"] += actual_in
+        u["budget_output"] += int(budget_output or 0)
+        u["output"] += actual_out
+        u["truncated"] += int(truncated)
+    log.debug("%s: entrada est=%s real=%s; salida presupuesto=%s real=%s%s", kind, est_input,
+              actual_in, budget_output, actual_out, " (MAX_TOKENS)" if truncated else "")
+
+
+def usage_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Totales por tipo de llamada, p. ej.:
+    {"sentiment": {"calls": 4, "est_input": 9100, "input": 8800, "budget_output": 8192,
+                   "output": 5300, "truncated": 0, "input_error": 0.034, "output_use": 0.65}}
+    """
+    with _LOCK:
+        snap = {k: dict(v) for k, v in _USAGE.items()}
+    for v in snap.values():
+        v["input_error"] = ((v["est_input"] - v["input"]) / v["input"]) if v["input"] else 0.0
+        v["output_use"] = (v["output"] / v["budget_output"]) if v["budget_output"] else 0.0
+    return snap
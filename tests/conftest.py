@@ -0,0 +1,5 @@
+# Los servicios se importan como en las páginas de Streamlit: "services.X" con app/ en el path.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
@@ -0,0 +1,44 @@
+import pytest
+
+from services.feedback import UNCLASSIFIED, lexicon_sentiment, sentiment_distribution
+
+# Umbral por defecto con el que feedback_gemini resuelve localmente (SENTIMENT_LOCAL_MIN_CONFIDENCE)
+LOCAL_MIN_CONFIDENCE = 0.5
+
+
+def _one(text):
+    return lexicon_sentiment([text]).iloc[0]
+
+
+@pytest.mark.parametrize("text, label", [
+    ("bien malo", "negativo"),              # "bien" intensifica: muy malo
+    ("Bien malo!!", "negativo"),
+    ("bien bueno el servicio", "positivo"),
+    ("sin duda lo mejor", "positivo"),      # frase hecha, no niega
+    ("sin dudas el mejor", "positivo"),
+    ("muy bien", "positivo"),
+    ("todo bien", "positivo"),
+    ("no es bueno", "negativo"),
+    ("llego sin problemas", "positivo"),    # "sin" sigue negando fuera de las frases hechas
+])
+def test_lexicon_labels(text, label):
+    assert _one(text)["sentiment"] == label
+
+
+@pytest.mark.parametrize("text, wrong", [("bien malo", "neutral"), ("sin duda lo mejor", "negativo")])
+def test_cascade_does_not_settle_wrong_label_locally(text, wrong):
+    row = _one(text)
+    assert not (row["sentiment"] == wrong and row["confidence"] >= LOCAL_MIN_CONFIDENCE)
+
+
+def test_empty_reviews_are_neutral_without_evidence():
+    rows = lexicon_sentiment(["", ""])
+    assert rows["sentiment"].tolist() == ["neutral", "neutral"]
+    assert (rows["confidence"] < LOCAL_MIN_CONFIDENCE).all()
+
+
+def test_distribution_leaves_unclassified_out_of_ratio():
+    dist = sentiment_distribution(["positivo", "negativo", UNCLASSIFIED, {"sentiment": UNCLASSIFIED}])
+    assert dist["total"] == 2
+    assert dist["unclassified"] == 2
+    assert dist["ratio"]["positivo"] == 0.5
@@ -0,0 +1,17 @@
+from services.label_store import LabelStore, label_key
+
+
+def test_key_folds_case_and_whitespace_only():
+    assert label_key("v1", "Muy  Bueno ") == label_key("v1", "muy bueno")
+    assert label_key("v1", "muy bueno!!") != label_key("v1", "muy bueno")
+
+
+def test_emoji_and_non_latin_reviews_get_their_own_key():
+    keys = {label_key("v1", r) for r in ("👍", "😡", "!!!", "很好", "")}
+    assert len(keys) == 5
+
+
+def test_labels_do_not_leak_between_emoji_reviews(tmp_path):
+    store = LabelStore(str(tmp_path / "labels.sqlite3"))
+    store.put_many("v1", ["👍"], [{"sentiment": "positivo", "rationale": ""}])
+    assert store.get_many("v1", ["😡", "👍"]) == {1: {"sentiment": "positivo", "rationale": ""}}
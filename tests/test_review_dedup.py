@@ -0,0 +1,32 @@
+import pytest
+
+from services.review_dedup import group_reviews
+
+
+@pytest.mark.parametrize("a, b", [
+    ("la entrega fue rapida y el producto es bueno",
+     "la entrega no fue rapida y el producto no es bueno"),
+    ("me gusto mucho el producto, lo recomiendo a todos mis amigos",
+     "no me gusto mucho el producto, no lo recomiendo a todos mis amigos"),
+    ("Muy bueno", "no muy bueno"),
+])
+def test_opposite_meaning_is_not_merged(a, b):
+    assert group_reviews([a, b]).group_of == [0, 1]
+
+
+@pytest.mark.parametrize("a, b", [("👍", "😡"), ("!!!", "👍"), ("😡", "...")])
+def test_empty_normalized_texts_are_not_grouped(a, b):
+    assert group_reviews([a, b]).group_of == [0, 1]
+
+
+def test_empty_normalized_exact_copies_still_group():
+    g = group_reviews(["👍", "😡", "👍"])
+    assert g.group_of == [0, 1, 0]
+    assert g.weights == [2, 1]
+
+
+def test_near_duplicates_with_same_cues_merge():
+    a = "la entrega fue rapida y el producto es bueno, volveria a comprar en esta tienda sin pensarlo dos veces"
+    g = group_reviews([a, a + " la verdad", "Muy bueno!!", "muy bueno"])
+    assert g.group_of == [0, 0, 1, 1]
+    assert g.weights == [2, 2]
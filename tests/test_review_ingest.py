@@ -0,0 +1,26 @@
+import io
+
+from services.review_ingest import iter_text_column, preview, read_text_column
+
+
+def _upload(text, name):
+    f = io.BytesIO(text.encode("utf-8"))
+    f.name = name
+    return f
+
+
+JSONL = '{"id":1}\n{"id":2}\n{"id":3,"Review":"hola"}\n{"id":4,"Review":"chau"}\n'
+
+
+def test_jsonl_column_missing_from_first_records():
+    assert list(preview(_upload(JSONL, "r.jsonl")).columns) == ["id", "review"]
+    assert read_text_column(_upload(JSONL, "r.jsonl"), "review") == ["hola", "chau"]
+
+
+def test_jsonl_chunk_without_the_column_is_empty():
+    blocks = list(iter_text_column(_upload(JSONL, "r.jsonl"), "review", chunksize=1))
+    assert blocks == [["hola"], ["chau"]]
+
+
+def test_csv_skips_empty_texts():
+    assert read_text_column(_upload("a,Review\n1,x\n2,\n3,y\n", "r.csv"), "review") == ["x", "y"]
@@ -0,0 +1,13 @@
+from services.token_budget import chunk_by_tokens, clip_to_tokens, estimate_tokens
+
+
+def test_clip_keeps_short_text():
+    assert clip_to_tokens("hola", 10) == "hola"
+
+
+def test_clipped_item_fits_its_chunk():
+    long = "x" * 120_000
+    clipped = clip_to_tokens(long, 24_000)
+    assert clipped.endswith("…")
+    assert estimate_tokens(clipped) <= 24_000
+    assert chunk_by_tokens([clipped, "corta"], 24_000) == [[clipped], ["corta"]]